@@ -1,21 +1,36 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory, g, session, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, send_from_directory, g, session, redirect, url_for, flash, Response, stream_with_context
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, Length
-from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import os
+import codecs
+import shutil
+import tempfile
+import click
+import time
 import secrets
-import smtplib
 from email.message import EmailMessage
 
 from itsdangerous import URLSafeTimedSerializer
-from datetime import datetime, timedelta
-import pytz  # for timezone handling
 # use env file for sensitive info in production
 from dotenv import load_dotenv
 from flask_babel import Babel, lazy_gettext as _
 
+import db
+import instrumentation
+import tree_columns
+from tree_indent import indent_rows
+from tree_io import FORMATS, export_trees, guess_format, import_trees
+from snapshot_cache import SnapshotCache
+import mail_outbox
+import passwords
+import sweeper
+import tree_check
+import tree_engine
+from tree_search import search_nodes
+import write_queue
+
 load_dotenv()
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
@@ -30,14 +45,104 @@ app.secret_key = os.getenv("SECRET_KEY") or 'dev_key'
 
 # Email configuration (update these with your SMTP settings)
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
-app.config['MAIL_PORT'] = os.getenv('MAIL_PORT')
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', '1').lower() in ('1', 'true', 'yes')
 app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 
-# Timezone configuration
-app.config['TIMEZONE'] = os.getenv('TIMEZONE', 'UTC')
+# Send queued email from a thread in each app process ('thread'), or only
+# from a separate `flask mail worker` process ('process')
+app.config['MAIL_WORKER'] = os.getenv('MAIL_WORKER', 'thread')
+# Messages sent over one SMTP connection before the outbox is checked again
+app.config['MAIL_BATCH_SIZE'] = int(os.getenv('MAIL_BATCH_SIZE', 50))
+# Seconds between outbox checks when nothing is due
+app.config['MAIL_POLL_INTERVAL'] = float(os.getenv('MAIL_POLL_INTERVAL', 5))
+# Attempts before a message is marked failed; the nth retry waits MAIL_RETRY_BACKOFF * 2**(n-1) seconds
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.getenv('MAIL_MAX_ATTEMPTS', 8))
+app.config['MAIL_RETRY_BACKOFF'] = float(os.getenv('MAIL_RETRY_BACKOFF', 30))
+# Seconds an idle SMTP connection is kept open, and the timeout for each SMTP command
+app.config['MAIL_IDLE_TIMEOUT'] = float(os.getenv('MAIL_IDLE_TIMEOUT', 60))
+app.config['MAIL_TIMEOUT'] = float(os.getenv('MAIL_TIMEOUT', 30))
+
+# Seconds between sweeps of expired tokens by each app process; 0 disables them
+app.config['TOKEN_SWEEP_INTERVAL'] = float(os.getenv('TOKEN_SWEEP_INTERVAL', 3600))
+# Rows deleted per sweeper transaction
+app.config['SWEEP_BATCH_SIZE'] = int(os.getenv('SWEEP_BATCH_SIZE', 1000))
+
+# Werkzeug method string for new password hashes; stored hashes with other
+# parameters are replaced at the next login. Time candidates with `flask passwords benchmark`.
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_SALT_LENGTH'] = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+# Processes that hash and verify passwords off the request threads; 0 hashes in the request thread
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+
+# SQLite connection settings, applied to every connection by db.py
+app.config['DATABASE'] = os.getenv('DATABASE', 'app.db')
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+# Negative values are KiB, positive values are pages
+app.config['SQLITE_CACHE_SIZE'] = int(os.getenv('SQLITE_CACHE_SIZE', -64000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_TEMP_STORE'] = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')
+# New database files return freed pages with `flask db prune` instead of only on VACUUM
+app.config['SQLITE_AUTO_VACUUM'] = os.getenv('SQLITE_AUTO_VACUUM', 'INCREMENTAL')
+# Milliseconds a connection waits for a lock before raising "database is locked"
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+
+# Apply pending migrations on the first request instead of refusing to serve
+app.config['DB_AUTO_UPGRADE'] = os.getenv('DB_AUTO_UPGRADE', '0').lower() in ('1', 'true', 'yes')
+
+# Maximum number of nodes returned by one page of the tree endpoints
+app.config['TREE_PAGE_SIZE'] = int(os.getenv('TREE_PAGE_SIZE', 1000))
+
+# Spacing between lft/rgt values for new trees; 0 keeps numbering contiguous
+app.config['TREE_GAP'] = int(os.getenv('TREE_GAP', 0))
+
+# Memory cap for encoded tree responses kept by snapshot_cache; 0 disables it
+app.config['SNAPSHOT_CACHE_BYTES'] = int(os.getenv('SNAPSHOT_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Maximum number of operations accepted by one /api/operations/batch request
+app.config['TREE_BATCH_SIZE'] = int(os.getenv('TREE_BATCH_SIZE', 10000))
+
+# /api/search ranks at most this many matches of a query (see tree_search.search_nodes)
+app.config['SEARCH_RANK_LIMIT'] = int(os.getenv('SEARCH_RANK_LIMIT', 10000))
+
+# How moves and deletes are applied: 'triggers' (move_node_operation) or 'python' (tree_engine)
+app.config['TREE_ENGINE'] = os.getenv('TREE_ENGINE', 'triggers')
+
+# Verify the numbering around every node an operation changes before committing it,
+# and refuse the operation if it is inconsistent (see tree_check.py)
+app.config['TREE_CHECK_WRITES'] = os.getenv('TREE_CHECK_WRITES', '0').lower() in ('1', 'true', 'yes')
+
+# Comma-separated usernames allowed to use /api/admin/*
+app.config['ADMIN_USERS'] = [name for name in os.getenv('ADMIN_USERS', '').split(',') if name]
+
+# Apply node operations through one writer thread per process, which commits
+# everything queued so far in one transaction (see write_queue.py); off gives
+# each request its own transaction
+app.config['WRITE_QUEUE'] = os.getenv('WRITE_QUEUE', '0').lower() in ('1', 'true', 'yes')
+# Writes per transaction at most, and seconds a request waits for its write to start
+app.config['WRITE_QUEUE_BATCH'] = int(os.getenv('WRITE_QUEUE_BATCH', 100))
+app.config['WRITE_QUEUE_TIMEOUT'] = float(os.getenv('WRITE_QUEUE_TIMEOUT', 30))
+# Bytes of an import body held in memory for the writer thread before spilling to a temporary file
+app.config['IMPORT_SPOOL_BYTES'] = int(os.getenv('IMPORT_SPOOL_BYTES', 8 * 1024 * 1024))
+
+# Record SQL statistics of every request for /metrics and the slow-request log (see instrumentation.py)
+app.config['INSTRUMENTATION'] = os.getenv('INSTRUMENTATION', '0').lower() in ('1', 'true', 'yes')
+# Requests taking longer than this many milliseconds are written to SLOW_REQUEST_LOG
+# (a file of JSON lines; empty for stderr) with their SLOW_REQUEST_STATEMENTS slowest statements
+app.config['SLOW_REQUEST_MS'] = float(os.getenv('SLOW_REQUEST_MS', 500))
+app.config['SLOW_REQUEST_LOG'] = os.getenv('SLOW_REQUEST_LOG', '')
+app.config['SLOW_REQUEST_STATEMENTS'] = int(os.getenv('SLOW_REQUEST_STATEMENTS', 5))
+# SQLite VM steps between progress callbacks; fewer time short statements better but cost more
+app.config['INSTRUMENTATION_PROGRESS_STEPS'] = int(os.getenv('INSTRUMENTATION_PROGRESS_STEPS', 1000))
+
+# Seconds between tree_journal checks by each open /api/events stream
+app.config['EVENTS_POLL_INTERVAL'] = float(os.getenv('EVENTS_POLL_INTERVAL', 0.5))
+
+# Seconds without events after which a stream sends a comment to keep proxies from closing it
+app.config['EVENTS_KEEPALIVE'] = float(os.getenv('EVENTS_KEEPALIVE', 15))
 
 def get_locale():
     # You can also use request.accept_languages to determine the best match
@@ -45,6 +150,24 @@ def get_locale():
 
 babel = Babel(app, locale_selector=get_locale)
 
+snapshot_cache = SnapshotCache(app.config['SNAPSHOT_CACHE_BYTES'])
+
+mail_worker = mail_outbox.Worker(app.config)
+
+token_sweeper = sweeper.Sweeper(app.config)
+
+writer = write_queue.WriteQueue(app.config)
+
+request_metrics = instrumentation.Metrics()
+
+slow_request_log = instrumentation.SlowRequestLog(app.config['SLOW_REQUEST_LOG'])
+
+password_hasher = passwords.PasswordHasher(app.config)
+
+# Token lifetimes in seconds; the emails state them in words
+REGISTRATION_TOKEN_SECONDS = 24 * 3600
+PASSWORD_RESET_TOKEN_SECONDS = 3600
+
 class RegistrationForm(FlaskForm):
     username = StringField(_('Username'), validators=[DataRequired(), Length(min=3, max=20)])
     email = StringField(_('Email'), validators=[DataRequired(), Email()])
@@ -65,94 +188,234 @@ class ResetPasswordForm(FlaskForm):
     confirm_password = PasswordField(_('Confirm New Password'), validators=[DataRequired(), Length(min=6)])
     submit = SubmitField(_('Reset Password'))
 
-def init_db():
-    with app.app_context():
-        conn = get_db()
-        with app.open_resource('schema.sql') as f:
-            conn.executescript(f.read().decode('utf8'))
-        conn.commit()
-
 def get_db():
+    """This thread's writer connection"""
     if 'db' not in g:
-        g.db = sqlite3.connect('app.db')
-        g.db.row_factory = sqlite3.Row
+        g.db = db.get_connection(app.config)
+        if 'request_stats' in g:
+            g.request_stats.attach(g.db)
     return g.db
 
+def get_read_db():
+    """This thread's read-only connection; in WAL mode it never waits for writers"""
+    if 'read_db' not in g:
+        g.read_db = db.get_connection(app.config, readonly=True)
+        if 'request_stats' in g:
+            g.request_stats.attach(g.read_db)
+    return g.read_db
+
 @app.teardown_appcontext
 def close_db(e=None):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    stats = g.pop('request_stats', None)
+    if stats is not None:
+        stats.detach()
+    # Connections stay open for the next request on this thread
+    for conn in (g.pop('db', None), g.pop('read_db', None)):
+        if conn is not None:
+            db.release(conn)
 
+# Registered before check_schema so that its queries are counted too
 @app.before_request
-def initialize():
-    if not hasattr(app, 'initialized'):
-        init_db()
-        app.initialized = True
-
-def get_current_time():
-    """Get current time in configured timezone"""
-    tz = pytz.timezone(app.config['TIMEZONE'])
-    return datetime.now(tz)
-
-def parse_db_datetime(dt_string):
-    """Parse datetime string from database with timezone awareness"""
-    if dt_string is None:
+def start_request_stats():
+    if app.config['INSTRUMENTATION']:
+        g.request_start = time.perf_counter()
+        g.request_stats = instrumentation.RequestStats(
+            app.config['SLOW_REQUEST_STATEMENTS'], app.config['INSTRUMENTATION_PROGRESS_STEPS']
+        )
+
+@app.after_request
+def record_request_stats(response):
+    # Statements run while a streamed body is sent are not counted
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    stats.detach()
+    seconds = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    slow = seconds * 1000 >= app.config['SLOW_REQUEST_MS']
+    request_metrics.record(endpoint, request.method, response.status_code, seconds, stats, slow)
+    if slow:
+        slow_request_log.write(instrumentation.slow_request_entry(
+            request.method, request.path, endpoint, response.status_code, seconds, stats
+        ))
+    return response
+
+@app.before_request
+def check_schema():
+    # One version lookup per process; migrations are applied by `flask db upgrade`
+    if getattr(app, 'schema_checked', False):
         return None
-    
-    # Try parsing as ISO format with timezone
-    try:
-        return datetime.fromisoformat(dt_string.replace('Z', '+00:00'))
-    except ValueError:
-        # Fallback: assume UTC if no timezone info
-        naive_dt = datetime.strptime(dt_string, '%Y-%m-%d %H:%M:%S')
-        return pytz.utc.localize(naive_dt)
-
-def is_token_expired(token_created, expiration_hours):
-    """Check if token is expired with timezone awareness"""
-    current_time = get_current_time()
-    
-    # Ensure both datetimes are timezone-aware
-    if token_created.tzinfo is None:
-        token_created = pytz.utc.localize(token_created)
-    
-    # Convert both to UTC for comparison
-    token_created_utc = token_created.astimezone(pytz.utc)
-    current_time_utc = current_time.astimezone(pytz.utc)
-    
-    time_diff = current_time_utc - token_created_utc
-    return time_diff > timedelta(hours=expiration_hours)
+    conn = get_db()
+    if not db.is_current(conn):
+        if not app.config['DB_AUTO_UPGRADE']:
+            return 'The database schema is out of date. Run "flask db upgrade".', 503
+        db.upgrade(conn)
+    app.schema_checked = True
+
+@app.before_request
+def start_token_sweeper():
+    token_sweeper.start()
+
+@app.before_request
+def start_mail_worker():
+    # Sends what is still pending or due for a retry after a restart
+    mail_worker.start()
+
+@app.cli.group('db')
+def db_cli():
+    """Manage the database schema."""
+
+@db_cli.command('upgrade')
+def upgrade_db_command():
+    """Apply pending migrations and the current schema.sql."""
+    conn = get_db()
+    for name in db.changed_migrations(conn):
+        click.echo(f'Warning: {name} was changed after it was applied', err=True)
+    applied = db.upgrade(conn)
+    click.echo('Applied: ' + ', '.join(applied) if applied else 'Already up to date')
+
+@db_cli.command('status')
+def db_status_command():
+    """Show the applied and pending schema versions."""
+    conn = get_db()
+    version, schema_checksum = db.current_state(conn)
+    latest, expected_checksum = db.expected_state()
+    click.echo(f'Schema version {version} of {latest}')
+    click.echo('schema.sql is ' + ('current' if schema_checksum == expected_checksum else 'not applied'))
+    for name in db.changed_migrations(conn):
+        click.echo(f'Warning: {name} was changed after it was applied')
+
+def get_owner_id(conn, username):
+    """The id of the user named username, or of the first user if it is None"""
+    if username is None:
+        row = conn.execute('SELECT MIN(id) AS id FROM users').fetchone()
+        if row['id'] is None:
+            raise click.UsageError('There are no users to own the trees; register one first')
+        return row['id']
+    row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    if row is None:
+        raise click.BadParameter(f'No user named {username}', param_hint='--owner')
+    return row['id']
+
+@db_cli.command('seed')
+@click.option('--owner', help='Username that gets the demo trees; defaults to the first user.')
+def seed_db_command(owner):
+    """Replace all trees with the demo trees from seed.sql."""
+    conn = get_db()
+    db.seed(conn, get_owner_id(conn, owner))
+    click.echo('Seeded demo trees')
+
+@db_cli.command('sweep')
+def sweep_db_command():
+    """Delete expired registration and password reset tokens."""
+    deleted = sweeper.sweep(get_db(), app.config['SWEEP_BATCH_SIZE'])
+    for table, count in deleted.items():
+        click.echo(f'{table}: {count} expired rows deleted')
+
+@db_cli.command('trace')
+@click.argument('state', type=click.Choice(['on', 'off']), required=False)
+def trace_db_command(state):
+    """Show or switch tracing of moves into move_operation_params_log."""
+    conn = get_db()
+    if state:
+        conn.execute('UPDATE debug_settings SET trace_moves = ?', (state == 'on',))
+        conn.commit()
+    enabled = conn.execute('SELECT trace_moves FROM debug_settings').fetchone()[0]
+    click.echo(f"Move tracing is {'on' if enabled else 'off'}")
+
+@db_cli.command('retention')
+@click.argument('table', required=False)
+@click.argument('keep_rows', type=click.IntRange(min=0), required=False)
+def retention_db_command(table, keep_rows):
+    """Show ring-buffer sizes, or set TABLE to keep KEEP_ROWS rows."""
+    conn = get_db()
+    if table is not None:
+        if keep_rows is None:
+            raise click.UsageError('KEEP_ROWS is required with TABLE')
+        if table == 'last_operation_id' and keep_rows < 1:
+            # The add operations read the id they created back from it
+            raise click.BadParameter('last_operation_id must keep at least 1 row', param_hint='KEEP_ROWS')
+        updated = conn.execute(
+            'UPDATE table_retention SET keep_rows = ? WHERE table_name = ?', (keep_rows, table)
+        ).rowcount
+        conn.commit()
+        if not updated:
+            raise click.BadParameter(f'{table} has no retention setting', param_hint='TABLE')
+    for name, keep in conn.execute('SELECT table_name, keep_rows FROM table_retention ORDER BY table_name'):
+        count = conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+        click.echo(f'{name}: keeps {keep} rows, has {count}')
+
+@db_cli.command('prune')
+@click.option('--vacuum', is_flag=True,
+              help='Run a full VACUUM if the file is not in incremental auto_vacuum mode yet.')
+def prune_db_command(vacuum):
+    """Trim the log tables to their retention, then reclaim free space."""
+    conn = get_db()
+    for table, count in db.prune(conn).items():
+        click.echo(f'{table}: {count} rows deleted')
+    size, free = db.database_size(conn)
+    reclaimed = db.compact(conn, full=vacuum)
+    click.echo(f'Reclaimed {reclaimed / 1024 / 1024:.2f} MiB of {size / 1024 / 1024:.2f} MiB')
+    if free and not reclaimed and not vacuum:
+        click.echo(f'{free / 1024 / 1024:.2f} MiB is free inside the file; run with --vacuum to release it')
+
+@app.cli.group('passwords')
+def passwords_cli():
+    """Password hashing."""
+
+@passwords_cli.command('benchmark')
+@click.option('--method', 'methods', multiple=True,
+              help='Werkzeug method string to time; repeatable. Defaults to PASSWORD_HASH_METHOD.')
+@click.option('--rounds', type=click.IntRange(min=1), default=20, show_default=True)
+def benchmark_passwords_command(methods, rounds):
+    """Report p50/p99 hash and verify latency on this host."""
+    click.echo(f"{'method':<28} {'hash p50':>9} {'hash p99':>9} {'verify p50':>11} {'verify p99':>11}")
+    for method in methods or (app.config['PASSWORD_HASH_METHOD'],):
+        result = passwords.benchmark(method, app.config['PASSWORD_SALT_LENGTH'], rounds)
+        click.echo(
+            f"{result['method']:<28} {result['hash_p50']:>7.1f}ms {result['hash_p99']:>7.1f}ms"
+            f" {result['verify_p50']:>9.1f}ms {result['verify_p99']:>9.1f}ms"
+        )
 
-def send_verification_email(email, token):
-    """Send verification email with token"""
+@app.cli.group('mail')
+def mail_cli():
+    """Send queued email."""
+
+@mail_cli.command('worker')
+def mail_worker_command():
+    """Send queued email until interrupted (for MAIL_WORKER=process)."""
+    click.echo(f"Sending mail through {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}")
     try:
-        verification_url = f"http://localhost:5000/verify-email/{token}"
-        
-        message = EmailMessage()
-        message['From'] = app.config['MAIL_DEFAULT_SENDER']
-        message['To'] = email
-        message['Subject'] = str(_('Verify Your Email Address'))
-        
-        body = str(f"""
-        <h2>{_('Welcome to Tree Manager!')}</h2>
-        <p>{_('Please click the link below to verify your email address:')}</p>
-        <p><a href="{verification_url}">{verification_url}</a></p>
-        <p>{_('This link will expire in 24 hours.')}</p>
-        <br>
-        <p>{_('If you did not create an account, please ignore this email.')}</p>
-        """)
-
-        message.set_content(body, subtype='html')
-        
-        with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
-            server.starttls()
-            server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-            server.send_message(message)
-        
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+        mail_worker.run()
+    except KeyboardInterrupt:
+        mail_worker.smtp.close()
+
+@mail_cli.command('status')
+def mail_status_command():
+    """Show how many messages are pending, sent and failed."""
+    for status, count in mail_outbox.outbox_status(get_read_db()).items():
+        click.echo(f'{status}: {count}')
+
+def queue_verification_email(conn, email, token):
+    """Queue the verification email; it is sent when the caller commits"""
+    verification_url = f"http://localhost:5000/verify-email/{token}"
+
+    message = EmailMessage()
+    message['From'] = app.config['MAIL_DEFAULT_SENDER']
+    message['To'] = email
+    message['Subject'] = str(_('Verify Your Email Address'))
+
+    body = str(f"""
+    <h2>{_('Welcome to Tree Manager!')}</h2>
+    <p>{_('Please click the link below to verify your email address:')}</p>
+    <p><a href="{verification_url}">{verification_url}</a></p>
+    <p>{_('This link will expire in 24 hours.')}</p>
+    <br>
+    <p>{_('If you did not create an account, please ignore this email.')}</p>
+    """)
+
+    message.set_content(body, subtype='html')
+    mail_outbox.enqueue(conn, message)
 
 def generate_verification_token():
     """Generate a secure random token"""
@@ -189,7 +452,7 @@ def register():
                 return render_template("register.html", form=form)
             
             # Hash password and insert new user (initially inactive)
-            hashed_password = generate_password_hash(form.password.data)
+            hashed_password = password_hasher.hash(form.password.data)
             cursor = conn.execute(
                 'INSERT INTO users (username, email, password, is_active) VALUES (?, ?, ?, ?)',
                 (form.username.data, form.email.data, hashed_password, False)
@@ -199,17 +462,14 @@ def register():
             # Generate verification token
             token = generate_verification_token()
             conn.execute(
-                'INSERT INTO registration_tokens (token, user_id) VALUES (?, ?)',
-                (token, user_id)
+                'INSERT INTO registration_tokens (token, user_id, expires_at) VALUES (?, ?, ?)',
+                (token, user_id, int(time.time()) + REGISTRATION_TOKEN_SECONDS)
             )
-            
+            queue_verification_email(conn, form.email.data, token)
+
             conn.commit()
-            
-            # Send verification email
-            if send_verification_email(form.email.data, token):
-                flash(_('Registration successful! Please check your email to verify your account.'), 'success')
-            else:
-                flash(_('Registration successful but failed to send verification email. Please contact support.'), 'warning')
+            mail_worker.wake()
+            flash(_('Registration successful! Please check your email to verify your account.'), 'success')
 
             return redirect(url_for('login'))
             
@@ -227,16 +487,15 @@ def verify_email(token):
     try:
         # Get token record
         token_record = conn.execute(
-            'SELECT * FROM registration_tokens WHERE token = ?', (token,)
+            "SELECT user_id, expires_at <= CAST(strftime('%s', 'now') AS INTEGER) AS expired "
+            'FROM registration_tokens WHERE token = ?', (token,)
         ).fetchone()
         
         if not token_record:
             flash('Invalid verification token.', 'error')
             return redirect(url_for('login'))
         
-        # Check if token is expired (24 hours)
-        token_created = parse_db_datetime(token_record['created_at'])
-        if is_token_expired(token_created, 24):
+        if token_record['expired']:
             flash('Verification token has expired.', 'error')
             return redirect(url_for('login'))
         
@@ -260,36 +519,27 @@ def verify_email(token):
         flash('Error verifying email.', 'error')
         return redirect(url_for('login'))
 
-def send_password_reset_email(email, token):
-    """Send password reset email with token"""
-    try:
-        reset_url = f"http://localhost:5000/reset-password/{token}"
-        
-        message = MIMEMultipart()
-        message['To'] = email
-        message['Subject'] = _('Password Reset Request')
-        
-        body = f"""
-        <h2>{_('Password Reset Request')}</h2>
-        <p>{_('You requested to reset your password. Click the link below to set a new password:')}</p>
-        <p><a href="{reset_url}">{reset_url}</a></p>
-        <p>{_('This link will expire in 1 hour.')}</p>
-        <br>
-        <p>{_('If you did not request a password reset, please ignore this email.')}</p>
-        """
-        
-        message.attach(MIMEText(body, 'html'))
-        
-        with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT']) as server:
-            server.starttls()
-            server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-            server.send_message(message)
-        
-        return True
-    except Exception as e:
-        print(f"Error sending password reset email: {e}")
-        return False
-    
+def queue_password_reset_email(conn, email, token):
+    """Queue the password reset email; it is sent when the caller commits"""
+    reset_url = f"http://localhost:5000/reset-password/{token}"
+
+    message = EmailMessage()
+    message['From'] = app.config['MAIL_DEFAULT_SENDER']
+    message['To'] = email
+    message['Subject'] = str(_('Password Reset Request'))
+
+    body = str(f"""
+    <h2>{_('Password Reset Request')}</h2>
+    <p>{_('You requested to reset your password. Click the link below to set a new password:')}</p>
+    <p><a href="{reset_url}">{reset_url}</a></p>
+    <p>{_('This link will expire in 1 hour.')}</p>
+    <br>
+    <p>{_('If you did not request a password reset, please ignore this email.')}</p>
+    """)
+
+    message.set_content(body, subtype='html')
+    mail_outbox.enqueue(conn, message)
+
 @app.route('/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
     form = ForgotPasswordForm()
@@ -313,16 +563,14 @@ def forgot_password():
             # Generate new token
             token = generate_verification_token()
             conn.execute(
-                'INSERT INTO password_reset_tokens (token, user_id) VALUES (?, ?)',
-                (token, user['id'])
+                'INSERT INTO password_reset_tokens (token, user_id, expires_at) VALUES (?, ?, ?)',
+                (token, user['id'], int(time.time()) + PASSWORD_RESET_TOKEN_SECONDS)
             )
-            
+            queue_password_reset_email(conn, form.email.data, token)
+
             conn.commit()
-            
-            if send_password_reset_email(form.email.data, token):
-                flash(_('Password reset link sent! Please check your email.'), 'success')
-            else:
-                flash(_('Failed to send password reset email. Please try again later.'), 'error')
+            mail_worker.wake()
+            flash(_('Password reset link sent! Please check your email.'), 'success')
 
             return redirect(url_for('login'))
         else:
@@ -337,16 +585,15 @@ def reset_password(token):
     
     # Validate token
     token_record = conn.execute(
-        'SELECT * FROM password_reset_tokens WHERE token = ?', (token,)
+        "SELECT user_id, expires_at <= CAST(strftime('%s', 'now') AS INTEGER) AS expired "
+        'FROM password_reset_tokens WHERE token = ?', (token,)
     ).fetchone()
     
     if not token_record:
         flash(_('Invalid or expired password reset token.'), 'error')
         return redirect(url_for('login'))
     
-    # Check if token is expired (1 hour)
-    token_created = parse_db_datetime(token_record['created_at'])
-    if is_token_expired(token_created, 1):
+    if token_record['expired']:
         flash(_('Password reset token has expired.'), 'error')
         return redirect(url_for('forgot_password'))
     
@@ -357,7 +604,7 @@ def reset_password(token):
         
         try:
             # Hash new password
-            hashed_password = generate_password_hash(form.password.data)
+            hashed_password = password_hasher.hash(form.password.data)
             
             # Update user password
             conn.execute(
@@ -386,15 +633,28 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         conn = get_db()
-        # allow login with either username or email
-        user = conn.execute(
-            'SELECT * FROM users WHERE username = ? OR email = ?', (form.username.data, form.username.data)
-        ).fetchone()
+        # allow login with either username or email; two point lookups on
+        # the unique indexes, a username match first
+        user = conn.execute('''
+            SELECT * FROM users WHERE username = ?
+            UNION ALL
+            SELECT * FROM users WHERE email = ?
+            LIMIT 1
+        ''', (form.username.data, form.username.data)).fetchone()
         
-        if user and check_password_hash(user['password'], form.password.data):
+        if user and password_hasher.verify(user['password'], form.password.data):
             if not user['is_active']:
                 flash(_('Please verify your email before logging in.'), 'error')
                 return render_template("login.html", form=form)
+
+            if password_hasher.needs_rehash(user['password']):
+                # Store the password with the current method and cost; skip if it changed meanwhile
+                new_hash = password_hasher.hash(form.password.data)
+                conn.execute(
+                    'UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                    (new_hash, user['id'], user['password'])
+                )
+                conn.commit()
             
             session["user_id"] = user['id']
             session["username"] = user['username']
@@ -448,16 +708,14 @@ def resend_verification():
             # Generate new token
             token = generate_verification_token()
             conn.execute(
-                'INSERT INTO registration_tokens (token, user_id) VALUES (?, ?)',
-                (token, user['id'])
+                'INSERT INTO registration_tokens (token, user_id, expires_at) VALUES (?, ?, ?)',
+                (token, user['id'], int(time.time()) + REGISTRATION_TOKEN_SECONDS)
             )
-            
+            queue_verification_email(conn, email, token)
+
             conn.commit()
-            
-            if send_verification_email(email, token):
-                flash(_('Verification email sent! Please check your inbox.'), 'success')
-            else:
-                flash(_('Failed to send verification email. Please try again later.'), 'error')
+            mail_worker.wake()
+            flash(_('Verification email sent! Please check your inbox.'), 'success')
 
             return redirect(url_for('login'))
         else:
@@ -465,6 +723,13 @@ def resend_verification():
 
     return render_template('resend_verification.html')
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this process; keep it off the public network"""
+    if not app.config['INSTRUMENTATION']:
+        return 'Instrumentation is off', 404
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory(app.static_folder, filename)
@@ -474,110 +739,762 @@ def serve_static(filename):
 def get_tree():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
-    conn = get_db()
-    tree = conn.execute('SELECT * FROM tree ORDER BY tree_id, lft').fetchall()
-    return jsonify([dict(node) for node in tree])
+    owner_id = session['user_id']
+    conn = get_read_db()
+
+    def build():
+        return conn.execute('''
+            SELECT tree.* FROM trees CROSS JOIN tree ON tree.tree_id = trees.tree_id
+            WHERE trees.owner_id = ?
+            ORDER BY trees.sort_key, tree.lft
+        ''', (owner_id,))
+    return conditional_nodes(('forest', owner_id, 'tree'), forest_etag(conn, owner_id), build)
 
 @app.route('/api/trees', methods=['GET'])
 def get_trees():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
-    conn = get_db()
-    trees = conn.execute('SELECT DISTINCT tree_id, name FROM tree WHERE level = 0 ORDER BY tree_id').fetchall()
-    return jsonify([dict(tree) for tree in trees])
+    owner_id = session['user_id']
+    conn = get_read_db()
+
+    def build():
+        # CROSS JOIN keeps trees as the outer loop: one (tree_id, level) index
+        # lookup per tree instead of a scan of every node for level = 0
+        return conn.execute(f'''
+            SELECT {NODE_COLUMNS} FROM trees CROSS JOIN tree ON tree.tree_id = trees.tree_id
+            WHERE trees.owner_id = ? AND tree.level = 0
+            ORDER BY trees.sort_key
+        ''', (owner_id,))
+    return conditional_nodes(('forest', owner_id, 'trees'), forest_etag(conn, owner_id), build)
+
+# Node columns for the lazily loaded endpoints. With gapped numbering a leaf
+# can have rgt - lft > 1, so whether a node has children is looked up in
+# the (tree_id, level, lft) index.
+NODE_COLUMNS = '''tree.*, EXISTS (
+    SELECT 1 FROM tree AS child
+    WHERE child.tree_id = tree.tree_id AND child.level = tree.level + 1
+      AND child.lft > tree.lft AND child.lft < tree.rgt
+) AS has_children'''
+
+def get_forest_version(conn, owner_id):
+    """Counter bumped by every change to any of the owner's trees; 0 before the first one"""
+    row = conn.execute('SELECT version FROM workspace_version WHERE owner_id = ?', (owner_id,)).fetchone()
+    return row['version'] if row else 0
+
+def forest_etag(conn, owner_id):
+    return f'forest-{owner_id}-{get_forest_version(conn, owner_id)}'
+
+def conditional_json(key, etag, build):
+    """Answer 304 if the client already has etag, else the JSON of build() tagged with it.
+
+    Callers read the version in etag before build() reads the data, so a
+    concurrent commit can only make the tag older than the body, never newer.
+    The encoded body is kept in snapshot_cache under key + (etag,), so the
+    next request for the same version skips the query and the encoding.
+    """
+    return conditional_body(
+        key, etag, 'application/json', lambda: app.json.dumps(build()).encode('utf8') + b'\n'
+    )
+
+def conditional_nodes(key, etag, build):
+    """conditional_json for the node rows returned by build(), a list or a cursor.
+
+    Clients that prefer tree_columns.MIMETYPE in their Accept header get the
+    rows in the columnar encoding, built straight from the row tuples,
+    under their own ETag and cache entry.
+    """
+    if request.accept_mimetypes.best_match(NODE_MIMETYPES) == tree_columns.MIMETYPE:
+        response = conditional_body(
+            key + ('columns',), etag + '-columns', tree_columns.MIMETYPE,
+            lambda: encode_node_columns(build())
+        )
+    else:
+        response = conditional_body(
+            key, etag, 'application/json',
+            lambda: app.json.dumps([dict(row) for row in build()]).encode('utf8') + b'\n'
+        )
+    response.vary.add('Accept')
+    return response
+
+# The JSON comes first so that "Accept: */*" keeps getting JSON
+NODE_MIMETYPES = ['application/json', tree_columns.MIMETYPE]
+
+def encode_node_columns(rows):
+    """Encode a list of rows, or a cursor straight from its result rows"""
+    if isinstance(rows, sqlite3.Cursor):
+        return tree_columns.encode_columns([column[0] for column in rows.description], rows)
+    return tree_columns.encode_columns(rows[0].keys() if rows else [], rows)
+
+def conditional_body(key, etag, mimetype, encode):
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = snapshot_cache.get_or_build(key + (etag,), encode)
+        response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Cache, but revalidate on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def get_page_args():
+    """Read the keyset pagination arguments (after_lft, limit) from the query string"""
+    after_lft = request.args.get('after_lft', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    page_size = app.config['TREE_PAGE_SIZE']
+    if limit is None or limit <= 0 or limit > page_size:
+        limit = page_size
+    return after_lft, limit
+
+@app.route('/api/trees/<int:tree_id>', methods=['GET'])
+def get_tree_nodes(tree_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    after_lft, limit = get_page_args()
+    conn = get_read_db()
+    version = conn.execute(
+        'SELECT version FROM trees WHERE tree_id = ? AND owner_id = ?', (tree_id, session['user_id'])
+    ).fetchone()
+    if not version:
+        return jsonify({'error': 'Tree not found'}), 404
+
+    def build():
+        return conn.execute(
+            f'SELECT {NODE_COLUMNS} FROM tree WHERE tree_id = ? AND lft > ? ORDER BY lft LIMIT ?',
+            (tree_id, after_lft, limit)
+        )
+    return conditional_nodes(
+        ('tree', tree_id, 'nodes', after_lft, limit), f'tree-{tree_id}-{version["version"]}', build
+    )
+
+@app.route('/api/nodes/<int:node_id>/subtree', methods=['GET'])
+def get_subtree(node_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    depth = request.args.get('depth', type=int)
+    after_lft, limit = get_page_args()
+    conn = get_read_db()
+    version = get_node_version(conn, node_id, session['user_id'])
+    if not version:
+        return jsonify({'error': 'Node not found'}), 404
+    return conditional_nodes(
+        ('tree', version['tree_id'], 'subtree', node_id, depth, after_lft, limit),
+        f'tree-{version["tree_id"]}-{version["version"]}',
+        lambda: get_subtree_nodes(conn, node_id, depth, after_lft, limit)
+    )
+
+def get_subtree_nodes(conn, node_id, depth, after_lft, limit, include_root=True):
+    parent = conn.execute(f'SELECT {NODE_COLUMNS} FROM tree WHERE id = ?', (node_id,)).fetchone()
+    if not parent:
+        return []
+
+    # The subtree root comes first in lft order, so it only belongs on the first page
+    nodes = [parent] if include_root and after_lft < parent['lft'] else []
+    after_lft = max(after_lft, parent['lft'])
+    if depth == 1:
+        # Direct children are a single (tree_id, level, lft) index range,
+        # so expanding a node never walks the rest of its subtree
+        nodes += conn.execute(f'''
+            SELECT {NODE_COLUMNS} FROM tree
+            WHERE tree_id = ? AND level = ? AND lft > ? AND lft < ?
+            ORDER BY lft
+            LIMIT ?
+        ''', (parent['tree_id'], parent['level'] + 1, after_lft, parent['rgt'], limit - len(nodes))).fetchall()
+    elif depth is None or depth > 1:
+        nodes += conn.execute(f'''
+            SELECT {NODE_COLUMNS} FROM tree
+            WHERE tree_id = ? AND lft > ? AND lft < ? AND (? IS NULL OR level <= ?)
+            ORDER BY lft
+            LIMIT ?
+        ''', (parent['tree_id'], after_lft, parent['rgt'],
+              depth, parent['level'] + (depth or 0), limit - len(nodes))).fetchall()
+    return nodes
+
+def get_node_version(conn, node_id, owner_id):
+    """(tree_id, version) of the node's tree, or None if the owner has no such node"""
+    return conn.execute('''
+        SELECT trees.tree_id, trees.version FROM tree JOIN trees ON trees.tree_id = tree.tree_id
+        WHERE tree.id = ? AND trees.owner_id = ?
+    ''', (node_id, owner_id)).fetchone()
+
+@app.route('/api/nodes/<int:node_id>/ancestors', methods=['GET'])
+def get_ancestors(node_id):
+    """The node's ancestors from its root down to its parent (breadcrumbs)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    conn = get_read_db()
+    version = get_node_version(conn, node_id, session['user_id'])
+    if not version:
+        return jsonify({'error': 'Node not found'}), 404
+    return conditional_nodes(
+        ('tree', version['tree_id'], 'ancestors', node_id),
+        f'tree-{version["tree_id"]}-{version["version"]}',
+        lambda: get_ancestor_nodes(conn, node_id)
+    )
+
+def get_ancestor_nodes(conn, node_id):
+    # tree.id_path lists the ancestor ids, so each one is a primary key lookup
+    return conn.execute(f'''
+        SELECT {NODE_COLUMNS} FROM tree
+        WHERE id IN (
+            SELECT CAST(value AS INTEGER) FROM json_each(
+                (SELECT '[' || replace(id_path, '.', ',') || ']' FROM tree WHERE id = ?)
+            )
+        ) AND id <> ?
+        ORDER BY level
+    ''', (node_id, node_id)).fetchall()
+
+@app.route('/api/nodes/<int:node_id>/descendants', methods=['GET'])
+def get_descendants(node_id):
+    """The node's subtree without the node itself, in display order, depth levels deep"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    depth = request.args.get('depth', type=int)
+    after_lft, limit = get_page_args()
+    conn = get_read_db()
+    version = get_node_version(conn, node_id, session['user_id'])
+    if not version:
+        return jsonify({'error': 'Node not found'}), 404
+    return conditional_nodes(
+        ('tree', version['tree_id'], 'descendants', node_id, depth, after_lft, limit),
+        f'tree-{version["tree_id"]}-{version["version"]}',
+        lambda: get_subtree_nodes(conn, node_id, depth, after_lft, limit, include_root=False)
+    )
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Nodes whose name matches q, best first, with their ancestor path; paged by offset"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    text = request.args.get('q', '')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', 50, type=int)
+    if limit <= 0 or limit > app.config['TREE_PAGE_SIZE']:
+        limit = app.config['TREE_PAGE_SIZE']
+    owner_id = session['user_id']
+    conn = get_read_db()
+    return conditional_json(
+        ('forest', owner_id, 'search', text, offset, limit), forest_etag(conn, owner_id),
+        lambda: search_nodes(conn, text, owner_id, offset, limit, app.config['SEARCH_RANK_LIMIT'])
+    )
 
 @app.route('/api/trees', methods=['POST'])
 def create_tree():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     data = request.get_json()
-    name = data.get('name', 'New Tree')
-    try:
-        conn = get_db()
-        conn.execute('BEGIN TRANSACTION') 
-        conn.execute('INSERT INTO add_root_operation (name) VALUES (?)', (name,))
-        conn.commit()
-        return jsonify({'success': True}), 200
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'error': str(e)}), 400
+    return run_operation({
+        'op': 'add', 'target_node_id': None,
+        'name': data.get('name', 'New Tree'), 'gap': data.get('gap', app.config['TREE_GAP']),
+    })
 
 @app.route('/api/nodes', methods=['POST'])
 def add_node():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     data = request.get_json()
-    conn = get_db()
-    
-    try:
-        conn.execute('BEGIN TRANSACTION') 
-        conn.execute('''
-            INSERT INTO add_node_operation (target_node_id, name, position)
-            VALUES (?, ?, ?)
-        ''', (data['target_node_id'], data['name'], data['position']))
-        conn.commit()
-        return jsonify({'success': True}), 200
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'error': str(e)}), 400
+    return run_operation({
+        'op': 'add', 'target_node_id': data['target_node_id'],
+        'name': data['name'], 'position': data['position'],
+    })
 
 @app.route('/api/nodes/<int:node_id>', methods=['PUT'])
 def rename_node(node_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     data = request.get_json()
-    conn = get_db()
-    
-    try:
-        conn.execute('BEGIN TRANSACTION') 
-        conn.execute('UPDATE tree SET name = ? WHERE id = ?', (data['name'], node_id))
-        conn.commit()
-        return jsonify({'success': True}), 200
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'error': str(e)}), 400
+    return run_operation({'op': 'rename', 'node_id': node_id, 'name': data['name']})
 
 @app.route('/api/nodes/move', methods=['POST'])
 def move_node():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     data = request.get_json()
+    return run_operation({
+        'op': 'move', 'node_id': data['node_id'],
+        'target_node_id': data['target_node_id'], 'position': data['position'],
+    })
+
+@app.route('/api/nodes/<int:node_id>', methods=['DELETE'])
+def delete_node(node_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return run_operation({'op': 'delete', 'node_id': node_id})
+
+def run_operation(op):
+    """Apply one operation in its own transaction and answer like the single-node routes"""
+    owner_id = session['user_id']
+    try:
+        result = write(lambda conn: apply_operation(conn, op, owner_id=owner_id))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    snapshot_cache.invalidate(result['trees'])
+    return jsonify({'success': True}), 200
+
+def write(work):
+    """Run work(conn) in a write transaction and return its result once committed.
+
+    With WRITE_QUEUE on, the writer thread runs it in a savepoint of a
+    transaction shared with other requests' writes; work must not use the
+    request context.
+    """
+    if app.config['WRITE_QUEUE']:
+        return writer.submit(work)
     conn = get_db()
-    
     try:
-        conn.execute('BEGIN TRANSACTION') 
-        conn.execute('''
-            INSERT INTO move_node_operation (node_id, target_node_id, position)
-            VALUES (?, ?, ?)
-        ''', (data['node_id'], data['target_node_id'], data['position']))
+        conn.execute('BEGIN IMMEDIATE TRANSACTION')
+        result = work(conn)
         conn.commit()
-        return jsonify({'success': True}), 200
-    except Exception as e:
+    except Exception:
         conn.rollback()
-        return jsonify({'error': str(e)}), 400
+        raise
+    return result
 
-@app.route('/api/nodes/<int:node_id>', methods=['DELETE'])
-def delete_node(node_id):
+POSITIONS = ('first-child', 'last-child', 'left', 'right')
+
+def resolve_node_ref(value, results):
+    """Return a node id, resolving "$<index>" to the node added by an earlier operation"""
+    if isinstance(value, str) and value.startswith('$'):
+        index = int(value[1:])
+        if not 0 <= index < len(results) or results[index].get('id') is None:
+            raise ValueError(f'{value} does not refer to an earlier add operation')
+        return results[index]['id']
+    return value
+
+def get_node_tree_id(conn, node_id, owner_id=None):
+    """The node's tree id; with an owner_id, nodes of other owners are not found"""
+    row = conn.execute('''
+        SELECT tree.tree_id FROM tree JOIN trees ON trees.tree_id = tree.tree_id
+        WHERE tree.id = ?1 AND (?2 IS NULL OR trees.owner_id = ?2)
+    ''', (node_id, owner_id)).fetchone()
+    if row is None:
+        raise ValueError(f'Node {node_id} not found')
+    return row['tree_id']
+
+def get_position(op):
+    position = op.get('position', 'last-child')
+    if position not in POSITIONS:
+        raise ValueError('Position must be one of: ' + ', '.join(POSITIONS))
+    return position
+
+def apply_operation(conn, op, results=(), owner_id=None):
+    """Run one add/move/rename/delete operation through the *_operation triggers
+    (moves and deletes through tree_engine when TREE_ENGINE is 'python').
+
+    Must be called inside a transaction. With an owner_id, nodes in other
+    owners' trees are not found and new trees belong to owner_id. Returns
+    the kind of operation, the node it created or changed and the ids of
+    the trees it touched.
+    """
+    kind = op.get('op')
+    checking = app.config['TREE_CHECK_WRITES']
+    if kind == 'add':
+        target_id = resolve_node_ref(op.get('target_node_id'), results)
+        if target_id is None:
+            gap = op.get('gap', app.config['TREE_GAP'])
+            if not isinstance(gap, int) or gap < 0:
+                raise ValueError('gap must be a non-negative integer')
+            conn.execute('INSERT INTO add_root_operation (name, gap, owner_id) VALUES (?, ?, ?)',
+                         (op.get('name', 'New Tree'), gap, owner_id))
+        else:
+            position = get_position(op)
+            get_node_tree_id(conn, target_id, owner_id)
+            conn.execute('''
+                INSERT INTO add_node_operation (target_node_id, name, position)
+                VALUES (?, ?, ?)
+            ''', (target_id, op['name'], position))
+        new_id = conn.execute(
+            'SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1'
+        ).fetchone()['id']
+        if checking:
+            check_written(conn, [node_position(conn, new_id)])
+        return {'op': kind, 'id': new_id, 'trees': [get_node_tree_id(conn, new_id)]}
+
+    node_id = resolve_node_ref(op.get('node_id'), results)
+    tree_ids = [get_node_tree_id(conn, node_id, owner_id)]
+    # Where the node was before the operation and where it is after it
+    touched = [node_position(conn, node_id)] if checking and kind != 'rename' else []
+    if kind == 'move':
+        target_id = resolve_node_ref(op.get('target_node_id'), results)
+        position = get_position(op)
+        if target_id is not None:
+            tree_ids.append(get_node_tree_id(conn, target_id, owner_id))
+        if app.config['TREE_ENGINE'] == 'python':
+            tree_engine.move_node(conn, node_id, target_id, position)
+        else:
+            conn.execute('''
+                INSERT INTO move_node_operation (node_id, target_node_id, position)
+                VALUES (?, ?, ?)
+            ''', (node_id, target_id, position))
+        tree_ids.append(get_node_tree_id(conn, node_id))
+        if checking:
+            touched.append(node_position(conn, node_id))
+    elif kind == 'rename':
+        conn.execute('UPDATE tree SET name = ? WHERE id = ?', (op['name'], node_id))
+    elif kind == 'delete':
+        if app.config['TREE_ENGINE'] == 'python':
+            tree_engine.delete_node(conn, node_id)
+        else:
+            conn.execute('INSERT INTO delete_node_operation (node_id) VALUES (?)', (node_id,))
+    else:
+        raise ValueError(f'Unknown operation: {kind!r}')
+    check_written(conn, touched)
+    return {'op': kind, 'id': node_id, 'trees': sorted(set(tree_ids))}
+
+def node_position(conn, node_id):
+    """(tree_id, lft) of the node"""
+    return tuple(conn.execute('SELECT tree_id, lft FROM tree WHERE id = ?', (node_id,)).fetchone())
+
+def check_written(conn, positions):
+    """Raise ValueError if any row an operation at positions can have changed is inconsistent.
+
+    Checks each tree from its first position to its end (tree_check.check_changed),
+    so the cost follows the number of nodes after the change.
+    """
+    starts = {}
+    for tree_id, lft in positions:
+        starts[tree_id] = min(lft, starts.get(tree_id, lft))
+    for tree_id, lft in starts.items():
+        problems = tree_check.check_changed(conn, tree_id, lft, limit=1)
+        if problems:
+            problem = problems[0]
+            raise ValueError(
+                f"The operation would leave tree {problem['tree_id']} inconsistent "
+                f"at node {problem['node_id']}: {problem['message']}"
+            )
+
+@app.route('/api/operations/batch', methods=['POST'])
+def batch_operations():
+    """Apply an ordered list of operations in one transaction.
+
+    Either every operation is applied or none is. A node id given as
+    "$<index>" refers to the node added by operation <index> of the batch.
+    """
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({'error': 'operations must be a list'}), 400
+    if len(operations) > app.config['TREE_BATCH_SIZE']:
+        return jsonify({'error': f"At most {app.config['TREE_BATCH_SIZE']} operations per batch"}), 400
+    owner_id = session['user_id']
+    results = []
+
+    def apply_all(conn):
+        for op in operations:
+            if not isinstance(op, dict):
+                raise ValueError('Each operation must be an object')
+            results.append(apply_operation(conn, op, results, owner_id))
+    try:
+        write(apply_all)
+    except Exception as e:
+        return jsonify({'error': str(e), 'index': len(results)}), 400
+    snapshot_cache.invalidate({tree_id for result in results for tree_id in result['trees']})
+
+    changes = {'added': [], 'moved': [], 'renamed': [], 'deleted': []}
+    past_tense = {'add': 'added', 'move': 'moved', 'rename': 'renamed', 'delete': 'deleted'}
+    for result in results:
+        changes[past_tense[result['op']]].append(result['id'])
+    # Includes trees that a delete or root move has emptied
+    changes['trees'] = sorted({tree_id for result in results for tree_id in result['trees']})
+    return jsonify({
+        'success': True,
+        'ids': [result['id'] if result['op'] == 'add' else None for result in results],
+        'changes': changes,
+    }), 200
+
+IMPORT_MIMETYPES = {'application/json': 'json', 'text/csv': 'csv', 'text/plain': 'text'}
+EXPORT_MIMETYPES = {fmt: mimetype for mimetype, fmt in IMPORT_MIMETYPES.items()}
+
+@app.route('/api/trees/export', methods=['GET'])
+def export_tree():
+    """Stream all trees, or the one given by tree_id, as json, csv or text"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    fmt = request.args.get('format', 'json')
+    if fmt not in FORMATS:
+        return jsonify({'error': 'format must be one of: ' + ', '.join(FORMATS)}), 400
+    tree_id = request.args.get('tree_id', type=int)
+    conn = get_read_db()
+    filename = f"tree-{tree_id or 'all'}.{'txt' if fmt == 'text' else fmt}"
+    return Response(
+        stream_with_context(export_trees(conn, fmt, tree_id, session['user_id'])),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/trees/import', methods=['POST'])
+def import_tree():
+    """Load the request body as new trees without going through the add triggers"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    fmt = request.args.get('format') or IMPORT_MIMETYPES.get(request.mimetype, 'json')
+    if fmt not in FORMATS:
+        return jsonify({'error': 'format must be one of: ' + ', '.join(FORMATS)}), 400
+    gap = request.args.get('gap', app.config['TREE_GAP'], type=int)
+    if gap is None or gap < 0:
+        return jsonify({'error': 'gap must be a non-negative integer'}), 400
+    owner_id = session['user_id']
+    body = request.stream
+    if app.config['WRITE_QUEUE']:
+        # The writer thread cannot read the request, so it gets a copy of the
+        # body, kept in memory up to IMPORT_SPOOL_BYTES and on disk beyond
+        body = tempfile.SpooledTemporaryFile(max_size=app.config['IMPORT_SPOOL_BYTES'])
+        shutil.copyfileobj(request.stream, body)
+        body.seek(0)
+
+    try:
+        tree_ids = write(
+            lambda conn: import_trees(conn, codecs.getreader('utf-8')(body), fmt, gap, owner_id=owner_id)
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        if body is not request.stream:
+            body.close()
+    snapshot_cache.invalidate(tree_ids)
+    return jsonify({'success': True, 'tree_ids': tree_ids}), 200
+
+@app.cli.group('tree')
+def tree_cli():
+    """Import, export and check trees."""
+
+@tree_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension, else json.')
+@click.option('--gap', type=click.IntRange(min=0), help='lft/rgt spacing; defaults to TREE_GAP.')
+@click.option('--owner', help='Username that gets the trees; defaults to the first user.')
+def import_tree_command(source, fmt, gap, owner):
+    """Load SOURCE (or stdin) as new trees."""
+    fmt = fmt or guess_format(source.name)
+    gap = app.config['TREE_GAP'] if gap is None else gap
     conn = get_db()
-    
+    owner_id = get_owner_id(conn, owner)
     try:
-        conn.execute('BEGIN TRANSACTION') 
-        conn.execute('INSERT INTO delete_node_operation (node_id) VALUES (?)', (node_id,))
+        conn.execute('BEGIN IMMEDIATE TRANSACTION')
+        tree_ids = import_trees(conn, source, fmt, gap, owner_id=owner_id)
         conn.commit()
-        return jsonify({'success': True}), 200
-    except Exception as e:
+    except Exception:
         conn.rollback()
+        raise
+    count = conn.execute(
+        f"SELECT COUNT(*) FROM tree WHERE tree_id IN ({', '.join('?' * len(tree_ids))})", tree_ids
+    ).fetchone()[0]
+    click.echo(f'Imported {len(tree_ids)} tree(s), {count} nodes: {tree_ids}')
+
+@tree_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension, else json.')
+@click.option('--tree-id', type=int, help='Export only this tree.')
+@click.option('--owner', help="Export only this user's trees.")
+def export_tree_command(target, fmt, tree_id, owner):
+    """Write all trees, or one, to TARGET (or stdout)."""
+    fmt = fmt or guess_format(target.name)
+    conn = get_read_db()
+    owner_id = None if owner is None else get_owner_id(conn, owner)
+    for chunk in export_trees(conn, fmt, tree_id, owner_id):
+        target.write(chunk)
+
+@tree_cli.command('check')
+@click.option('--tree-id', type=int, help='Check only this tree; defaults to every tree and the search index.')
+@click.option('--lo', type=int, help='With --tree-id, check only nodes with lft >= LO.')
+@click.option('--hi', type=int, help='With --tree-id, check only nodes with lft <= HI.')
+@click.option('--limit', type=click.IntRange(min=1), default=tree_check.MAX_PROBLEMS, show_default=True,
+              help='Stop after this many problems.')
+@click.option('--repair', is_flag=True, help='Renumber the trees with problems, and rebuild a broken search index.')
+@click.option('--from', 'source', type=click.Choice(tree_check.PARENT_SOURCES), default='id_path',
+              show_default=True, help='Where --repair takes each node\'s parent from.')
+def check_tree_command(tree_id, lo, hi, limit, repair, source):
+    """Verify the nested-set numbering; exit with status 1 if there are problems."""
+    if tree_id is None and (lo is not None or hi is not None):
+        raise click.UsageError('--lo and --hi need --tree-id')
+    conn = get_read_db()
+    problems = check_integrity(conn, tree_id, lo, hi, limit)
+    for problem in problems:
+        node = '' if problem['node_id'] is None else f" node {problem['node_id']}"
+        click.echo(f"tree {problem['tree_id']}{node}: {problem['kind']}: {problem['message']}")
+    if not problems:
+        click.echo('No problems found')
+        return
+    if not repair:
+        raise SystemExit(1)
+    broken = sorted({problem['tree_id'] for problem in problems if problem['tree_id'] is not None})
+    fts = any(problem['kind'] == 'fts' for problem in problems)
+    for broken_id in broken:
+        try:
+            changed = repair_integrity(broken_id, source)
+        except ValueError as e:
+            click.echo(f'Tree {broken_id} not repaired: {e}', err=True)
+            continue
+        click.echo(f'Tree {broken_id}: {changed} nodes renumbered')
+    if fts:
+        repair_integrity(None, source, fts=True)
+        click.echo('Search index rebuilt')
+    problems = check_integrity(conn, tree_id, lo, hi, limit)
+    click.echo(f'Problems left: {len(problems)}' if problems else 'No problems left')
+    if problems:
+        raise SystemExit(1)
+
+def check_integrity(conn, tree_id=None, lo=None, hi=None, limit=tree_check.MAX_PROBLEMS):
+    """Problems in one tree (in its rows with lft in [lo, hi] if given), or in every tree and tree_fts"""
+    # One read transaction, so that every statement of the check sees the same snapshot
+    conn.execute('BEGIN')
+    try:
+        if tree_id is not None:
+            return tree_check.check_tree(conn, tree_id, lo, hi, limit)
+        problems = tree_check.check_all(conn, limit=limit)
+    finally:
+        conn.rollback()
+    # FTS5 takes 'integrity-check' as an INSERT, which a read-only connection refuses
+    return problems + write(tree_check.check_fts)
+
+def repair_integrity(tree_id, source, fts=False):
+    """Renumber tree_id (if given) from source and rebuild tree_fts (if fts) in one write transaction"""
+    def repair(conn):
+        changed = 0 if tree_id is None else tree_check.repair_tree(conn, tree_id, source)
+        if fts:
+            tree_check.rebuild_fts(conn)
+        return changed
+    changed = write(repair)
+    if changed:
+        snapshot_cache.invalidate([tree_id])
+    return changed
+
+def is_admin():
+    return session.get('username') in app.config['ADMIN_USERS']
+
+@app.route('/api/admin/integrity', methods=['GET'])
+def get_integrity():
+    """Check the nested-set numbering of one tree, or of all trees and the search index"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    tree_id = request.args.get('tree_id', type=int)
+    lo = request.args.get('lo', type=int)
+    hi = request.args.get('hi', type=int)
+    if tree_id is None and (lo is not None or hi is not None):
+        return jsonify({'error': 'lo and hi need a tree_id'}), 400
+    limit = request.args.get('limit', tree_check.MAX_PROBLEMS, type=int)
+    problems = check_integrity(get_read_db(), tree_id, lo, hi, limit)
+    return jsonify({'ok': not problems, 'problems': problems}), 200
+
+@app.route('/api/admin/integrity/repair', methods=['POST'])
+def post_integrity_repair():
+    """Renumber a tree from its id_path values (or levels) and/or rebuild the search index"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    data = request.get_json(silent=True) or {}
+    tree_id = data.get('tree_id')
+    source = data.get('source', 'id_path')
+    fts = bool(data.get('fts'))
+    if tree_id is None and not fts:
+        return jsonify({'error': 'tree_id or fts is required'}), 400
+    if tree_id is not None and not isinstance(tree_id, int):
+        return jsonify({'error': 'tree_id must be an integer'}), 400
+    try:
+        changed = repair_integrity(tree_id, source, fts)
+    except Exception as e:
         return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'changed': changed}), 200
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(snapshot_cache.stats())
+
+EVENTS_BATCH = 500
+
+def sse_event(event_id, data):
+    return f'id: {event_id}\ndata: {app.json.dumps(data)}\n\n'
+
+def journal_events(conn, owner_id, tree_id, last_id):
+    """Yield the owner's tree_journal entries after last_id as server-sent events, until the client leaves.
+
+    Polls the journal on the read-only connection, so streams never wait for
+    writers, but each open stream keeps one worker thread busy. A client whose
+    last_id is no longer in the journal is told to reload instead.
+    """
+    poll = app.config['EVENTS_POLL_INTERVAL']
+    first_id, max_id = conn.execute('SELECT MIN(id), IFNULL(MAX(id), 0) FROM tree_journal').fetchone()
+    if last_id is None:
+        last_id = max_id
+    elif last_id > max_id or (first_id is not None and last_id < first_id - 1):
+        yield sse_event(max_id, {'kind': 'reload'})
+        last_id = max_id
+    idle = 0.0
+    while True:
+        rows = conn.execute('''
+            SELECT id, tree_id, old_tree_id, version, kind, node_id, data
+            FROM tree_journal
+            WHERE owner_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (owner_id, last_id, EVENTS_BATCH)).fetchall()
+        for row in rows:
+            if tree_id is None or tree_id in (row['tree_id'], row['old_tree_id']):
+                entry = dict(row)
+                entry.update(app.json.loads(entry.pop('data')))
+                yield sse_event(row['id'], entry)
+                idle = 0.0
+        if rows:
+            last_id = rows[-1]['id']
+        if len(rows) == EVENTS_BATCH:
+            continue
+        time.sleep(poll)
+        idle += poll
+        if idle >= app.config['EVENTS_KEEPALIVE']:
+            yield ': keepalive\n\n'
+            idle = 0.0
+
+def event_stream(tree_id=None):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    owner_id = session['user_id']
+    conn = get_read_db()
+    if tree_id is not None and not conn.execute(
+        'SELECT 1 FROM trees WHERE tree_id = ? AND owner_id = ?', (tree_id, owner_id)
+    ).fetchone():
+        return jsonify({'error': 'Tree not found'}), 404
+    # EventSource resends the id of the last event it saw when it reconnects
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    return Response(
+        stream_with_context(journal_events(conn, owner_id, tree_id, last_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """Stream changes to every tree of the user as server-sent events"""
+    return event_stream()
+
+@app.route('/api/trees/<int:tree_id>/events', methods=['GET'])
+def get_tree_events(tree_id):
+    """Stream changes to one tree, including moves into and out of it"""
+    return event_stream(tree_id)
 
 @app.route('/api/tree/indented', methods=['GET'])
 def get_indented_tree():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
-    conn = get_db()
-    tree = conn.execute('SELECT * FROM tree_indented ORDER BY tree_id, lft').fetchall()
-    return jsonify([dict(node) for node in tree])
+    owner_id = session['user_id']
+    conn = get_read_db()
+
+    def build():
+        tree = conn.execute('''
+            SELECT id, tree.tree_id, name, lft, rgt, level
+            FROM trees CROSS JOIN tree ON tree.tree_id = trees.tree_id
+            WHERE trees.owner_id = ?
+            ORDER BY trees.sort_key, tree.lft
+        ''', (owner_id,)).fetchall()
+        return list(indent_rows(tree))
+    return conditional_json(('forest', owner_id, 'indented'), forest_etag(conn, owner_id), build)
 
 if __name__ == '__main__':
     app.run(debug=True)
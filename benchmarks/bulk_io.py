@@ -0,0 +1,105 @@
+"""Time bulk tree import/export against adding nodes one at a time.
+
+    python benchmarks/bulk_io.py [--sizes 1000,100000,1000000,5000000]
+
+trigger_add inserts every node through add_node_operation and is skipped
+above --trigger-max nodes because it is quadratic. The database is a
+temporary file so that max_rss reflects the Python side, not the table.
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import create_database  # noqa: E402
+from tree_io import export_trees, import_trees  # noqa: E402
+
+
+def random_tree_lines(size, max_depth=12, seed=0):
+    """Yield an indented text tree of size nodes without building it in memory"""
+    rng = random.Random(seed)
+    depth = 0
+    for i in range(size):
+        yield '  ' * depth + f'Node {i}\n'
+        depth = rng.randint(1, min(depth + 1, max_depth)) if i else 1
+
+
+def trigger_add(conn, size, seed=0):
+    rng = random.Random(seed)
+    conn.execute("INSERT INTO add_root_operation (name, gap) VALUES ('Node 0', 0)")
+    ids = [conn.execute('SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1').fetchone()[0]]
+    for i in range(1, size):
+        conn.execute(
+            "INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, ?, 'last-child')",
+            (rng.choice(ids), f'Node {i}')
+        )
+        ids.append(conn.execute('SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1').fetchone()[0])
+    conn.commit()
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return f'{time.perf_counter() - start:.3f}s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000,5000000')
+    parser.add_argument('--trigger-max', type=int, default=2000)
+    args = parser.parse_args()
+
+    columns = ('trigger_add', 'import_text', 'export_json', 'import_json', 'export_csv', 'max_rss')
+    print(f"{'nodes':>9}  " + '  '.join(f'{c:>11}' for c in columns))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (int(s) for s in args.sizes.split(',')):
+            db_path = os.path.join(tmp, f'{size}.db')
+            json_path = os.path.join(tmp, f'{size}.json')
+            conn = create_database(db_path)
+            timings = []
+
+            if size <= args.trigger_max:
+                timings.append(timed(lambda: trigger_add(conn, size)))
+                conn.execute('DELETE FROM tree')
+                conn.execute('DELETE FROM trees')
+                conn.commit()
+            else:
+                timings.append('skipped')
+
+            def import_text():
+                import_trees(conn, random_tree_lines(size), 'text')
+                conn.commit()
+            timings.append(timed(import_text))
+            tree_id = conn.execute('SELECT MAX(tree_id) FROM trees').fetchone()[0]
+
+            def export_json():
+                with open(json_path, 'w', encoding='utf8') as f:
+                    for chunk in export_trees(conn, 'json', tree_id):
+                        f.write(chunk)
+            timings.append(timed(export_json))
+
+            def import_json():
+                with open(json_path, encoding='utf8') as f:
+                    import_trees(conn, f, 'json')
+                conn.commit()
+            timings.append(timed(import_json))
+
+            timings.append(timed(lambda: sum(len(chunk) for chunk in export_trees(conn, 'csv', tree_id))))
+            count = conn.execute('SELECT COUNT(*) FROM tree').fetchone()[0]
+            assert count == 2 * size, (count, size)
+            timings.append(f'{max_rss_mb():.0f}MB')
+            print(f'{size:>9}  ' + '  '.join(f'{t:>11}' for t in timings))
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
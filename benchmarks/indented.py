@@ -0,0 +1,94 @@
+"""Compare the indented-tree implementations from 1k to 1M nodes.
+
+    python benchmarks/indented.py [--sizes 1000,10000,100000,1000000]
+
+legacy_view is the original correlated-subquery view and is skipped above
+--legacy-max nodes because it is quadratic.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import create_database, load_tree  # noqa: E402
+from tree_indent import indent_rows  # noqa: E402
+
+LEGACY_VIEW = """
+CREATE TEMP VIEW tree_indented_legacy AS
+WITH tree_with_ancestors AS (
+    SELECT t.*,
+        (SELECT GROUP_CONCAT(a.name, ' > ') FROM tree a
+         WHERE a.tree_id = t.tree_id AND a.lft < t.lft AND a.rgt > t.rgt) AS ancestor_path,
+        (SELECT GROUP_CONCAT(a.id, '.') FROM tree a
+         WHERE a.tree_id = t.tree_id AND a.lft < t.lft AND a.rgt > t.rgt) AS ancestor_id_path,
+        (SELECT COUNT(*) FROM tree a
+         WHERE a.tree_id = t.tree_id AND a.lft < t.lft AND a.rgt > t.rgt) AS depth
+    FROM tree t
+)
+SELECT id, tree_id,
+    CASE WHEN depth = 0 THEN name ELSE
+        SUBSTR('│   │   │   │   │   │   │   │   │   │   ', 1, (depth - 1) * 4) ||
+        CASE WHEN EXISTS (
+            SELECT 1 FROM tree s WHERE s.tree_id = tree_id AND s.lft > lft
+                AND s.rgt < (SELECT MIN(parent.rgt) FROM tree parent
+                             WHERE parent.tree_id = tree_id AND parent.lft < lft AND parent.rgt > rgt
+                             UNION SELECT rgt FROM tree WHERE id = tree_with_ancestors.id LIMIT 1)
+                AND s.level = level + 1
+        ) THEN '├── ' ELSE '└── ' END || name
+    END AS indented_name,
+    SUBSTR('    ', 1, level * 3) || name AS simple_indented_name,
+    name, lft, rgt, level,
+    COALESCE(ancestor_path || ' > ' || name, name) AS full_path,
+    COALESCE(ancestor_id_path || '.' || id, CAST(id AS TEXT)) AS id_path,
+    depth
+FROM tree_with_ancestors
+ORDER BY tree_id, lft
+"""
+
+
+def time_call(func):
+    start = time.perf_counter()
+    count = func()
+    return time.perf_counter() - start, count
+
+
+def legacy_view(conn):
+    return len(conn.execute('SELECT * FROM tree_indented_legacy').fetchall())
+
+
+def recursive_view(conn):
+    return len(conn.execute('SELECT * FROM tree_indented').fetchall())
+
+
+def python_engine(conn):
+    rows = conn.execute('SELECT id, tree_id, name, lft, rgt, level FROM tree ORDER BY tree_id, lft').fetchall()
+    return sum(1 for _ in indent_rows(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--legacy-max', type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>9}  {'legacy_view':>12}  {'recursive_view':>14}  {'python_engine':>13}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        conn = create_database()
+        conn.execute(LEGACY_VIEW)
+        load_tree(conn, size)
+        timings = []
+        for name, func in (('legacy', legacy_view), ('view', recursive_view), ('python', python_engine)):
+            if name == 'legacy' and size > args.legacy_max:
+                timings.append('skipped')
+                continue
+            elapsed, count = time_call(lambda: func(conn))
+            assert count == size, (name, count, size)
+            timings.append(f'{elapsed:.3f}s')
+        print(f'{size:>9}  {timings[0]:>12}  {timings[1]:>14}  {timings[2]:>13}')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
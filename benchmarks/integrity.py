@@ -0,0 +1,77 @@
+"""Time the nested-set checks and the repair.
+
+    python benchmarks/integrity.py [--sizes 10000,100000,1000000] [--repeat 3]
+
+For each size, loads one random tree and prints the median time of a full
+tree_check.check_tree; the median and worst time, and the median size,
+of the ranged check that TREE_CHECK_WRITES runs after an operation, from
+--samples random nodes to the end of the tree; and the time of repair_tree after every lft/rgt past the
+middle of the tree has been shifted by one, with the number of rows it
+rewrote.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tree_check  # noqa: E402
+from synthetic import create_database, load_tree  # noqa: E402
+
+
+def median_ms(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--samples', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>8} {'check_ms':>9} {'ranged_ms':>9} {'worst_ms':>9} {'ranged_rows':>11} {'repair_ms':>9} {'rewritten':>9}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        conn = create_database()
+        load_tree(conn, size, seed=size)
+        conn.commit()
+        check_ms, problems = median_ms(lambda: tree_check.check_tree(conn, 1), args.repeat)
+        assert not problems, problems[:3]
+
+        rng = random.Random(size)
+        ranged_times = []
+        ranged_sizes = []
+        for node_id in rng.sample(range(2, size + 1), min(args.samples, size - 1)):
+            lft = conn.execute('SELECT lft FROM tree WHERE id = ?', (node_id,)).fetchone()[0]
+            ms, problems = median_ms(lambda: tree_check.check_changed(conn, 1, lft), 1)
+            assert not problems, problems[:3]
+            ranged_times.append(ms)
+            ranged_sizes.append(
+                conn.execute('SELECT COUNT(*) FROM tree WHERE tree_id = 1 AND lft >= ?', (lft,)).fetchone()[0]
+            )
+        ranged_ms = statistics.median(ranged_times)
+        worst_ms = max(ranged_times)
+        ranged_rows = statistics.median(ranged_sizes)
+
+        conn.execute('UPDATE tree SET lft = lft + 1, rgt = rgt + 1 WHERE tree_id = 1 AND lft > ?', (size,))
+        conn.execute('UPDATE tree SET rgt = rgt + 1 WHERE tree_id = 1 AND lft <= ? AND rgt > ?', (size, size))
+        assert tree_check.check_tree(conn, 1, limit=1)
+        start = time.perf_counter()
+        rewritten = tree_check.repair_tree(conn, 1)
+        conn.commit()
+        repair_ms = (time.perf_counter() - start) * 1000
+        assert not tree_check.check_tree(conn, 1)
+        print(f'{size:>8} {check_ms:>9.1f} {ranged_ms:>9.2f} {worst_ms:>9.1f} {ranged_rows:>11.0f} {repair_ms:>9.1f} {rewritten:>9}')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
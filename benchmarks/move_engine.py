@@ -0,0 +1,141 @@
+"""Check that tree_engine matches the move/delete triggers, then time both.
+
+    python benchmarks/move_engine.py [--steps 2000] [--seed 0] [--size 10000] [--moves 500]
+
+The check applies the same random adds, moves and deletes to two databases,
+one through move_node_operation/delete_node_operation and one through
+tree_engine, and compares tree, trees, tree_version and tree_journal after
+every step, and checks tree.id_path against tree_indented. Some trees are
+gapped so that the fallback is exercised too.
+The timing moves random subtrees within one --size node tree.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tree_engine  # noqa: E402
+from synthetic import OWNER_ID, create_database, load_tree  # noqa: E402
+
+STATE_QUERIES = (
+    'SELECT id, tree_id, lft, rgt, level, name, id_path FROM tree ORDER BY id',
+    'SELECT tree_id, sort_key, gap, version, owner_id FROM trees ORDER BY tree_id',
+    'SELECT version FROM tree_version',
+    'SELECT owner_id, version FROM workspace_version ORDER BY owner_id',
+    'SELECT id, tree_id, old_tree_id, owner_id, version, kind, node_id, data FROM tree_journal ORDER BY id',
+)
+
+# Nodes whose materialized path differs from the one tree_indented derives from lft/rgt
+STALE_PATHS = 'SELECT COUNT(*) FROM tree JOIN tree_indented USING (id) WHERE tree.id_path <> tree_indented.id_path'
+
+
+def trigger_move(conn, node_id, target_id, position):
+    conn.execute('INSERT INTO move_node_operation (node_id, target_node_id, position) VALUES (?, ?, ?)',
+                 (node_id, target_id, position))
+
+
+def trigger_delete(conn, node_id):
+    conn.execute('INSERT INTO delete_node_operation (node_id) VALUES (?)', (node_id,))
+
+
+def state(conn):
+    return [[tuple(row) for row in conn.execute(query)] for query in STATE_QUERIES]
+
+
+def random_operation(conn, rng):
+    """An operation both engines accept: no moves into the node's own subtree"""
+    nodes = conn.execute('SELECT id, tree_id, lft, rgt, level FROM tree').fetchall()
+    if len(nodes) < 3 or rng.random() < 0.4:
+        if not nodes or rng.random() < 0.15:
+            return ('root', rng.choice((0, 0, 10)))
+        target = rng.choice(nodes)
+        return ('add', target['id'], rng.choice(('first-child', 'last-child')))
+    if rng.random() < 0.05:
+        return ('delete', rng.choice(nodes)['id'])
+    node = rng.choice(nodes)
+    position = rng.choice(tree_engine.POSITIONS)
+    if rng.random() < 0.1:
+        return ('move', node['id'], None, position)
+    targets = [t for t in nodes
+               if not (t['tree_id'] == node['tree_id'] and node['lft'] <= t['lft'] <= node['rgt'])]
+    if not targets:
+        return ('move', node['id'], None, position)
+    return ('move', node['id'], rng.choice(targets)['id'], position)
+
+
+def apply(conn, op, move, delete):
+    if op[0] == 'root':
+        conn.execute("INSERT INTO add_root_operation (name, gap, owner_id) VALUES ('Root', ?, ?)", (op[1], OWNER_ID))
+    elif op[0] == 'add':
+        conn.execute("INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, 'Node', ?)",
+                     (op[1], op[2]))
+    elif op[0] == 'move':
+        move(conn, *op[1:])
+    else:
+        delete(conn, op[1])
+    conn.commit()
+
+
+def check(steps, seed):
+    rng = random.Random(seed)
+    triggers = create_database()
+    python = create_database()
+    for step in range(steps):
+        op = random_operation(triggers, rng)
+        apply(triggers, op, trigger_move, trigger_delete)
+        apply(python, op, tree_engine.move_node, tree_engine.delete_node)
+        if state(triggers) != state(python):
+            sys.exit(f'step {step}: {op} left the databases different')
+        if triggers.execute(STALE_PATHS).fetchone()[0]:
+            sys.exit(f'step {step}: {op} left tree.id_path out of date')
+    nodes = triggers.execute('SELECT COUNT(*) FROM tree').fetchone()[0]
+    print(f'{steps} operations, {nodes} nodes at the end: states identical')
+
+
+def time_moves(size, moves, seed):
+    rng = random.Random(seed)
+    operations = []
+    conn = create_database()
+    load_tree(conn, size, seed=seed)
+    for _ in range(moves):
+        operations.append(random_operation(conn, rng))
+    # Only moves are timed; replay the ones that are still valid in each database
+    results = {}
+    for name, move in (('triggers', trigger_move), ('python', tree_engine.move_node)):
+        conn = create_database()
+        load_tree(conn, size, seed=seed)
+        elapsed = 0.0
+        count = 0
+        for op in operations:
+            if op[0] != 'move':
+                continue
+            node = conn.execute('SELECT tree_id, lft, rgt FROM tree WHERE id = ?', (op[1],)).fetchone()
+            target = conn.execute('SELECT tree_id, lft FROM tree WHERE id = ?', (op[2],)).fetchone()
+            if target and target['tree_id'] == node['tree_id'] and node['lft'] <= target['lft'] <= node['rgt']:
+                continue
+            start = time.perf_counter()
+            move(conn, *op[1:])
+            conn.commit()
+            elapsed += time.perf_counter() - start
+            count += 1
+        results[name] = (count, elapsed)
+    for name, (count, elapsed) in results.items():
+        print(f'{name:>9}: {count} moves in {elapsed:.3f}s, {elapsed / max(count, 1) * 1000:.2f} ms/move')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--moves', type=int, default=500)
+    args = parser.parse_args()
+    check(args.steps, args.seed)
+    time_moves(args.size, args.moves, args.seed)
+
+
+if __name__ == '__main__':
+    main()
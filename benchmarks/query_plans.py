@@ -0,0 +1,128 @@
+"""Fail if a node query of the API or of tree_engine scans the whole tree table.
+
+    python benchmarks/query_plans.py [--size 20000]
+
+Every listed request is made through the Flask test client against a
+temporary database of two --size node trees, and every statement it runs is
+recorded. The script prints EXPLAIN QUERY PLAN for each statement and exits
+with status 1 if any of them reads the whole tree table, or every row of
+one tree, instead of an index range. Statements run inside triggers are not
+visible to EXPLAIN QUERY PLAN and are not checked.
+tests/test_query_plans.py makes the same requests against smaller trees.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import create_database, load_tree  # noqa: E402
+
+# Transaction control, and statements run by triggers and virtual tables,
+# which the trace callback reports as comments
+SKIPPED = re.compile(r'^\s*(--|(BEGIN|COMMIT|ROLLBACK|PRAGMA|SAVEPOINT|RELEASE)\b)', re.I)
+
+
+def node_scans(conn, sql):
+    """The plan lines of sql, and those that scan the tree table or a whole tree.
+
+    SCAN of other tables (trees has one row per tree) is fine.
+    """
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    tables = {'tree'} | set(re.findall(r'\btree\s+AS\s+(\w+)', sql, re.I))
+    scans = []
+    for line in plan:
+        match = re.match(r'SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?', line)
+        if match and (match.group(1) in tables or (match.group(2) or '').startswith('idx_tree_')):
+            scans.append(line)
+        elif re.match(r'SEARCH (\w+) .*\(tree_id=\?\)$', line):
+            scans.append(line)
+    return plan, scans
+
+
+def statement_plans(conn, statements):
+    """(sql, plan, scans) for every traced statement that EXPLAIN QUERY PLAN can show"""
+    for sql in statements:
+        if not SKIPPED.match(sql):
+            yield (sql, *node_scans(conn, sql))
+
+
+def sample_nodes(conn, size):
+    """A node in the middle of tree 1 and one of its deepest nodes"""
+    deep = conn.execute(
+        'SELECT id FROM tree WHERE tree_id = 1 ORDER BY level DESC, id LIMIT 1'
+    ).fetchone()[0]
+    return size // 2, deep
+
+
+def api_requests(size, node, deep):
+    """(method, url, json body) of the checked requests; reads first, then the writes, in order"""
+    return [
+        ('GET', '/api/trees', None),
+        ('GET', f'/api/nodes/{deep}/ancestors', None),
+        ('GET', f'/api/nodes/{node}/descendants', None),
+        ('GET', f'/api/nodes/{node}/descendants?depth=1', None),
+        ('GET', f'/api/nodes/{node}/descendants?depth=3&limit=50', None),
+        ('GET', f'/api/nodes/{node}/subtree?depth=2', None),
+        ('GET', '/api/trees/1?after_lft=100&limit=100', None),
+        ('GET', '/api/search?q=node%2012&limit=20', None),
+        ('POST', '/api/nodes/move', {'node_id': deep, 'target_node_id': node, 'position': 'last-child'}),
+        ('POST', '/api/nodes/move', {'node_id': deep, 'target_node_id': size + 5, 'position': 'left'}),
+        ('POST', '/api/nodes', {'target_node_id': node, 'name': 'New', 'position': 'first-child'}),
+        ('DELETE', f'/api/nodes/{deep}', None),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'plans.db')
+        conn = create_database(path)
+        load_tree(conn, args.size, tree_id=1, seed=1)
+        load_tree(conn, args.size, tree_id=2, seed=2)
+        conn.close()
+
+        os.environ['DATABASE'] = path
+        os.environ['TREE_ENGINE'] = 'python'
+        import app as tree_app
+        import db
+
+        node, deep = sample_nodes(db.get_connection(tree_app.app.config), args.size)
+        requests = api_requests(args.size, node, deep)
+
+        statements = []
+        for readonly in (False, True):
+            db.get_connection(tree_app.app.config, readonly).set_trace_callback(statements.append)
+        client = tree_app.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+        failed = False
+        for method, url, body in requests:
+            statements.clear()
+            response = client.open(url, method=method, json=body)
+            print(f'{method} {url} -> {response.status_code}')
+            if response.status_code >= 400:
+                print(f'  {response.get_data(as_text=True).strip()}')
+                failed = True
+            conn = db.get_connection(tree_app.app.config)
+            conn.set_trace_callback(None)
+            for sql, plan, scans in statement_plans(conn, statements):
+                for line in plan:
+                    marker = '!!' if line in scans else '  '
+                    print(f'  {marker} {line}')
+                if scans:
+                    print(f'     in: {" ".join(sql.split())[:200]}')
+                    failed = True
+            conn.set_trace_callback(statements.append)
+        if failed:
+            sys.exit('Some node queries scan the tree table')
+        print('No node query scans the tree table')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Time /api/search queries (tree_search.search_nodes) on a large forest.
+
+    python benchmarks/search.py [--size 1000000] [--rounds 20]
+
+Node names are two or three words drawn with a Zipf-like distribution from
+a generated vocabulary, so some words occur in a large part of the tree and
+most are rare. Each query kind is run --rounds times with different words;
+like_scan is a LIKE '%word%' filter for a rare word, which reads every name.
+The database is a temporary file.
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import OWNER_ID, create_database, random_tree_rows  # noqa: E402
+from tree_search import fts_query, search_nodes  # noqa: E402
+
+VOCABULARY_SIZE = 20000
+
+
+def vocabulary(rng):
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'be', 'da', 'fi', 'go', 'ha', 'ju', 'pe']
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def load_forest(conn, size, words, rng):
+    # Rank r is drawn with weight 1 / (r + 1)
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    rows = random_tree_rows(size)
+    conn.executemany(
+        'INSERT INTO tree (id, tree_id, name, lft, rgt, level, id_path) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((node_id, tree_id, ' '.join(rng.choices(words, cum_weights=weights, k=rng.randint(2, 3))).title(),
+          lft, rgt, level, id_path)
+         for node_id, tree_id, _, lft, rgt, level, id_path in rows)
+    )
+    conn.execute('INSERT INTO trees (tree_id, sort_key, owner_id) VALUES (1, 1024, ?)', (OWNER_ID,))
+    conn.commit()
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = vocabulary(rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = create_database(os.path.join(tmp, 'search.db'))
+        start = time.perf_counter()
+        load_forest(conn, args.size, words, rng)
+        print(f'{args.size} nodes loaded and indexed in {time.perf_counter() - start:.1f}s')
+
+        common = words[:10]
+        medium = words[100:1000]
+        rare = words[-5000:]
+        kinds = {
+            'common_word': lambda: (rng.choice(common), 0),
+            'rare_word': lambda: (rng.choice(rare), 0),
+            'two_words': lambda: (f'{rng.choice(common)} {rng.choice(medium)}', 0),
+            'prefix_3': lambda: (rng.choice(medium)[:3], 0),
+            'page_20': lambda: (rng.choice(medium), 20 * args.limit),
+        }
+        print(f"{'query':>12}  {'p50_ms':>9}  {'p99_ms':>9}  {'matches':>9}")
+        for name, make in kinds.items():
+            times = []
+            matches = []
+            for _ in range(args.rounds):
+                text, offset = make()
+                start = time.perf_counter()
+                search_nodes(conn, text, OWNER_ID, offset, args.limit)
+                times.append((time.perf_counter() - start) * 1000)
+                matches.append(conn.execute(
+                    'SELECT COUNT(*) FROM tree_fts WHERE tree_fts MATCH ?', (fts_query(text),)
+                ).fetchone()[0])
+            print(f'{name:>12}  {percentile(times, 50):9.2f}  {percentile(times, 99):9.2f}  '
+                  f'{int(statistics.median(matches)):9d}')
+
+        times = []
+        for _ in range(max(args.rounds // 4, 2)):
+            word = rng.choice(rare)
+            start = time.perf_counter()
+            conn.execute('SELECT id FROM tree WHERE name LIKE ? LIMIT ?', (f'%{word}%', args.limit)).fetchall()
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"{'like_scan':>12}  {percentile(times, 50):9.2f}  {percentile(times, 99):9.2f}")
+
+
+if __name__ == '__main__':
+    main()
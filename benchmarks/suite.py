@@ -0,0 +1,385 @@
+"""Time every tree operation and API route on synthetic forests; compare runs.
+
+    python benchmarks/suite.py [--shapes random,deep,wide,forest]
+        [--sizes 1000,10000,100000] [--repeat 10] [--output run.json]
+        [--compare baseline.json] [--threshold 0.25]
+
+For each shape and size (see synthetic.load_forest) a temporary database is
+loaded and two groups are measured:
+
+operation  one INSERT into an *_operation view (or a rename UPDATE), run on
+           the app's writer connection inside a savepoint that is rolled back
+           afterwards, so every repetition starts from the same forest
+route      one request through the Flask test client; changes are undone by
+           untimed requests afterwards, and cached responses are dropped
+           before every GET
+
+Each result has p50/p99/mean milliseconds and the rows the statement or
+request inserted, updated or deleted, triggers included. --output writes
+them as JSON. --compare reads such a file and exits with status 1 if a
+result got more than --threshold slower at p50 (and by at least --min-ms)
+or writes more rows than before. Routes use TREE_ENGINE from the
+environment; the operation group always runs the triggers.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import OWNER_ID, SHAPES, create_database, load_forest  # noqa: E402
+
+# Fewest timings per measurement, for the percentiles of statistics.quantiles
+MIN_SAMPLES = 3
+
+
+def last_added_id(conn):
+    return conn.execute('SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1').fetchone()[0]
+
+
+def add_root(conn, name='Bench'):
+    """Add a one-node tree and return its root id"""
+    conn.execute('INSERT INTO add_root_operation (name, gap, owner_id) VALUES (?, 0, ?)', (name, OWNER_ID))
+    return last_added_id(conn)
+
+
+def add_child(conn, target_id, name='Bench'):
+    """Add a last child to target_id and return its id"""
+    conn.execute(
+        "INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, ?, 'last-child')",
+        (target_id, name)
+    )
+    return last_added_id(conn)
+
+
+def landmarks(conn):
+    """Node ids the operations work on, all in the first tree of the forest.
+
+    root, mid (the node in the middle of the tree in preorder, with its
+    subtree), leaf (the first leaf at or after mid) and last (the last node in
+    preorder, always a leaf).
+    """
+    root = conn.execute('''
+        SELECT tree.id, tree.tree_id, tree.rgt FROM trees JOIN tree ON tree.tree_id = trees.tree_id
+        WHERE tree.level = 0 ORDER BY trees.sort_key LIMIT 1
+    ''').fetchone()
+    mid = conn.execute(
+        'SELECT id, lft FROM tree WHERE tree_id = ? AND lft >= ? ORDER BY lft LIMIT 1',
+        (root['tree_id'], root['rgt'] // 2)
+    ).fetchone()
+    leaf = conn.execute(
+        'SELECT id FROM tree WHERE tree_id = ? AND lft >= ? AND rgt = lft + 1 ORDER BY lft LIMIT 1',
+        (root['tree_id'], mid['lft'])
+    ).fetchone()
+    last = conn.execute(
+        'SELECT id FROM tree WHERE tree_id = ? ORDER BY lft DESC LIMIT 1', (root['tree_id'],)
+    ).fetchone()
+    return {'root': root['id'], 'mid': mid['id'], 'leaf': leaf['id'], 'last': last['id']}
+
+
+def operations(ids):
+    """(name, setup) pairs; setup(conn) runs untimed and returns (sql, params) to time"""
+    def add(target, position):
+        return lambda conn: (
+            'INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, ?, ?)',
+            (ids[target], 'Bench', position)
+        )
+
+    def move(node, target, position):
+        return lambda conn: (
+            'INSERT INTO move_node_operation (node_id, target_node_id, position) VALUES (?, ?, ?)',
+            (node(conn) if callable(node) else ids[node],
+             target(conn) if callable(target) else ids.get(target), position)
+        )
+
+    def delete(node):
+        return lambda conn: ('INSERT INTO delete_node_operation (node_id) VALUES (?)', (ids[node],))
+
+    return [
+        ('add_root', lambda conn: (
+            "INSERT INTO add_root_operation (name, gap, owner_id) VALUES ('Bench', 0, ?)", (OWNER_ID,)
+        )),
+        ('add first-child of root', add('root', 'first-child')),
+        ('add last-child of root', add('root', 'last-child')),
+        ('add left of mid', add('mid', 'left')),
+        ('add right of mid', add('mid', 'right')),
+        ('add last-child of last', add('last', 'last-child')),
+        ('move leaf to first-child of root', move('leaf', 'root', 'first-child')),
+        ('move mid to last-child of root', move('mid', 'root', 'last-child')),
+        ('move mid to new tree', move('mid', None, 'last-child')),
+        ('move mid to other tree', move('mid', add_root, 'last-child')),
+        ('move other root to first-child of root', move(add_root, 'root', 'first-child')),
+        ('delete leaf', delete('leaf')),
+        ('delete mid', delete('mid')),
+        ('delete root', delete('root')),
+        ('rename mid', lambda conn: ("UPDATE tree SET name = 'Renamed' WHERE id = ?", (ids['mid'],))),
+    ]
+
+
+def time_operation(conn, setup):
+    """Milliseconds and rows written for one run of the statement setup returns; leaves no trace"""
+    conn.execute('SAVEPOINT bench')
+    try:
+        sql, params = setup(conn)
+        changes = conn.total_changes
+        start = time.perf_counter()
+        conn.execute(sql, params)
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, conn.total_changes - changes
+    finally:
+        conn.execute('ROLLBACK TO bench')
+        conn.execute('RELEASE bench')
+
+
+def original_place(conn, node_id):
+    """(target_node_id, position) that puts node_id back where it is now"""
+    node = conn.execute('SELECT tree_id, lft, level, id_path FROM tree WHERE id = ?', (node_id,)).fetchone()
+    left = conn.execute(
+        'SELECT id FROM tree WHERE tree_id = ? AND rgt = ? AND level = ?',
+        (node['tree_id'], node['lft'] - 1, node['level'])
+    ).fetchone()
+    if left:
+        return left['id'], 'right'
+    return int(node['id_path'].split('.')[-2]), 'first-child'
+
+
+def routes(ids):
+    """(name, method, setup, cleanup) tuples.
+
+    setup(conn) returns (url, json body) and runs untimed, like cleanup(client,
+    conn, response), which undoes the change.
+    """
+    moved_from = {}
+
+    def get(url):
+        return lambda conn: (url.format(**ids), None)
+
+    def delete_added(client, conn, response):
+        client.delete(f'/api/nodes/{last_added_id(conn)}')
+
+    def move_back(client, conn, response):
+        target, position = moved_from['place']
+        client.post('/api/nodes/move', json={'node_id': ids['leaf'], 'target_node_id': target, 'position': position})
+
+    def move_leaf(conn):
+        moved_from['place'] = original_place(conn, ids['leaf'])
+        return '/api/nodes/move', {'node_id': ids['leaf'], 'target_node_id': ids['root'], 'position': 'first-child'}
+
+    def delete_new_leaf(conn):
+        node_id = add_child(conn, ids['mid'])
+        conn.commit()
+        return f'/api/nodes/{node_id}', None
+
+    return [
+        ('GET /api/trees', 'GET', get('/api/trees'), None),
+        ('GET /api/trees/<root tree>', 'GET', get('/api/trees/1?limit=100'), None),
+        ('GET /api/nodes/<mid>/subtree?depth=2', 'GET', get('/api/nodes/{mid}/subtree?depth=2'), None),
+        ('GET /api/nodes/<root>/descendants?depth=1', 'GET', get('/api/nodes/{root}/descendants?depth=1'), None),
+        ('GET /api/nodes/<last>/ancestors', 'GET', get('/api/nodes/{last}/ancestors'), None),
+        ('GET /api/search', 'GET', get('/api/search?q=node%2012&limit=20'), None),
+        ('POST /api/trees', 'POST', lambda conn: ('/api/trees', {'name': 'Bench', 'gap': 0}), delete_added),
+        ('POST /api/nodes first-child of root', 'POST',
+         lambda conn: ('/api/nodes', {'target_node_id': ids['root'], 'name': 'Bench', 'position': 'first-child'}),
+         delete_added),
+        ('PUT /api/nodes/<mid>', 'PUT', lambda conn: (f'/api/nodes/{ids["mid"]}', {'name': 'Renamed'}), None),
+        ('POST /api/nodes/move leaf to first-child of root', 'POST', move_leaf, move_back),
+        ('DELETE /api/nodes/<leaf>', 'DELETE', delete_new_leaf, None),
+    ]
+
+
+def summarize(kind, name, shape, size, samples):
+    times = [elapsed for elapsed, _ in samples]
+    quantiles = statistics.quantiles(times, n=100, method='inclusive')
+    return {
+        'kind': kind, 'name': name, 'shape': shape, 'size': size, 'samples': len(times),
+        'p50_ms': round(quantiles[49], 4), 'p99_ms': round(quantiles[98], 4),
+        'mean_ms': round(statistics.fmean(times), 4),
+        'rows_written': statistics.median_high(rows for _, rows in samples),
+    }
+
+
+def measure(run, repeat, budget):
+    """Call run() once to warm the page cache, then repeat times, or fewer
+    (at least MIN_SAMPLES) once budget seconds are spent"""
+    run()
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < repeat and (len(samples) < MIN_SAMPLES or time.perf_counter() - start < budget):
+        samples.append(run())
+    return samples
+
+
+def run_suite(args):
+    os.environ.setdefault('DATABASE', os.path.join(args.tmp, 'unused.db'))
+    import app as tree_app
+    import db
+
+    client = tree_app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    results = []
+    for size in args.sizes:
+        for shape in args.shapes:
+            path = os.path.join(args.tmp, f'{shape}-{size}.db')
+            conn = create_database(path)
+            load_forest(conn, shape, size, seed=args.seed)
+            conn.close()
+            tree_app.app.config['DATABASE'] = path
+            tree_app.snapshot_cache.clear()
+            conn = db.get_connection(tree_app.app.config)
+            ids = landmarks(conn)
+
+            for name, setup in operations(ids):
+                samples = measure(lambda: time_operation(conn, setup), args.repeat, args.budget)
+                results.append(report(summarize('operation', name, shape, size, samples)))
+
+            for name, method, setup, cleanup in routes(ids):
+                def run():
+                    url, body = setup(conn)
+                    tree_app.snapshot_cache.clear()
+                    changes = conn.total_changes
+                    start = time.perf_counter()
+                    response = client.open(url, method=method, json=body)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    if response.status_code != 200:
+                        sys.exit(f'{method} {url} -> {response.status_code}: {response.get_data(as_text=True)}')
+                    rows = conn.total_changes - changes
+                    if cleanup:
+                        cleanup(client, conn, response)
+                    return elapsed, rows
+                samples = measure(run, args.repeat, args.budget)
+                results.append(report(summarize('route', name, shape, size, samples)))
+            db.close_all()
+    return results
+
+
+def calibrate(rounds=15):
+    """p50 milliseconds of a fixed SQLite workload, a measure of how fast this host is right now"""
+    conn = sqlite3.connect(':memory:')
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        conn.execute('''
+            WITH RECURSIVE n (i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000)
+            SELECT SUM(i % 7), COUNT(DISTINCT i % 1000) FROM n
+        ''').fetchone()
+        times.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return statistics.median(times)
+
+
+def report(result):
+    print(f"{result['kind']:>9}  {result['shape']:>6}  {result['size']:>8}  {result['name']:<48}"
+          f"  {result['p50_ms']:10.3f}  {result['p99_ms']:10.3f}  {result['rows_written']:>8}", flush=True)
+    return result
+
+
+def metadata(args, calibration_ms):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'tree_engine': os.getenv('TREE_ENGINE', 'triggers'),
+        'shapes': args.shapes, 'sizes': args.sizes,
+        'repeat': args.repeat, 'budget': args.budget, 'seed': args.seed,
+        'calibration_ms': round(calibration_ms, 4),
+    }
+
+
+def result_key(result):
+    return result['kind'], result['name'], result['shape'], result['size']
+
+
+def compare(baseline, meta, results, threshold, min_ms):
+    """Print every result also in baseline with its p50 ratio; return the regressions.
+
+    Times are scaled by the ratio of the two calibration_ms values first, so
+    a host that is busier or slower as a whole does not count as a regression.
+    """
+    before = {result_key(result): result for result in baseline['results']}
+    host = meta['calibration_ms'] / baseline['meta']['calibration_ms']
+    regressions = []
+    print(f"\ncompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('created_at')}),"
+          f" host speed x{1 / host:.2f}")
+    for result in results:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        p50 = result['p50_ms'] / host
+        ratio = p50 / old['p50_ms'] if old['p50_ms'] else float('inf')
+        slower = ratio > 1 + threshold and p50 - old['p50_ms'] >= min_ms
+        more_rows = result['rows_written'] > old['rows_written']
+        marker = '!!' if slower or more_rows else '  '
+        print(f"{marker} {result['kind']:>9}  {result['shape']:>6}  {result['size']:>8}  {result['name']:<48}"
+              f"  {old['p50_ms']:10.3f} -> {result['p50_ms']:10.3f}  x{ratio:5.2f}"
+              f"  rows {old['rows_written']} -> {result['rows_written']}")
+        if slower or more_rows:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shapes', default=','.join(SHAPES))
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=10,
+                        help='seconds after which a measurement stops repeating')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='p50 slowdown (0.25 = 25%%) that counts as a regression')
+    parser.add_argument('--min-ms', type=float, default=0.05,
+                        help='smaller p50 slowdowns are noise, whatever the ratio')
+    args = parser.parse_args()
+    args.shapes = args.shapes.split(',')
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    if args.repeat < MIN_SAMPLES:
+        parser.error(f'--repeat must be at least {MIN_SAMPLES}')
+    unknown = set(args.shapes) - set(SHAPES)
+    if unknown:
+        parser.error(f'unknown shapes: {", ".join(sorted(unknown))}')
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            baseline = json.load(f)
+
+    print(f"{'kind':>9}  {'shape':>6}  {'size':>8}  {'name':<48}  {'p50_ms':>10}  {'p99_ms':>10}  {'rows':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        args.tmp = tmp
+        # Calibrated before and after, as the load on a shared host changes
+        calibration_ms = calibrate()
+        results = run_suite(args)
+        calibration_ms = (calibration_ms + calibrate()) / 2
+
+    meta = metadata(args, calibration_ms)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+            f.write('\n')
+    if baseline is not None:
+        regressions = compare(baseline, meta, results, args.threshold, args.min_ms)
+        if regressions:
+            sys.exit(f'{len(regressions)} regressions (p50 more than {args.threshold:.0%} slower, or more rows written)')
+        print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Synthetic nested-set forests for the benchmarks."""
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+from tree_io import insert_rows  # noqa: E402
+
+SHAPES = ('random', 'deep', 'wide', 'forest')
+# Length of the chains hanging from the root of a deep tree
+CHAIN_LENGTH = 100
+# Nodes per tree of a forest
+FOREST_TREE_SIZE = 100
+# Owner of the loaded trees; the benchmarks log in to the API as this user id
+OWNER_ID = 1
+
+
+def create_database(path=':memory:'):
+    """Create a database with the app schema and no tree rows."""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    db.upgrade(conn)
+    return conn
+
+
+def random_tree_rows(size, tree_id=1, max_depth=12, seed=0, first_id=1):
+    """Return (id, tree_id, name, lft, rgt, level, id_path) rows for a random tree in preorder.
+
+    Each new node is attached to a random node on the current root-to-leaf
+    path, which gives a mix of wide and deep subtrees.
+    """
+    rng = random.Random(seed)
+    levels = []
+    depth = 0
+    for _ in range(size):
+        if depth:
+            keep = rng.randint(1, depth) if depth >= max_depth else rng.randint(1, depth + 1)
+            depth = min(depth, keep)
+        levels.append(depth)
+        depth += 1
+    return level_tree_rows(levels, tree_id, first_id)
+
+
+def level_tree_rows(levels, tree_id=1, first_id=1):
+    """Return the rows of the tree whose nodes, in preorder, have these levels.
+
+    levels starts with 0 and grows by at most one from node to node.
+    """
+    rows = []
+    stack = []
+    counter = 1
+    for i, level in enumerate(levels):
+        while len(stack) > level:
+            rows[stack.pop()][4] = counter
+            counter += 1
+        node_id = first_id + i
+        id_path = f'{rows[stack[-1]][6]}.{node_id}' if stack else str(node_id)
+        rows.append([node_id, tree_id, f'Node {i}', counter, None, level, id_path])
+        counter += 1
+        stack.append(len(rows) - 1)
+    while stack:
+        rows[stack.pop()][4] = counter
+        counter += 1
+    return [tuple(row) for row in rows]
+
+
+def load_tree(conn, size, tree_id=1, seed=0):
+    conn.execute(
+        'INSERT INTO trees (tree_id, sort_key, owner_id) VALUES (?, ?, ?)',
+        (tree_id, tree_id * 1024, OWNER_ID)
+    )
+    first_id = conn.execute('SELECT IFNULL(MAX(id), 0) + 1 FROM tree').fetchone()[0]
+    insert_rows(conn, random_tree_rows(size, tree_id=tree_id, seed=seed, first_id=first_id))
+    conn.commit()
+
+
+def load_forest(conn, shape, size, seed=0):
+    """Load size nodes shaped like shape into an empty database.
+
+    random: one random_tree_rows tree; deep: one root with chains of
+    CHAIN_LENGTH nodes below it; wide: one root with size - 1 children;
+    forest: trees of FOREST_TREE_SIZE random nodes.
+    """
+    if shape == 'forest':
+        first_id = 1
+        for tree_id in range(1, -(-size // FOREST_TREE_SIZE) + 1):
+            tree_size = min(FOREST_TREE_SIZE, size - first_id + 1)
+            conn.execute(
+                'INSERT INTO trees (tree_id, sort_key, owner_id) VALUES (?, ?, ?)',
+                (tree_id, tree_id * 1024, OWNER_ID)
+            )
+            insert_rows(conn, random_tree_rows(tree_size, tree_id=tree_id, seed=seed + tree_id, first_id=first_id))
+            first_id += tree_size
+        conn.commit()
+        return
+    if shape == 'random':
+        load_tree(conn, size, seed=seed)
+        return
+    if shape == 'deep':
+        levels = [0] + [1 + (i - 1) % CHAIN_LENGTH for i in range(1, size)]
+    elif shape == 'wide':
+        levels = [0] + [1] * (size - 1)
+    else:
+        raise ValueError(f'Unknown shape: {shape!r}')
+    conn.execute('INSERT INTO trees (tree_id, sort_key, owner_id) VALUES (1, 1024, ?)', (OWNER_ID,))
+    insert_rows(conn, level_tree_rows(levels))
+    conn.commit()
@@ -0,0 +1,139 @@
+"""Compare the JSON and columnar encodings of the node endpoints.
+
+    python benchmarks/wire_format.py [--sizes 10000,100000,1000000] [--repeat 5]
+
+For each size, loads one random tree and requests /api/tree and one page of
+/api/trees/1 in both formats through the Flask test client, with the
+snapshot cache off so that every request encodes. Prints the body size,
+its gzip size, the median server time, and the median time for Node.js to
+turn the body into the array of node objects the UI uses (JSON.parse
+against static/tree-columns.js), plus the columnar decode alone. Parse
+times need `node` on the PATH and are skipped without it.
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import OWNER_ID, create_database, load_tree  # noqa: E402
+
+FORMATS = {
+    'json': 'application/json',
+    'columns': 'application/vnd.sqlitetree.columns',
+}
+
+DECODER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'tree-columns.js')
+
+# Reads the bodies named on the command line and prints one JSON line of
+# median milliseconds per body
+NODE_SCRIPT = '''
+import { readFileSync } from 'node:fs';
+import { decodeColumns, columnsToObjects } from %s;
+
+const repeat = Number(process.argv[2]);
+function median(f) {
+    const times = [];
+    for (let i = 0; i < repeat; i++) {
+        const start = performance.now();
+        f();
+        times.push(performance.now() - start);
+    }
+    times.sort((a, b) => a - b);
+    return times[Math.floor(times.length / 2)];
+}
+const result = {};
+for (const path of process.argv.slice(3)) {
+    const bytes = readFileSync(path);
+    const buffer = bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + bytes.length);
+    if (path.endsWith('.json')) {
+        result[path] = { objects: median(() => JSON.parse(new TextDecoder().decode(buffer))) };
+    } else {
+        result[path] = {
+            objects: median(() => columnsToObjects(decodeColumns(buffer))),
+            decode: median(() => decodeColumns(buffer)),
+        };
+    }
+}
+console.log(JSON.stringify(result));
+'''
+
+
+def request_body(client, url, mimetype, repeat):
+    """(body, median server milliseconds) of GET url in the given format"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url, headers={'Accept': mimetype})
+        times.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+        assert response.mimetype == mimetype, response.mimetype
+    return response.get_data(), statistics.median(times)
+
+
+def parse_times(tmp, paths, repeat):
+    """{path: {'objects': ms, 'decode': ms}} from Node.js, or {} without node"""
+    node = shutil.which('node')
+    if node is None:
+        return {}
+    script = os.path.join(tmp, 'parse.mjs')
+    with open(script, 'w', encoding='utf8') as f:
+        f.write(NODE_SCRIPT % json.dumps('file://' + DECODER))
+    output = subprocess.run([node, script, str(repeat), *paths], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    os.environ['SNAPSHOT_CACHE_BYTES'] = '0'
+    os.environ['TREE_PAGE_SIZE'] = str(max(sizes))
+    with tempfile.TemporaryDirectory() as tmp:
+        import app as tree_app
+        import db
+
+        print(f"{'nodes':>8}  {'endpoint':<14} {'format':<8} {'bytes':>11} {'gzip':>10} "
+              f"{'server_ms':>9} {'parse_ms':>9} {'decode_ms':>9}")
+        for size in sizes:
+            path = os.path.join(tmp, f'{size}.db')
+            conn = create_database(path)
+            load_tree(conn, size, seed=size)
+            conn.close()
+            tree_app.app.config['DATABASE'] = path
+            client = tree_app.app.test_client()
+            with client.session_transaction() as session:
+                session['user_id'] = OWNER_ID
+
+            results = []
+            for endpoint, url in (('/api/tree', '/api/tree'), ('/api/trees/1', f'/api/trees/1?limit={size}')):
+                for fmt, mimetype in FORMATS.items():
+                    body, server_ms = request_body(client, url, mimetype, args.repeat)
+                    body_path = os.path.join(tmp, f'{size}-{len(results)}.{fmt}')
+                    with open(body_path, 'wb') as f:
+                        f.write(body)
+                    results.append((endpoint, fmt, body_path, len(body), len(gzip.compress(body, 6)), server_ms))
+            db.close_all()
+
+            parsed = parse_times(tmp, [r[2] for r in results], args.repeat)
+            for endpoint, fmt, body_path, size_bytes, gzip_bytes, server_ms in results:
+                times = parsed.get(body_path, {})
+                parse_ms = f"{times['objects']:.1f}" if 'objects' in times else '-'
+                decode_ms = f"{times['decode']:.1f}" if 'decode' in times else '-'
+                print(f'{size:>8}  {endpoint:<14} {fmt:<8} {size_bytes:>11} {gzip_bytes:>10} '
+                      f'{server_ms:>9.1f} {parse_ms:>9} {decode_ms:>9}')
+                os.remove(body_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Compare per-request write transactions with the write queue under concurrent editors.
+
+    python benchmarks/write_queue.py [--size 10000] [--threads 1,4,16,64] [--ops 100]
+
+Each of --threads threads sends --ops requests through its own Flask test
+client, alternating PUT /api/nodes/<id> (rename) and POST /api/nodes
+(last-child of the tree's root), as one user. Runs once with WRITE_QUEUE
+off and once on, against a fresh copy of a --size node tree, and prints
+throughput, p50/p99 request latency, failed requests and, for the queue,
+the mean number of writes per transaction. --synchronous sets
+SQLITE_SYNCHRONOUS (FULL makes every commit fsync).
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import OWNER_ID, create_database, load_tree  # noqa: E402
+
+
+def editor(tree_app, ops, size, seed, latencies, failures):
+    client = tree_app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = OWNER_ID
+    rng = random.Random(seed)
+    for i in range(ops):
+        start = time.perf_counter()
+        if i % 2:
+            response = client.post('/api/nodes', json={'target_node_id': 1, 'name': 'Added', 'position': 'last-child'})
+        else:
+            response = client.put(f'/api/nodes/{rng.randint(1, size)}', json={'name': f'Renamed {i}'})
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            failures.append(response.get_json().get('error'))
+
+
+def run(tree_app, threads, ops, size):
+    latencies = []
+    failures = []
+    workers = [
+        threading.Thread(target=editor, args=(tree_app, ops, size, seed, latencies, failures))
+        for seed in range(threads)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+    return seconds, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--threads', default='1,4,16,64')
+    parser.add_argument('--ops', type=int, default=100)
+    parser.add_argument('--synchronous', default='NORMAL')
+    args = parser.parse_args()
+
+    os.environ['SQLITE_SYNCHRONOUS'] = args.synchronous
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        conn = create_database(template)
+        load_tree(conn, args.size, seed=1)
+        conn.close()
+
+        import app as tree_app
+
+        print(f"{'threads':>7}  {'queue':<5} {'ops/s':>8} {'p50_ms':>8} {'p99_ms':>9} {'failed':>6} {'per_txn':>7}")
+        for threads in (int(t) for t in args.threads.split(',')):
+            for queued in (False, True):
+                path = os.path.join(tmp, f'{threads}-{int(queued)}.db')
+                shutil.copy(template, path)
+                tree_app.app.config['DATABASE'] = path
+                tree_app.app.config['WRITE_QUEUE'] = queued
+                # A new writer thread, and so a connection to the new file
+                tree_app.writer = tree_app.write_queue.WriteQueue(tree_app.app.config)
+                seconds, latencies, failures = run(tree_app, threads, args.ops, args.size)
+                count = len(latencies)
+                p99 = statistics.quantiles(latencies, n=100, method='inclusive')[98]
+                stats = tree_app.writer.stats()
+                per_txn = f"{stats['writes'] / stats['groups']:.1f}" if stats['groups'] else '-'
+                print(f'{threads:>7}  {"on" if queued else "off":<5} {count / seconds:>8.0f} '
+                      f'{statistics.median(latencies):>8.1f} {p99:>9.1f} {len(failures):>6} {per_txn:>7}')
+                for error in sorted(set(failures))[:3]:
+                    print(f'         {error}')
+
+
+if __name__ == '__main__':
+    main()
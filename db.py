@@ -0,0 +1,301 @@
+"""SQLite connections with tuned PRAGMAs, reused per thread, and schema migrations.
+
+Every thread (and every process after a fork) keeps one writer connection
+and one read-only connection per database file instead of opening a new
+connection for each request. In WAL mode readers see the last committed
+state and never wait for the write lock; the busy timeout makes writers
+queue for the lock instead of failing with "database is locked".
+Write transactions should start with BEGIN IMMEDIATE so that they take the
+lock up front; a deferred transaction that reads first cannot wait for it.
+"""
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+_local = threading.local()
+
+# PRAGMA name -> app.config key; values come from the environment (see app.py)
+PRAGMAS = (
+    # auto_vacuum must come first: switching to WAL writes the file header
+    ('auto_vacuum', 'SQLITE_AUTO_VACUUM'),
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('temp_store', 'SQLITE_TEMP_STORE'),
+)
+
+# journal_mode and auto_vacuum are properties of the database file and can
+# only be set by a writer; auto_vacuum only takes effect on a new file or
+# after VACUUM (see compact)
+WRITER_ONLY_PRAGMAS = ('journal_mode', 'auto_vacuum')
+
+
+def connect(path, config, readonly=False):
+    """Open a connection to path and apply the PRAGMAs found in config"""
+    timeout = config.get('SQLITE_BUSY_TIMEOUT', 5000) / 1000
+    if readonly:
+        uri = 'file:' + os.path.abspath(path) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, timeout=timeout)
+    else:
+        conn = sqlite3.connect(path, timeout=timeout)
+    conn.row_factory = sqlite3.Row
+    for pragma, key in PRAGMAS:
+        value = config.get(key)
+        if value is None or (readonly and pragma in WRITER_ONLY_PRAGMAS):
+            continue
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    return conn
+
+
+def get_connection(config, readonly=False):
+    """Return this thread's writer or read-only connection to config['DATABASE']"""
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        # Connections must not be shared with a parent process
+        _local.pid = pid
+        _local.connections = {}
+    key = (config['DATABASE'], readonly)
+    conn = _local.connections.get(key)
+    if conn is None:
+        if readonly:
+            # The writer creates the file and switches it to WAL before any reader opens it
+            get_connection(config)
+        conn = connect(config['DATABASE'], config, readonly)
+        _local.connections[key] = conn
+    return conn
+
+
+def release(conn):
+    """Hand a connection back after a request; roll back anything left open"""
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def close_all():
+    """Close every connection this thread holds"""
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+# Migrations
+#
+# migrations/NNNN_name.sql hold tables and indexes and are applied once each,
+# in order, and recorded in schema_version. schema.sql holds the views and
+# triggers; it drops and recreates every object it defines, so it is simply
+# re-applied whenever its checksum differs from the one in schema_objects.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(ROOT, 'migrations')
+SCHEMA_FILE = os.path.join(ROOT, 'schema.sql')
+SEED_FILE = os.path.join(ROOT, 'seed.sql')
+
+BOOKKEEPING = (
+    '''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS schema_objects (
+        name TEXT PRIMARY KEY,
+        checksum TEXT NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''',
+)
+
+
+def read_sql(path):
+    with open(path, encoding='utf8') as f:
+        return f.read()
+
+
+def checksum(sql):
+    return hashlib.sha256(sql.encode('utf8')).hexdigest()
+
+
+def split_statements(sql):
+    """Split a script into statements, keeping CREATE TRIGGER ... END; whole"""
+    statement = ''
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                yield statement
+            statement = ''
+    if statement.strip() and not re.fullmatch(r'(\s|--[^\n]*)*', statement):
+        raise ValueError(f'Incomplete SQL statement: {statement.strip()[:60]!r}')
+
+
+def run_script(conn, sql):
+    """Execute every statement of sql in the caller's transaction.
+
+    Unlike executescript this does not commit first, so a migration and its
+    schema_version row are applied atomically.
+    """
+    for statement in split_statements(sql):
+        conn.execute(statement)
+
+
+def migrations():
+    """Return (version, name, path) for every file in migrations/, in order"""
+    found = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'(\d+)_.*\.sql$', name)
+        if match:
+            found.append((int(match.group(1)), name, os.path.join(MIGRATIONS_DIR, name)))
+    return sorted(found)
+
+
+@functools.lru_cache(maxsize=None)
+def expected_state():
+    """Latest migration version and schema.sql checksum on disk, read once per process"""
+    versions = [version for version, _, _ in migrations()]
+    return max(versions, default=0), checksum(read_sql(SCHEMA_FILE))
+
+
+def current_state(conn):
+    """Applied migration version and schema.sql checksum, or (0, None) for a new database"""
+    try:
+        version = conn.execute('SELECT IFNULL(MAX(version), 0) FROM schema_version').fetchone()[0]
+        row = conn.execute("SELECT checksum FROM schema_objects WHERE name = 'schema.sql'").fetchone()
+    except sqlite3.OperationalError:
+        return 0, None
+    return version, row[0] if row else None
+
+
+def is_current(conn):
+    """O(1) startup check: are all migrations and the current schema.sql applied?"""
+    return current_state(conn) == expected_state()
+
+
+def upgrade(conn):
+    """Apply pending migrations, then schema.sql if it changed. Returns what was applied.
+
+    Each step runs in its own BEGIN IMMEDIATE transaction and re-checks the
+    recorded state after taking the lock, so concurrent upgrades from several
+    workers apply every step exactly once.
+    """
+    applied = []
+    for statement in BOOKKEEPING:
+        conn.execute(statement)
+    conn.commit()
+
+    for version, name, path in migrations():
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                conn.rollback()
+                continue
+            sql = read_sql(path)
+            run_script(conn, sql)
+            conn.execute(
+                'INSERT INTO schema_version (version, name, checksum) VALUES (?, ?, ?)',
+                (version, name, checksum(sql))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(name)
+
+    sql = read_sql(SCHEMA_FILE)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute("SELECT checksum FROM schema_objects WHERE name = 'schema.sql'").fetchone()
+        if row and row[0] == checksum(sql):
+            conn.rollback()
+        else:
+            run_script(conn, sql)
+            conn.execute(
+                "INSERT OR REPLACE INTO schema_objects (name, checksum) VALUES ('schema.sql', ?)",
+                (checksum(sql),)
+            )
+            conn.commit()
+            applied.append('schema.sql')
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def changed_migrations(conn):
+    """Names of applied migrations whose file no longer matches the recorded checksum"""
+    try:
+        recorded = dict(conn.execute('SELECT version, checksum FROM schema_version').fetchall())
+    except sqlite3.OperationalError:
+        return []
+    return [
+        name for version, name, path in migrations()
+        if version in recorded and recorded[version] != checksum(read_sql(path))
+    ]
+
+
+def seed(conn, owner_id):
+    """Replace all trees with the demo data in seed.sql, owned by owner_id"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        run_script(conn, read_sql(SEED_FILE))
+        # seed.sql has no parameters; its trees are created without an owner
+        conn.execute('UPDATE trees SET owner_id = ?', (owner_id,))
+        conn.execute('UPDATE tree_journal SET owner_id = ? WHERE owner_id IS NULL', (owner_id,))
+        conn.execute('INSERT INTO bump_tree_version_operation (tree_id) SELECT tree_id FROM trees')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Maintenance
+#
+# table_retention bounds the append-only tables: triggers in schema.sql trim
+# them as rows are added, and prune() trims them all at once. Deleted rows
+# leave free pages behind; compact() hands those back to the file system.
+
+def prune(conn):
+    """Trim every table in table_retention to its newest keep_rows rows; returns rows deleted per table"""
+    deleted = {}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table, keep in conn.execute('SELECT table_name, keep_rows FROM table_retention').fetchall():
+            deleted[table] = conn.execute(
+                f'DELETE FROM {table} WHERE rowid <= (SELECT MAX(rowid) FROM {table}) - ?', (keep,)
+            ).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
+
+
+def database_size(conn):
+    """(bytes in the database, bytes of those on the free list)"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return pages * page_size, free * page_size
+
+
+def compact(conn, full=False):
+    """Release free pages and refresh planner statistics; returns bytes reclaimed.
+
+    With auto_vacuum=INCREMENTAL this is cheap: incremental_vacuum moves the
+    free pages to the end of the file and truncates it. Databases created
+    before auto_vacuum was set need one full VACUUM (full=True), which
+    rewrites the whole file and switches it to incremental mode.
+    """
+    before = database_size(conn)[0]
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        # execute() would step the pragma once, which frees a single page
+        conn.executescript('PRAGMA incremental_vacuum;')
+    elif full:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    conn.execute('PRAGMA optimize')
+    # In WAL mode the file only shrinks once the log is checkpointed
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    return before - database_size(conn)[0]
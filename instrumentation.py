@@ -0,0 +1,202 @@
+"""Per-request SQL statistics, Prometheus metrics and a slow-request log.
+
+While INSTRUMENTATION is on, the connections a request uses get a trace
+callback, which sees every statement (statements run by triggers, and by
+virtual tables such as FTS5, arrive as "-- ..." comments and count as
+nested), and a progress handler, which is called every
+INSTRUMENTATION_PROGRESS_STEPS virtual machine steps. A statement's time
+runs from its trace callback to the last progress call before the next
+statement starts, so time spent in Python between statements is not
+counted, and a statement shorter than one progress interval counts as
+zero. Rows touched are the connection's total_changes, triggers included.
+
+When it is off no callback is installed and a request costs one config
+lookup. Metrics are kept per process; with several worker processes each
+/metrics scrape sees one of them.
+"""
+import bisect
+import json
+import re
+import sys
+import threading
+import time
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Characters of SQL kept for each statement in the slow-request log
+LOGGED_SQL_CHARS = 500
+
+# The trace callback gets statements with their parameters filled in; the
+# log replaces literals so that it holds no names, emails or hashes
+LITERALS = re.compile(r"'(?:[^']|'')*'|\bX'[0-9A-Fa-f]*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    """sql on one line, with string and number literals replaced by ?"""
+    return LITERALS.sub('?', ' '.join(sql.split()))[:LOGGED_SQL_CHARS]
+
+
+class RequestStats:
+    """SQL statistics of one request, fed by the callbacks of the connections it uses"""
+
+    def __init__(self, keep_statements=5, progress_steps=1000):
+        self.keep_statements = keep_statements
+        self.progress_steps = progress_steps
+        self.statements = 0
+        self.nested_statements = 0
+        self.sql_seconds = 0.0
+        self.steps = 0
+        self.rows_changed = 0
+        self.slowest = []  # (seconds, steps, sql), slowest first
+        self.connections = {}  # connection -> total_changes when attached
+        self.current = None  # [sql, start, last progress time, steps] of the running statement
+
+    def attach(self, conn):
+        if conn in self.connections:
+            return
+        self.connections[conn] = conn.total_changes
+        conn.set_trace_callback(self.on_statement)
+        conn.set_progress_handler(self.on_progress, self.progress_steps)
+
+    def detach(self):
+        """Remove the callbacks and add up the rows each connection changed"""
+        self.finish_statement()
+        for conn, changes in self.connections.items():
+            conn.set_trace_callback(None)
+            conn.set_progress_handler(None, 0)
+            self.rows_changed += conn.total_changes - changes
+        self.connections = {}
+
+    def on_statement(self, sql):
+        if sql.startswith('--'):
+            self.nested_statements += 1
+            return
+        self.finish_statement()
+        now = time.perf_counter()
+        self.statements += 1
+        self.current = [sql, now, now, 0]
+
+    def on_progress(self):
+        current = self.current
+        if current is not None:
+            current[2] = time.perf_counter()
+            current[3] += self.progress_steps
+        # Returning a true value would interrupt the statement
+        return 0
+
+    def finish_statement(self):
+        if self.current is None:
+            return
+        sql, start, end, steps = self.current
+        self.current = None
+        seconds = end - start
+        self.sql_seconds += seconds
+        self.steps += steps
+        if len(self.slowest) < self.keep_statements or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, steps, sql))
+            self.slowest.sort(key=lambda item: -item[0])
+            del self.slowest[self.keep_statements:]
+
+
+class Metrics:
+    """Counters and a duration histogram per endpoint, in Prometheus text format"""
+
+    COUNTERS = ('sql_statements', 'sql_nested_statements', 'sql_seconds', 'sql_rows_changed', 'slow_requests')
+
+    def __init__(self, prefix='sqlitetree'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.endpoints = {}  # endpoint -> {'buckets': [...], 'seconds': ..., counter: ...}
+
+    def record(self, endpoint, method, status, seconds, stats, slow):
+        bucket = bisect.bisect_left(DURATION_BUCKETS, seconds)
+        values = (stats.statements, stats.nested_statements, stats.sql_seconds, stats.rows_changed, int(slow))
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            totals = self.endpoints.get(endpoint)
+            if totals is None:
+                totals = self.endpoints[endpoint] = {
+                    'buckets': [0] * (len(DURATION_BUCKETS) + 1), 'seconds': 0.0,
+                    **{name: 0 for name in self.COUNTERS},
+                }
+            totals['buckets'][bucket] += 1
+            totals['seconds'] += seconds
+            for name, value in zip(self.COUNTERS, values):
+                totals[name] += value
+
+    def render(self):
+        p = self.prefix
+        lines = [
+            f'# HELP {p}_http_requests_total Requests by endpoint, method and status.',
+            f'# TYPE {p}_http_requests_total counter',
+        ]
+        with self.lock:
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'{p}_http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                             f'status="{status}"}} {count}')
+            lines += [
+                f'# HELP {p}_http_request_duration_seconds Time from the first request hook to the response.',
+                f'# TYPE {p}_http_request_duration_seconds histogram',
+            ]
+            for endpoint, totals in sorted(self.endpoints.items()):
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + ('+Inf',), totals['buckets']):
+                    cumulative += count
+                    lines.append(f'{p}_http_request_duration_seconds_bucket{{endpoint="{endpoint}",'
+                                 f'le="{bound}"}} {cumulative}')
+                lines.append(f'{p}_http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {totals["seconds"]:.6f}')
+                lines.append(f'{p}_http_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+            for name, help_text in (
+                ('sql_statements', 'Statements run by requests, not counting those run by triggers.'),
+                ('sql_nested_statements', 'Statements run by triggers and virtual tables during requests.'),
+                ('sql_seconds', 'Time spent in SQLite by requests.'),
+                ('sql_rows_changed', 'Rows inserted, updated or deleted by requests, triggers included.'),
+                ('slow_requests', 'Requests slower than SLOW_REQUEST_MS.'),
+            ):
+                lines += [f'# HELP {p}_{name}_total {help_text}', f'# TYPE {p}_{name}_total counter']
+                for endpoint, totals in sorted(self.endpoints.items()):
+                    value = totals[name]
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{p}_{name}_total{{endpoint="{endpoint}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestLog:
+    """JSON lines, one per slow request, appended to a file or written to stderr"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.path:
+                with open(self.path, 'a', encoding='utf8') as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+                sys.stderr.flush()
+
+
+def slow_request_entry(method, path, endpoint, status, seconds, stats):
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'method': method,
+        'path': path,
+        'endpoint': endpoint,
+        'status': status,
+        'ms': round(seconds * 1000, 3),
+        'sql_ms': round(stats.sql_seconds * 1000, 3),
+        'statements': stats.statements,
+        'nested_statements': stats.nested_statements,
+        'rows_changed': stats.rows_changed,
+        'vm_steps': stats.steps,
+        'slowest': [
+            {'ms': round(seconds * 1000, 3), 'vm_steps': steps, 'sql': normalize_sql(sql)}
+            for seconds, steps, sql in stats.slowest
+        ],
+    }
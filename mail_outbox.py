@@ -0,0 +1,210 @@
+"""Outgoing email queue stored in the email_outbox table.
+
+Request handlers call enqueue() in their own transaction and return; no
+SMTP traffic happens while a request is being served. A Worker drains the
+table in the background: it claims up to MAIL_BATCH_SIZE due messages,
+sends them over one SMTP connection that stays open and logged in between
+batches, and schedules failures for a retry with exponential backoff.
+
+The worker runs as a thread in each app process (MAIL_WORKER=thread) or
+only in `flask mail worker` (MAIL_WORKER=process). Several workers can
+share one database: claiming is done under BEGIN IMMEDIATE, so every
+message is sent by one of them.
+"""
+import smtplib
+import threading
+import time
+
+import db
+
+# Seconds a claimed message is reserved for the worker that claimed it
+CLAIM_SECONDS = 300
+
+
+def enqueue(conn, message):
+    """Queue an EmailMessage; it is sent once the caller commits"""
+    conn.execute(
+        'INSERT INTO email_outbox (recipient, message, next_attempt_at) VALUES (?, ?, ?)',
+        (message['To'], message.as_string(), time.time())
+    )
+
+
+def outbox_status(conn):
+    """Number of messages per status, and the number of pending messages already due"""
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status').fetchall())
+    due = conn.execute(
+        "SELECT COUNT(*) FROM email_outbox WHERE status = 'pending' AND next_attempt_at <= ?",
+        (time.time(),)
+    ).fetchone()[0]
+    return {status: counts.get(status, 0) for status in ('pending', 'sent', 'failed')} | {'due': due}
+
+
+class SMTPConnection:
+    """One SMTP connection that is opened on demand and kept open while in use"""
+
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+        self.last_used = 0.0
+
+    def open(self):
+        config = self.config
+        server = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+        try:
+            if config['MAIL_USE_TLS']:
+                server.starttls()
+            if config['MAIL_USERNAME']:
+                server.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def get(self):
+        """Return a live connection, reusing the open one unless it idled out or was dropped"""
+        if self.server is not None:
+            if time.monotonic() - self.last_used > self.config['MAIL_IDLE_TIMEOUT']:
+                self.close()
+            else:
+                try:
+                    self.server.noop()
+                except (smtplib.SMTPException, OSError):
+                    self.close()
+        if self.server is None:
+            self.server = self.open()
+        self.last_used = time.monotonic()
+        return self.server
+
+    def send(self, recipient, message):
+        sender = self.config['MAIL_DEFAULT_SENDER'] or self.config['MAIL_USERNAME']
+        try:
+            self.get().sendmail(sender, [recipient], message.encode('utf8'))
+        except smtplib.SMTPServerDisconnected:
+            # The server may close a connection between our liveness check and the send
+            self.close()
+            self.get().sendmail(sender, [recipient], message.encode('utf8'))
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+
+def is_permanent(error):
+    """5xx replies (unknown recipient, rejected message) will not succeed on a retry"""
+    return isinstance(error, smtplib.SMTPRecipientsRefused) or (
+        isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+        and not isinstance(error, smtplib.SMTPAuthenticationError)
+    )
+
+
+class Worker:
+    def __init__(self, config):
+        self.config = config
+        self.smtp = SMTPConnection(config)
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def claim(self, conn):
+        """Reserve the next batch of due messages and count the attempt"""
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('''
+                SELECT id, recipient, message, attempts + 1 AS attempts
+                FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', (now, self.config['MAIL_BATCH_SIZE'])).fetchall()
+            conn.executemany(
+                'UPDATE email_outbox SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?',
+                [(now + CLAIM_SECONDS, row['id']) for row in rows]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return rows
+
+    def retry_at(self, attempts):
+        return time.time() + self.config['MAIL_RETRY_BACKOFF'] * 2 ** (attempts - 1)
+
+    def send_batch(self, conn):
+        """Send one batch of due messages; returns how many were claimed"""
+        rows = self.claim(conn)
+        sent = []
+        failed = []  # (status, next_attempt_at, error, id)
+        released = []  # (next_attempt_at, id) of messages that were not tried
+        for i, row in enumerate(rows):
+            try:
+                self.smtp.send(row['recipient'], row['message'])
+                sent.append((row['id'],))
+            except (smtplib.SMTPException, OSError) as e:
+                if is_permanent(e) or row['attempts'] >= self.config['MAIL_MAX_ATTEMPTS']:
+                    failed.append(('failed', None, str(e), row['id']))
+                else:
+                    failed.append(('pending', self.retry_at(row['attempts']), str(e), row['id']))
+                if not is_permanent(e):
+                    # The server is unreachable or refusing us: put the rest of the batch back
+                    self.smtp.close()
+                    released = [(self.retry_at(1), rest['id']) for rest in rows[i + 1:]]
+                    break
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                "UPDATE email_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE id = ?",
+                sent
+            )
+            conn.executemany(
+                'UPDATE email_outbox SET status = ?, next_attempt_at = IFNULL(?, next_attempt_at), '
+                'last_error = ? WHERE id = ?',
+                failed
+            )
+            conn.executemany(
+                'UPDATE email_outbox SET attempts = attempts - 1, next_attempt_at = ? WHERE id = ?',
+                released
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(rows)
+
+    def run(self, stop=None):
+        """Drain the outbox until stop is set, sleeping while nothing is due"""
+        conn = db.get_connection(self.config)
+        while stop is None or not stop.is_set():
+            try:
+                claimed = self.send_batch(conn)
+            except Exception as e:
+                print(f"Error in mail worker: {e}")
+                claimed = 0
+            if claimed < self.config['MAIL_BATCH_SIZE']:
+                if self.wakeup.wait(self.config['MAIL_POLL_INTERVAL']):
+                    self.wakeup.clear()
+                elif time.monotonic() - self.smtp.last_used > self.config['MAIL_IDLE_TIMEOUT']:
+                    self.smtp.close()
+
+    def start(self):
+        """Start this process's background thread unless it is running or MAIL_WORKER is not 'thread'"""
+        if self.config['MAIL_WORKER'] != 'thread' or (self.thread and self.thread.is_alive()):
+            return
+        with self.lock:
+            # Threads do not survive a fork, so each worker process starts its own
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='mail-worker', daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        """Start the background thread if needed and have it check the outbox now"""
+        if self.config['MAIL_WORKER'] != 'thread':
+            return
+        self.start()
+        self.wakeup.set()
@@ -0,0 +1,165 @@
+-- Tables and indexes. Applied once by `flask db upgrade` and recorded in
+-- schema_version; views and triggers live in schema.sql.
+--
+-- Persistent tables are created only if missing, so this also upgrades a
+-- database created by the old schema.sql without touching its rows. The
+-- *_operation_params tables are per-statement scratch space and are always
+-- empty between operations, so they are recreated with the current columns.
+
+-- One row per tree. tree_id is assigned once and never renumbered;
+-- sort_key gives the display order of the trees and is sparse, so moving a
+-- tree among the others updates only its own row. gap > 0 selects gapped
+-- lft/rgt numbering for the tree (see make_gap_room_operation).
+CREATE TABLE IF NOT EXISTS trees (
+    tree_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sort_key INTEGER NOT NULL,
+    gap INTEGER NOT NULL DEFAULT 0 CHECK (gap >= 0)
+);
+
+CREATE INDEX IF NOT EXISTS idx_trees_sort_key ON trees(sort_key);
+
+CREATE TABLE IF NOT EXISTS tree (
+    id INTEGER PRIMARY KEY,
+    tree_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    lft INTEGER NOT NULL,
+    rgt INTEGER NOT NULL,
+    level INTEGER NOT NULL
+);
+
+DROP INDEX IF EXISTS idx_tree_tree_id;
+-- Range and keyset scans within one tree: WHERE tree_id = ? AND lft > ? ORDER BY lft
+CREATE INDEX IF NOT EXISTS idx_tree_tree_id_lft ON tree(tree_id, lft);
+-- Direct children of a node without scanning its whole subtree
+CREATE INDEX IF NOT EXISTS idx_tree_tree_id_level_lft ON tree(tree_id, level, lft);
+-- Nearest lft/rgt value before a point, used by gapped numbering
+CREATE INDEX IF NOT EXISTS idx_tree_tree_id_rgt ON tree(tree_id, rgt);
+CREATE INDEX IF NOT EXISTS idx_tree_lft_rgt ON tree(lft, rgt);
+CREATE INDEX IF NOT EXISTS idx_tree_name ON tree(name);
+
+-- Databases from before the trees table only have tree.tree_id
+INSERT INTO trees (tree_id, sort_key)
+SELECT DISTINCT tree_id, tree_id * 1024 FROM tree
+WHERE tree_id NOT IN (SELECT tree_id FROM trees);
+
+DROP TABLE IF EXISTS add_operation_params;
+CREATE TABLE add_operation_params (
+    shift_point INTEGER,
+    new_level INTEGER,
+    tree_id INTEGER,
+    gap INTEGER,
+    new_lft INTEGER,
+    new_rgt INTEGER
+);
+
+DROP TABLE IF EXISTS gap_operation_params;
+CREATE TABLE gap_operation_params (
+    tree_id INTEGER,
+    target_node_id INTEGER,
+    position TEXT,
+    need INTEGER,  -- number of free lft/rgt values needed at the position
+    gap INTEGER,
+    lo INTEGER,
+    step INTEGER
+);
+
+DROP TABLE IF EXISTS renumber_points;
+CREATE TABLE renumber_points (
+    v INTEGER PRIMARY KEY,
+    r INTEGER NOT NULL
+);
+
+DROP TABLE IF EXISTS move_operation_params;
+CREATE TABLE move_operation_params (
+    node_id INTEGER,
+    node_lft INTEGER,
+    node_rgt INTEGER,
+    node_level INTEGER,
+    node_tree_id INTEGER,
+    node_width INTEGER,
+    node_is_root BOOLEAN,
+    target_node_id INTEGER,
+    target_lft INTEGER,
+    target_rgt INTEGER,
+    target_tree_id INTEGER,
+    target_level INTEGER,
+    target_is_root BOOLEAN,
+    move_operation TEXT,
+    position TEXT,
+    space_target INTEGER,
+    level_change INTEGER,
+    left_right_change INTEGER,
+    right_shift INTEGER,
+    gap INTEGER
+);
+
+-- Filled with SELECT * FROM move_operation_params, so it must keep the same columns
+DROP TABLE IF EXISTS move_operation_params_log;
+CREATE TABLE move_operation_params_log (
+    node_id INTEGER,
+    node_lft INTEGER,
+    node_rgt INTEGER,
+    node_level INTEGER,
+    node_tree_id INTEGER,
+    node_width INTEGER,
+    node_is_root BOOLEAN,
+    target_node_id INTEGER,
+    target_lft INTEGER,
+    target_rgt INTEGER,
+    target_tree_id INTEGER,
+    target_level INTEGER,
+    target_is_root BOOLEAN,
+    move_operation TEXT,
+    position TEXT,
+    space_target INTEGER,
+    level_change INTEGER,
+    left_right_change INTEGER,
+    right_shift INTEGER,
+    gap INTEGER
+);
+
+DROP TABLE IF EXISTS delete_operation_params;
+CREATE TABLE delete_operation_params (
+    node_size INTEGER,
+    node_lft INTEGER,
+    node_rgt INTEGER,
+    node_tree_id INTEGER,
+    node_is_root BOOLEAN,
+    gap INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS last_operation_id (
+    id INTEGER,
+    operation_name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    logtext TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    is_active BOOLEAN DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS registration_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT UNIQUE NOT NULL,
+    user_id INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE IF NOT EXISTS password_reset_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token TEXT UNIQUE NOT NULL,
+    user_id INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
@@ -0,0 +1,12 @@
+-- Change counters for conditional GETs. tree_version.version goes up on
+-- every change to any tree; trees.version is set to the new value whenever
+-- that tree changes, so both only ever increase.
+
+CREATE TABLE IF NOT EXISTS tree_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO tree_version (id, version) VALUES (1, 0);
+
+ALTER TABLE trees ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
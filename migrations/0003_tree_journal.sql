@@ -0,0 +1,16 @@
+-- Append-only log of tree changes, streamed to clients by /api/events.
+-- One row per operation, written by the operation triggers in schema.sql.
+-- kind is insert, move, rename or delete; data is a JSON object describing
+-- the node's new place. old_tree_id is set when a move leaves another tree,
+-- so that the per-tree stream of that tree also sees the move.
+
+CREATE TABLE IF NOT EXISTS tree_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_id INTEGER NOT NULL,
+    old_tree_id INTEGER,
+    version INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    node_id INTEGER,
+    data TEXT NOT NULL DEFAULT '{}',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,20 @@
+-- Outgoing email, written by the request handlers and drained by the mail
+-- worker (mail_outbox.py). message is the complete RFC 5322 text.
+-- A row stays 'pending' until it is sent or runs out of attempts; a worker
+-- claims a row by pushing next_attempt_at past the time the send may take,
+-- so rows claimed by a worker that died are picked up again later.
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    sent_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_pending
+ON email_outbox(next_attempt_at) WHERE status = 'pending';
@@ -0,0 +1,19 @@
+-- Token expiry as an indexed Unix time, so that lookups compare integers in
+-- SQL and the sweeper can delete expired rows with an index range scan.
+-- Existing tokens keep the lifetimes the app used to check in Python:
+-- 24 hours for registration and 1 hour for password reset.
+
+ALTER TABLE registration_tokens ADD COLUMN expires_at INTEGER NOT NULL DEFAULT 0;
+UPDATE registration_tokens
+SET expires_at = CAST(strftime('%s', created_at) AS INTEGER) + 24 * 3600;
+
+ALTER TABLE password_reset_tokens ADD COLUMN expires_at INTEGER NOT NULL DEFAULT 0;
+UPDATE password_reset_tokens
+SET expires_at = CAST(strftime('%s', created_at) AS INTEGER) + 3600;
+
+-- Tokens are replaced by user_id when a new one is issued
+CREATE INDEX IF NOT EXISTS idx_registration_tokens_user_id ON registration_tokens(user_id);
+CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_user_id ON password_reset_tokens(user_id);
+
+CREATE INDEX IF NOT EXISTS idx_registration_tokens_expires_at ON registration_tokens(expires_at);
+CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires_at ON password_reset_tokens(expires_at);
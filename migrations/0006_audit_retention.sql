@@ -0,0 +1,26 @@
+-- Runtime switches for debug tracing and ring-buffer sizes for the
+-- append-only tables. Both are read by triggers in schema.sql, so changing
+-- a row here takes effect at once, without re-applying the schema.
+
+-- trace_moves = 1 copies every step of every move into move_operation_params_log
+CREATE TABLE IF NOT EXISTS debug_settings (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    trace_moves INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO debug_settings (id) VALUES (1);
+
+-- Each listed table keeps about its newest keep_rows rows; tables without a
+-- row here are never trimmed. The add operations read the id they created
+-- back from last_operation_id, so it keeps at least one.
+CREATE TABLE IF NOT EXISTS table_retention (
+    table_name TEXT PRIMARY KEY,
+    keep_rows INTEGER NOT NULL
+        CHECK (keep_rows >= CASE table_name WHEN 'last_operation_id' THEN 1 ELSE 0 END)
+);
+
+INSERT OR IGNORE INTO table_retention (table_name, keep_rows) VALUES
+    ('move_operation_params_log', 10000),
+    ('logs', 10000),
+    ('last_operation_id', 1000),
+    ('tree_journal', 100000);
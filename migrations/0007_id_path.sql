@@ -0,0 +1,32 @@
+-- Materialized path of every node: the ids from its root down to the node,
+-- dot-separated like tree_indented.id_path ('1.5.9'). Kept current by the
+-- add and move operations in schema.sql (refresh_id_path_operation) and
+-- written directly by bulk imports. A node's ancestors are then primary key
+-- lookups instead of an lft/rgt range scan over its tree.
+ALTER TABLE tree ADD COLUMN id_path TEXT NOT NULL DEFAULT '';
+
+WITH RECURSIVE walk (id, tree_id, lft, rgt, level, id_path) AS (
+    SELECT id, tree_id, lft, rgt, level, CAST(id AS TEXT)
+    FROM tree
+    WHERE level = 0
+    UNION ALL
+    SELECT child.id, child.tree_id, child.lft, child.rgt, child.level, walk.id_path || '.' || child.id
+    FROM walk
+    JOIN tree AS child
+        ON child.tree_id = walk.tree_id
+        AND child.level = walk.level + 1
+        AND child.lft > walk.lft AND child.lft < walk.rgt
+)
+UPDATE tree SET id_path = walk.id_path
+FROM walk
+WHERE walk.id = tree.id;
+
+-- Ancestor and containment tests compare both ends of a node; with the other
+-- end in the index they never read the table rows
+DROP INDEX IF EXISTS idx_tree_tree_id_lft;
+CREATE INDEX IF NOT EXISTS idx_tree_tree_id_lft_rgt ON tree(tree_id, lft, rgt);
+DROP INDEX IF EXISTS idx_tree_tree_id_rgt;
+CREATE INDEX IF NOT EXISTS idx_tree_tree_id_rgt_lft ON tree(tree_id, rgt, lft);
+-- lft/rgt values are only comparable within a tree, so every lookup names
+-- one; an index that does not start with tree_id spans all trees
+DROP INDEX IF EXISTS idx_tree_lft_rgt;
@@ -0,0 +1,14 @@
+-- Full-text index of node names for /api/search. tree_fts stores only the
+-- index and reads the names from tree (external content, rowid = tree.id);
+-- the triggers in schema.sql keep it in step with inserts, renames and
+-- deletes. prefix='2 3' indexes short prefixes so that the partly typed
+-- last word of a query is one index lookup.
+CREATE VIRTUAL TABLE IF NOT EXISTS tree_fts USING fts5(
+    name,
+    content='tree',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+INSERT INTO tree_fts (tree_fts) VALUES ('rebuild');
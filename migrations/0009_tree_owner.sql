@@ -0,0 +1,36 @@
+-- Trees belong to a user. API requests only see and change the trees of
+-- the logged-in user; each owner's trees have their own sort_key order and
+-- their own change counter in workspace_version, so one user's edits do not
+-- invalidate the forest-wide ETags of another. Nodes do not carry the owner:
+-- every node query already names one tree, which belongs to one owner.
+ALTER TABLE trees ADD COLUMN owner_id INTEGER REFERENCES users(id);
+
+-- Until now every user saw every tree; they go to the first account
+UPDATE trees SET owner_id = (SELECT MIN(id) FROM users);
+
+DROP INDEX IF EXISTS idx_trees_sort_key;
+CREATE INDEX IF NOT EXISTS idx_trees_owner_id_sort_key ON trees(owner_id, sort_key);
+
+-- Set to tree_version.version whenever one of the owner's trees changes
+-- (see bump_tree_version_operation), so it only ever increases
+CREATE TABLE IF NOT EXISTS workspace_version (
+    owner_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO workspace_version (owner_id, version)
+SELECT DISTINCT owner_id, (SELECT version FROM tree_version) FROM trees
+WHERE owner_id IS NOT NULL;
+
+-- /api/events streams one owner's entries
+ALTER TABLE tree_journal ADD COLUMN owner_id INTEGER;
+
+UPDATE tree_journal SET owner_id = IFNULL(
+    (SELECT owner_id FROM trees WHERE trees.tree_id = tree_journal.tree_id),
+    (SELECT MIN(id) FROM users)
+);
+
+CREATE INDEX IF NOT EXISTS idx_tree_journal_owner_id_id ON tree_journal(owner_id, id);
+
+-- A deleted root takes its trees row with it before the journal entry is written
+ALTER TABLE delete_operation_params ADD COLUMN owner_id INTEGER;
@@ -0,0 +1,103 @@
+"""Password hashing with configurable cost, run in a bounded process pool.
+
+Hashing is deliberately slow and CPU-bound; done on a request thread it
+holds the GIL and stalls every other request in the process. With
+PASSWORD_HASH_WORKERS > 0 it runs in that many worker processes instead,
+and request threads only wait on the result.
+
+PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH take Werkzeug's method
+strings, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'. Hashes made
+with other parameters still verify, and needs_rehash() tells login() to
+replace them.
+"""
+import functools
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_method(method):
+    """The method string Werkzeug stores for method, with every parameter filled in"""
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+class PasswordHasher:
+    def __init__(self, config):
+        self.config = config
+        self.pool = None
+        self.pool_pid = None
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        """This process's worker pool, or None to hash on the calling thread"""
+        workers = self.config['PASSWORD_HASH_WORKERS']
+        if workers <= 0:
+            return None
+        with self.lock:
+            # A pool inherited through fork belongs to the parent process
+            if self.pool is None or self.pool_pid != os.getpid():
+                # spawn, not fork: forking a process that runs threads can copy held locks
+                self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+                self.pool_pid = os.getpid()
+            return self.pool
+
+    def run(self, func, *args):
+        pool = self.get_pool()
+        if pool is None:
+            return func(*args)
+        return pool.submit(func, *args).result()
+
+    def hash(self, password):
+        return self.run(
+            generate_password_hash, password,
+            self.config['PASSWORD_HASH_METHOD'], self.config['PASSWORD_SALT_LENGTH']
+        )
+
+    def verify(self, stored_hash, password):
+        return self.run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """Was stored_hash made with a different method, cost or salt length than configured?"""
+        method, _, rest = stored_hash.partition('$')
+        salt = rest.partition('$')[0]
+        return (method != canonical_method(self.config['PASSWORD_HASH_METHOD'])
+                or len(salt) != self.config['PASSWORD_SALT_LENGTH'])
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None and self.pool_pid == os.getpid():
+                self.pool.shutdown()
+            self.pool = None
+
+
+def benchmark(method, salt_length=16, rounds=20):
+    """Time hashing and verifying on this thread; returns p50/p99 in milliseconds"""
+    hash_times = []
+    verify_times = []
+    for i in range(rounds):
+        password = f'benchmark-password-{i}'
+        start = time.perf_counter()
+        stored_hash = generate_password_hash(password, method, salt_length)
+        hash_times.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        check_password_hash(stored_hash, password)
+        verify_times.append((time.perf_counter() - start) * 1000)
+    return {
+        'method': canonical_method(method),
+        'hash_p50': percentile(hash_times, 50),
+        'hash_p99': percentile(hash_times, 99),
+        'verify_p50': percentile(verify_times, 50),
+        'verify_p99': percentile(verify_times, 99),
+    }
+
+
+def percentile(values, p):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
@@ -1,76 +1,16 @@
-DROP TABLE IF EXISTS tree;
-CREATE TABLE tree (
-    id INTEGER PRIMARY KEY,
-    tree_id INTEGER NOT NULL,
-    name TEXT NOT NULL,
-    lft INTEGER NOT NULL,
-    rgt INTEGER NOT NULL,
-    level INTEGER NOT NULL
-);
-
-DROP INDEX IF EXISTS idx_tree_tree_id;
-DROP INDEX IF EXISTS idx_tree_lft_rgt;
-DROP INDEX IF EXISTS idx_tree_name;
-CREATE INDEX idx_tree_tree_id ON tree(tree_id);
-CREATE INDEX idx_tree_lft_rgt ON tree(lft, rgt);
-CREATE INDEX idx_tree_name ON tree(name);
-
-DROP TABLE IF EXISTS add_operation_params;
-CREATE TABLE add_operation_params (
-    shift_point INTEGER,
-    new_level INTEGER,
-    tree_id INTEGER
-);
-
-DROP TABLE IF EXISTS move_operation_params;
-CREATE TABLE move_operation_params (
-    node_id INTEGER,
-    node_lft INTEGER,
-    node_rgt INTEGER,
-    node_level INTEGER,
-    node_tree_id INTEGER,
-    node_width INTEGER,
-    node_is_root BOOLEAN,
-    target_node_id INTEGER,
-    target_lft INTEGER,
-    target_rgt INTEGER,
-    target_tree_id INTEGER,
-    target_level INTEGER,
-    target_is_root BOOLEAN,
-    move_operation TEXT,
-    position TEXT,
-    space_target INTEGER,
-    level_change INTEGER,
-    left_right_change INTEGER,
-    right_shift INTEGER
-);
-
-DROP TABLE IF EXISTS move_operation_params_log;
-CREATE TABLE move_operation_params_log (
-    node_id INTEGER,
-    node_lft INTEGER,
-    node_rgt INTEGER,
-    node_level INTEGER,
-    node_tree_id INTEGER,
-    node_width INTEGER,
-    node_is_root BOOLEAN,
-    target_node_id INTEGER,
-    target_lft INTEGER,
-    target_rgt INTEGER,
-    target_tree_id INTEGER,
-    target_level INTEGER,
-    target_is_root BOOLEAN,
-    move_operation TEXT,
-    position TEXT,
-    space_target INTEGER,
-    level_change INTEGER,
-    left_right_change INTEGER,
-    right_shift INTEGER
-);
-
+-- Views and triggers: the *_operation views and their INSTEAD OF triggers
+-- that implement the nested-set operations, plus tree_indented.
+--
+-- Every object is dropped and recreated, so the file can be applied any
+-- number of times without touching data. `flask db upgrade` re-applies it
+-- after the migrations in migrations/ whenever its checksum changes.
+
+-- Debug tracing of moves, off unless debug_settings.trace_moves is set
+-- (`flask db trace on`)
 DROP TRIGGER IF EXISTS log_move_operation_params_after_update;
 CREATE TRIGGER log_move_operation_params_after_update
 AFTER UPDATE ON move_operation_params
+WHEN (SELECT trace_moves FROM debug_settings)
 BEGIN
     INSERT INTO move_operation_params_log
     SELECT * FROM move_operation_params WHERE rowid = NEW.rowid;
@@ -79,43 +19,249 @@ END;
 DROP TRIGGER IF EXISTS log_move_operation_params_after_insert;
 CREATE TRIGGER log_move_operation_params_after_insert
 AFTER INSERT ON move_operation_params
+WHEN (SELECT trace_moves FROM debug_settings)
 BEGIN
     INSERT INTO move_operation_params_log
     SELECT * FROM move_operation_params WHERE rowid = NEW.rowid;
 END;
 
-DROP TABLE IF EXISTS delete_operation_params;
-CREATE TABLE delete_operation_params (
-    node_size INTEGER,
-    node_lft INTEGER,
-    node_rgt INTEGER,
-    node_tree_id INTEGER,
-    node_is_root BOOLEAN
-);
+-- Ring buffers: every 100th insert trims the table to its newest
+-- table_retention.keep_rows rows, so trimming costs one range delete per
+-- hundred rows. Rows are appended with increasing rowids.
+DROP TRIGGER IF EXISTS move_operation_params_log_trim;
+CREATE TRIGGER move_operation_params_log_trim
+AFTER INSERT ON move_operation_params_log
+WHEN NEW.rowid % 100 = 0
+BEGIN
+    DELETE FROM move_operation_params_log
+    WHERE rowid <= NEW.rowid - (
+        SELECT keep_rows FROM table_retention WHERE table_name = 'move_operation_params_log'
+    );
+END;
+
+DROP TRIGGER IF EXISTS logs_trim;
+CREATE TRIGGER logs_trim
+AFTER INSERT ON logs
+WHEN NEW.rowid % 100 = 0
+BEGIN
+    DELETE FROM logs
+    WHERE rowid <= NEW.rowid - (SELECT keep_rows FROM table_retention WHERE table_name = 'logs');
+END;
+
+DROP TRIGGER IF EXISTS last_operation_id_trim;
+CREATE TRIGGER last_operation_id_trim
+AFTER INSERT ON last_operation_id
+WHEN NEW.rowid % 100 = 0
+BEGIN
+    -- Always keeps NEW: the add operations read their new id back from it
+    DELETE FROM last_operation_id
+    WHERE rowid <= NEW.rowid - MAX(
+        (SELECT keep_rows FROM table_retention WHERE table_name = 'last_operation_id'), 1
+    );
+END;
+
+DROP TRIGGER IF EXISTS tree_journal_trim;
+CREATE TRIGGER tree_journal_trim
+AFTER INSERT ON tree_journal
+WHEN NEW.id % 100 = 0
+BEGIN
+    DELETE FROM tree_journal
+    WHERE id <= NEW.id - (SELECT keep_rows FROM table_retention WHERE table_name = 'tree_journal');
+END;
+
+-- Record a change to tree NEW.tree_id: bump the global counter and stamp
+-- the tree and its owner's workspace with it. The read endpoints use these
+-- as ETags.
+DROP VIEW IF EXISTS bump_tree_version_operation;
+CREATE VIEW bump_tree_version_operation (tree_id) AS
+    SELECT NULL WHERE 0;
+
+DROP TRIGGER IF EXISTS bump_tree_version_operation_insert;
+CREATE TRIGGER bump_tree_version_operation_insert
+INSTEAD OF INSERT ON bump_tree_version_operation
+BEGIN
+    UPDATE tree_version SET version = version + 1;
+    UPDATE trees SET version = (SELECT version FROM tree_version)
+    WHERE tree_id = NEW.tree_id;
+    INSERT INTO workspace_version (owner_id, version)
+    SELECT owner_id, (SELECT version FROM tree_version) FROM trees
+    WHERE tree_id = NEW.tree_id AND owner_id IS NOT NULL
+    ON CONFLICT (owner_id) DO UPDATE SET version = excluded.version;
+END;
 
-DROP TABLE IF EXISTS last_operation_id;
-CREATE TABLE last_operation_id (
-    id INTEGER,
-    operation_name TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+-- New, removed and reordered trees change the forest even without node
+-- operations (bulk import, emptied trees, place_tree_operation)
+DROP TRIGGER IF EXISTS trees_version_after_insert;
+CREATE TRIGGER trees_version_after_insert
+AFTER INSERT ON trees
+BEGIN
+    INSERT INTO bump_tree_version_operation (tree_id) VALUES (NEW.tree_id);
+END;
 
+DROP TRIGGER IF EXISTS trees_version_after_delete;
+CREATE TRIGGER trees_version_after_delete
+AFTER DELETE ON trees
+BEGIN
+    INSERT INTO bump_tree_version_operation (tree_id) VALUES (OLD.tree_id);
+    -- The row is gone, so the bump cannot find the owner
+    INSERT INTO workspace_version (owner_id, version)
+    SELECT OLD.owner_id, version FROM tree_version
+    WHERE OLD.owner_id IS NOT NULL
+    ON CONFLICT (owner_id) DO UPDATE SET version = excluded.version;
+END;
+
+DROP TRIGGER IF EXISTS trees_version_after_sort_key_update;
+CREATE TRIGGER trees_version_after_sort_key_update
+AFTER UPDATE OF sort_key ON trees
+BEGIN
+    INSERT INTO bump_tree_version_operation (tree_id) VALUES (NEW.tree_id);
+END;
+
+-- Record NEW.kind for node NEW.node_id in tree_journal, with the node's
+-- current row and its place for clients that show the tree: the parent id
+-- and the index among the parent's children (or among the roots). NEW.data
+-- is merged into the entry. Call it after bump_tree_version_operation so the
+-- entry carries the version the change produced.
+DROP VIEW IF EXISTS journal_node_operation;
+CREATE VIEW journal_node_operation (kind, node_id, old_tree_id, data) AS
+    SELECT NULL, NULL, NULL, NULL WHERE 0;
+
+DROP TRIGGER IF EXISTS journal_node_operation_insert;
+CREATE TRIGGER journal_node_operation_insert
+INSTEAD OF INSERT ON journal_node_operation
+BEGIN
+    INSERT INTO tree_journal (tree_id, old_tree_id, owner_id, version, kind, node_id, data)
+    WITH
+    node AS (SELECT * FROM tree WHERE id = NEW.node_id),
+    parent AS (
+        SELECT p.id, p.lft FROM tree AS p, node
+        WHERE p.tree_id = node.tree_id AND p.level = node.level - 1 AND p.lft < node.lft
+        ORDER BY p.lft DESC
+        LIMIT 1
+    )
+    SELECT
+        node.tree_id,
+        NULLIF(NEW.old_tree_id, node.tree_id),
+        (SELECT owner_id FROM trees WHERE tree_id = node.tree_id),
+        (SELECT version FROM tree_version),
+        NEW.kind,
+        node.id,
+        json_patch(
+            json_object(
+                'node', json_object(
+                    'id', node.id, 'tree_id', node.tree_id, 'name', node.name,
+                    'lft', node.lft, 'rgt', node.rgt, 'level', node.level,
+                    'has_children', json(CASE WHEN EXISTS (
+                        SELECT 1 FROM tree AS child
+                        WHERE child.tree_id = node.tree_id AND child.level = node.level + 1
+                          AND child.lft > node.lft AND child.lft < node.rgt
+                    ) THEN 'true' ELSE 'false' END)
+                ),
+                'parent_id', (SELECT id FROM parent),
+                'position', CASE
+                    WHEN node.level = 0 THEN (
+                        SELECT COUNT(*) FROM trees AS own, trees AS other
+                        WHERE own.tree_id = node.tree_id
+                          AND other.owner_id IS own.owner_id AND other.sort_key < own.sort_key
+                    )
+                    ELSE (
+                        SELECT COUNT(*) FROM tree AS sibling, parent
+                        WHERE sibling.tree_id = node.tree_id AND sibling.level = node.level
+                          AND sibling.lft > parent.lft AND sibling.lft < node.lft
+                    )
+                END
+            ),
+            IFNULL(NEW.data, '{}')
+        )
+    FROM node;
+END;
+
+-- Recompute tree.id_path for NEW.node_id and its subtree from the parent's
+-- path. Call it after a node is added or moved; a subtree that kept its
+-- parent is left alone.
+DROP VIEW IF EXISTS refresh_id_path_operation;
+CREATE VIEW refresh_id_path_operation (node_id) AS
+    SELECT NULL WHERE 0;
+
+DROP TRIGGER IF EXISTS refresh_id_path_operation_insert;
+CREATE TRIGGER refresh_id_path_operation_insert
+INSTEAD OF INSERT ON refresh_id_path_operation
+BEGIN
+    UPDATE tree
+    SET id_path = paths.new_path || substr(tree.id_path, length(paths.old_path) + 1)
+    FROM (
+        SELECT node.tree_id, node.lft, node.rgt, node.id_path AS old_path,
+            IFNULL((
+                SELECT p.id_path || '.' FROM tree AS p
+                WHERE p.tree_id = node.tree_id AND p.level = node.level - 1 AND p.lft < node.lft
+                ORDER BY p.lft DESC
+                LIMIT 1
+            ), '') || node.id AS new_path
+        FROM tree AS node
+        WHERE node.id = NEW.node_id
+    ) AS paths
+    WHERE paths.new_path <> paths.old_path
+      AND tree.tree_id = paths.tree_id AND tree.lft BETWEEN paths.lft AND paths.rgt;
+END;
+
+-- Keep the full-text index tree_fts in step with tree.name. Moves only
+-- change lft/rgt/level/tree_id and do not touch it.
+DROP TRIGGER IF EXISTS tree_fts_after_insert;
+CREATE TRIGGER tree_fts_after_insert
+AFTER INSERT ON tree
+BEGIN
+    INSERT INTO tree_fts (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+
+DROP TRIGGER IF EXISTS tree_fts_after_delete;
+CREATE TRIGGER tree_fts_after_delete
+AFTER DELETE ON tree
+BEGIN
+    INSERT INTO tree_fts (tree_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+END;
+
+DROP TRIGGER IF EXISTS tree_fts_after_rename;
+CREATE TRIGGER tree_fts_after_rename
+AFTER UPDATE OF name ON tree
+BEGIN
+    INSERT INTO tree_fts (tree_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    INSERT INTO tree_fts (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+
+-- Renames are plain UPDATEs of tree.name
+DROP TRIGGER IF EXISTS tree_version_after_rename;
+CREATE TRIGGER tree_version_after_rename
+AFTER UPDATE OF name ON tree
+BEGIN
+    INSERT INTO bump_tree_version_operation (tree_id) VALUES (NEW.tree_id);
+    INSERT INTO journal_node_operation (kind, node_id) VALUES ('rename', NEW.id);
+END;
 
 -- Dummy view for update/insert triggers
 DROP VIEW IF EXISTS add_root_operation;
-CREATE VIEW add_root_operation (name) AS
-    SELECT NULL WHERE 0;
+CREATE VIEW add_root_operation (name, gap, owner_id) AS
+    SELECT NULL, NULL, NULL WHERE 0;
 
 DROP TRIGGER IF EXISTS add_root_operation_insert;
 CREATE TRIGGER add_root_operation_insert INSTEAD OF INSERT ON add_root_operation
 BEGIN
+    -- New trees go after the owner's other trees
+    INSERT INTO trees (sort_key, gap, owner_id)
+    SELECT IFNULL(MAX(sort_key), 0) + 1024, IFNULL(NEW.gap, 0), NEW.owner_id FROM trees
+    WHERE owner_id IS NEW.owner_id;
+
     INSERT INTO tree (tree_id, name, lft, rgt, level)
-    WITH max_tree_id AS (
-        SELECT IFNULL(MAX(tree_id), 0) + 1 AS new_tree_id FROM tree
-    )
-    SELECT new_tree_id, NEW.name, 1, 2, 0 FROM max_tree_id;
+    VALUES (
+        last_insert_rowid(), NEW.name, 1,
+        CASE WHEN NEW.gap > 0 THEN 1 + 3 * NEW.gap ELSE 2 END,
+        0
+    );
     INSERT INTO last_operation_id (id, operation_name)
     VALUES (last_insert_rowid(), 'add_root');
+    INSERT INTO refresh_id_path_operation (node_id)
+    SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1;
+    INSERT INTO journal_node_operation (kind, node_id)
+    SELECT 'insert', id FROM last_operation_id ORDER BY rowid DESC LIMIT 1;
 END;
 
 DROP VIEW IF EXISTS add_node_operation;
@@ -125,7 +271,12 @@ CREATE VIEW add_node_operation (target_node_id, name, position) AS
 DROP TRIGGER IF EXISTS add_node_operation_insert;
 CREATE TRIGGER add_node_operation_insert INSTEAD OF INSERT ON add_node_operation
 BEGIN
-    INSERT INTO add_operation_params (shift_point, new_level, tree_id)
+    -- A tree has one root; new trees are added through add_root_operation
+    SELECT RAISE(ABORT, 'Cannot add a sibling of a root node')
+    FROM tree
+    WHERE id = NEW.target_node_id AND level = 0 AND NEW.position IN ('left', 'right');
+
+    INSERT INTO add_operation_params (shift_point, new_level, tree_id, gap)
     WITH 
     targ AS (
         SELECT * FROM tree WHERE id = NEW.target_node_id
@@ -146,40 +297,184 @@ BEGIN
             END AS new_level
         FROM targ
     )
-    SELECT shift.shift_point, shift.new_level, targ.tree_id FROM shift, targ;
+    SELECT shift.shift_point, shift.new_level, targ.tree_id,
+        COALESCE((SELECT gap FROM trees WHERE trees.tree_id = targ.tree_id), 0)
+    FROM shift, targ;
 
+    -- Contiguous numbering: shift everything right of the insertion point
     INSERT INTO create_space_operation ( size, target_point, tree_id)
     SELECT 2, shift_point - 1, tree_id
-    FROM add_operation_params;
+    FROM add_operation_params
+    WHERE gap = 0;
+
+    UPDATE add_operation_params
+    SET new_lft = shift_point, new_rgt = shift_point + 1
+    WHERE gap = 0;
+
+    -- Gapped numbering: take two free values between the neighbouring points
+    INSERT INTO gap_operation_params (tree_id, target_node_id, position, need, gap)
+    SELECT tree_id, NEW.target_node_id, NEW.position, 2, gap
+    FROM add_operation_params
+    WHERE gap > 0;
+
+    INSERT INTO make_gap_room_operation (should_run)
+    SELECT 1 FROM gap_operation_params;
+
+    UPDATE add_operation_params
+    SET new_lft = (SELECT lo + step FROM gap_operation_params),
+        new_rgt = (SELECT lo + 2 * step FROM gap_operation_params)
+    WHERE gap > 0;
+    DELETE FROM gap_operation_params;
 
     INSERT INTO tree (tree_id, name, lft, rgt, level)
-    SELECT tree_id, NEW.name, shift_point, shift_point + 1, new_level
+    SELECT tree_id, NEW.name, new_lft, new_rgt, new_level
     FROM add_operation_params;
     INSERT INTO last_operation_id (id, operation_name)
     VALUES (last_insert_rowid(), 'add_node');
+    INSERT INTO refresh_id_path_operation (node_id)
+    SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1;
+    INSERT INTO bump_tree_version_operation (tree_id)
+    SELECT tree_id FROM add_operation_params;
+    -- Contiguous trees shift every point from the new node's lft on by 2
+    INSERT INTO journal_node_operation (kind, node_id, data)
+    SELECT 'insert', (SELECT id FROM last_operation_id ORDER BY rowid DESC LIMIT 1),
+        json_object('shift', json_object('from', new_lft, 'by', CASE WHEN gap = 0 THEN 2 ELSE 0 END))
+    FROM add_operation_params;
     DELETE FROM add_operation_params;
 END;
 
-DROP VIEW IF EXISTS manage_space_operation;
-CREATE VIEW manage_space_operation (space, target_point, tree_id) AS    
+-- Free interval (lo, hi) at the position described by gap_operation_params:
+-- the two neighbouring lft/rgt values in the target's tree
+DROP VIEW IF EXISTS gap_bounds;
+CREATE VIEW gap_bounds (tree_id, lo, hi, need, gap) AS
+    SELECT
+        p.tree_id,
+        CASE
+            WHEN p.position = 'first-child' THEN x.lft
+            WHEN p.position = 'right' THEN x.rgt
+            WHEN p.position = 'last-child' THEN (
+                SELECT MAX(v) FROM (
+                    SELECT MAX(lft) AS v FROM tree WHERE tree_id = x.tree_id AND lft < x.rgt
+                    UNION ALL
+                    SELECT MAX(rgt) FROM tree WHERE tree_id = x.tree_id AND rgt < x.rgt
+                )
+            )
+            WHEN p.position = 'left' THEN (
+                SELECT MAX(v) FROM (
+                    SELECT MAX(lft) AS v FROM tree WHERE tree_id = x.tree_id AND lft < x.lft
+                    UNION ALL
+                    SELECT MAX(rgt) FROM tree WHERE tree_id = x.tree_id AND rgt < x.lft
+                )
+            )
+        END AS lo,
+        CASE
+            WHEN p.position = 'last-child' THEN x.rgt
+            WHEN p.position = 'left' THEN x.lft
+            WHEN p.position = 'first-child' THEN (
+                SELECT MIN(v) FROM (
+                    SELECT MIN(lft) AS v FROM tree WHERE tree_id = x.tree_id AND lft > x.lft
+                    UNION ALL
+                    SELECT MIN(rgt) FROM tree WHERE tree_id = x.tree_id AND rgt > x.lft
+                )
+            )
+            WHEN p.position = 'right' THEN (
+                SELECT MIN(v) FROM (
+                    SELECT MIN(lft) AS v FROM tree WHERE tree_id = x.tree_id AND lft > x.rgt
+                    UNION ALL
+                    SELECT MIN(rgt) FROM tree WHERE tree_id = x.tree_id AND rgt > x.rgt
+                )
+            )
+        END AS hi,
+        p.need,
+        p.gap
+    FROM gap_operation_params AS p
+    JOIN tree AS x ON x.id = p.target_node_id;
+
+-- Spread the lft/rgt values of the subtree [lft, rgt] evenly, step apart,
+-- starting at lft. tail is extra room left before the subtree root's rgt.
+DROP VIEW IF EXISTS renumber_subtree_operation;
+CREATE VIEW renumber_subtree_operation (tree_id, lft, rgt, step, tail) AS
     SELECT NULL WHERE 0;
 
-DROP TRIGGER IF EXISTS manage_space_operation_insert;
-CREATE TRIGGER manage_space_operation_insert INSTEAD OF INSERT ON manage_space_operation
+DROP TRIGGER IF EXISTS renumber_subtree_operation_insert;
+CREATE TRIGGER renumber_subtree_operation_insert
+INSTEAD OF INSERT ON renumber_subtree_operation
 BEGIN
+    INSERT INTO renumber_points (v, r)
+    SELECT v, ROW_NUMBER() OVER (ORDER BY v) - 1
+    FROM (
+        SELECT lft AS v FROM tree
+        WHERE tree_id = NEW.tree_id AND lft BETWEEN NEW.lft AND NEW.rgt
+        UNION ALL
+        SELECT rgt FROM tree
+        WHERE tree_id = NEW.tree_id AND lft BETWEEN NEW.lft AND NEW.rgt
+    );
+
     UPDATE tree
-    SET lft = CASE
-        WHEN lft > NEW.target_point THEN lft + NEW.space
-        ELSE lft
-    END,
-    rgt = CASE
-        WHEN rgt > NEW.target_point THEN rgt + NEW.space
-        ELSE rgt
-    END
-    WHERE tree_id = NEW.tree_id AND (lft > NEW.target_point OR rgt > NEW.target_point);
+    SET
+        lft = NEW.lft + (SELECT r FROM renumber_points WHERE v = tree.lft) * NEW.step,
+        rgt = NEW.lft + (SELECT r FROM renumber_points WHERE v = tree.rgt) * NEW.step
+            + CASE WHEN tree.rgt = NEW.rgt THEN NEW.tail ELSE 0 END
+    WHERE tree_id = NEW.tree_id AND lft BETWEEN NEW.lft AND NEW.rgt;
+
+    DELETE FROM renumber_points;
 END;
 
+-- Make sure gap_bounds has room for gap_operation_params.need values, then
+-- store where they go (lo) and how far apart (step) in gap_operation_params
+DROP VIEW IF EXISTS make_gap_room_operation;
+CREATE VIEW make_gap_room_operation (should_run) AS
+    SELECT NULL WHERE 0;
+
+DROP TRIGGER IF EXISTS make_gap_room_operation_insert;
+CREATE TRIGGER make_gap_room_operation_insert
+INSTEAD OF INSERT ON make_gap_room_operation
+BEGIN
+    SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
+
+    -- Out of room: renumber the innermost enclosing subtree whose own
+    -- interval is wide enough to leave need values between every point
+    INSERT INTO renumber_subtree_operation (tree_id, lft, rgt, step, tail)
+    SELECT tree_id, lft, rgt, step, 0
+    FROM (
+        SELECT
+            anchor.tree_id, anchor.lft, anchor.rgt, bounds.need,
+            (anchor.rgt - anchor.lft) / (2 * (
+                SELECT COUNT(*) FROM tree
+                WHERE tree.tree_id = anchor.tree_id AND tree.lft BETWEEN anchor.lft AND anchor.rgt
+            ) - 1) AS step
+        FROM gap_bounds AS bounds, tree AS anchor
+        WHERE bounds.hi - bounds.lo <= bounds.need
+            AND anchor.tree_id = bounds.tree_id
+            AND anchor.lft <= bounds.lo
+            AND anchor.rgt >= bounds.hi
+    )
+    WHERE step > need
+    ORDER BY lft DESC
+    LIMIT 1;
 
+    -- Still out of room: renumber the whole tree and double the room left
+    -- at the end of the root, so appends stay cheap (amortized)
+    INSERT INTO renumber_subtree_operation (tree_id, lft, rgt, step, tail)
+    SELECT
+        anchor.tree_id, anchor.lft, anchor.rgt,
+        MAX(bounds.gap, bounds.need + 1),
+        2 * (
+            SELECT COUNT(*) FROM tree
+            WHERE tree.tree_id = anchor.tree_id AND tree.lft BETWEEN anchor.lft AND anchor.rgt
+        ) * MAX(bounds.gap, bounds.need + 1)
+    FROM gap_bounds AS bounds, tree AS anchor
+    WHERE bounds.hi - bounds.lo <= bounds.need
+        AND anchor.tree_id = bounds.tree_id
+        AND anchor.lft <= bounds.lo
+        AND anchor.rgt >= bounds.hi
+    ORDER BY anchor.lft ASC
+    LIMIT 1;
+
+    UPDATE gap_operation_params
+    SET lo = (SELECT lo FROM gap_bounds),
+        step = (SELECT MIN(gap, (hi - lo) / (need + 1)) FROM gap_bounds);
+END;
 
 DROP VIEW IF EXISTS move_node_operation;
 CREATE VIEW move_node_operation (node_id, target_node_id, position) AS
@@ -188,13 +483,20 @@ CREATE VIEW move_node_operation (node_id, target_node_id, position) AS
 DROP TRIGGER IF EXISTS move_node_operation_insert;
 CREATE TRIGGER move_node_operation_insert INSTEAD OF INSERT ON move_node_operation
 BEGIN
+    -- The target must not be the node or one of its descendants (tree_engine
+    -- refuses the same with the same message)
+    SELECT RAISE(ABORT, 'Cannot move a node into its own subtree')
+    FROM tree AS node, tree AS target
+    WHERE node.id = NEW.node_id AND target.id = NEW.target_node_id
+      AND target.tree_id = node.tree_id AND target.lft BETWEEN node.lft AND node.rgt;
+
     -- Step 1: Compute move parameters
     INSERT INTO move_operation_params (
         node_id,
         node_lft, node_rgt, node_level, node_tree_id, node_width, node_is_root,
         target_node_id,
         target_lft, target_rgt, target_tree_id, target_level, target_is_root,
-        move_operation, position
+        move_operation, position, gap
     )
     WITH
     node_info AS (
@@ -249,7 +551,8 @@ BEGIN
         node_info.width AS node_width, node_info.is_root_node AS node_is_root,
         target_info.id,
         target_info.lft AS target_lft, target_info.rgt AS target_rgt, target_info.tree_id AS target_tree_id,target_info.level AS target_level,
-        target_info.is_root_node AS target_is_root, operation_info.move_operation AS move_operation, NEW.position AS position
+        target_info.is_root_node AS target_is_root, operation_info.move_operation AS move_operation, NEW.position AS position,
+        COALESCE((SELECT gap FROM trees WHERE trees.tree_id = target_info.tree_id), 0) AS gap
     FROM node_info, target_info, operation_info;
 
     INSERT INTO make_child_root_node_operation (should_run, new_tree_id)
@@ -279,6 +582,18 @@ BEGIN
         ELSE 0
     END
     FROM move_operation_params;
+
+    INSERT INTO refresh_id_path_operation (node_id) VALUES (NEW.node_id);
+
+    -- The node's old tree, the target's tree and the node's new tree
+    INSERT INTO bump_tree_version_operation (tree_id)
+    SELECT node_tree_id FROM move_operation_params
+    UNION
+    SELECT target_tree_id FROM move_operation_params WHERE target_tree_id IS NOT NULL
+    UNION
+    SELECT tree_id FROM tree WHERE id = NEW.node_id;
+    INSERT INTO journal_node_operation (kind, node_id, old_tree_id)
+    SELECT 'move', NEW.node_id, node_tree_id FROM move_operation_params;
     DELETE FROM move_operation_params;
 END;
 
@@ -365,8 +680,9 @@ BEGIN
             END
         ) - 1,
         right_shift = CASE WHEN parent_exists THEN 2 * (
-            SELECT COUNT(*) FROM tree 
-            WHERE tree.lft BETWEEN move_operation_params.node_lft AND move_operation_params.node_rgt
+            SELECT COUNT(*) FROM tree
+            WHERE tree.tree_id = move_operation_params.node_tree_id
+            AND tree.lft BETWEEN move_operation_params.node_lft AND move_operation_params.node_rgt
             AND tree.level > move_operation_params.node_level
         ) + 2 ELSE 0 END
     FROM (
@@ -378,7 +694,8 @@ BEGIN
             SELECT parent.id
             FROM tree AS parent, move_operation_params as mop
             JOIN tree AS child ON child.id = mop.target_node_id
-            WHERE parent.lft < child.lft
+            WHERE parent.tree_id = child.tree_id
+            AND parent.lft < child.lft
             AND parent.rgt > child.rgt
             ORDER BY (parent.rgt - parent.lft) ASC
             LIMIT 1
@@ -407,6 +724,16 @@ BEGIN
     -- Only run if should_run = 1
     SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
     
+    -- Without a given tree, the node becomes its owner's last tree and keeps
+    -- its old tree's numbering mode
+    INSERT INTO trees (sort_key, gap, owner_id)
+    SELECT
+        (SELECT IFNULL(MAX(sort_key), 0) + 1024 FROM trees AS other WHERE other.owner_id IS old.owner_id),
+        old.gap,
+        old.owner_id
+    FROM trees AS old, move_operation_params AS mop
+    WHERE old.tree_id = mop.node_tree_id AND NEW.new_tree_id IS NULL;
+
     -- Use the inter_tree_move_and_close_gap_operation with parameters from move_operation_params
     INSERT INTO inter_tree_move_and_close_gap_operation (
         level_change, left_right_change, new_tree_id
@@ -414,7 +741,7 @@ BEGIN
     SELECT 
         node_level AS level_change,  -- Reduce level to 0
         node_lft - 1 AS left_right_change,  -- Move to position 1
-        (SELECT COALESCE(NEW.new_tree_id, IFNULL(MAX(tree_id), 0) + 1) FROM tree) AS new_tree_id  -- Auto-generate new tree_id
+        COALESCE(NEW.new_tree_id, (SELECT MAX(tree_id) FROM trees)) AS new_tree_id
     FROM move_operation_params;
     
 END;
@@ -436,8 +763,9 @@ BEGIN
             WHEN rgt > NEW.target_point THEN rgt + NEW.space
             ELSE rgt
         END
-    WHERE tree_id = NEW.tree_id 
-      AND (lft > NEW.target_point OR rgt > NEW.target_point);
+    -- lft < rgt, so this is every row with lft or rgt past the point, and
+    -- one range of the (tree_id, rgt, lft) index
+    WHERE tree_id = NEW.tree_id AND rgt > NEW.target_point;
 END;
 
 DROP VIEW IF EXISTS close_gap_operation;
@@ -470,20 +798,84 @@ BEGIN
     
 END;
 
+-- Put tree NEW.tree_id directly left or right of NEW.target_tree_id in the
+-- display order of their owner's trees. Normally this updates one trees row;
+-- the owner's sort keys are respaced only when no integer is left between
+-- the target and its neighbour.
+DROP VIEW IF EXISTS place_tree_operation;
+CREATE VIEW place_tree_operation (tree_id, target_tree_id, position) AS
+    SELECT NULL WHERE 0;
+
+DROP TRIGGER IF EXISTS place_tree_operation_insert;
+CREATE TRIGGER place_tree_operation_insert
+INSTEAD OF INSERT ON place_tree_operation
+BEGIN
+    UPDATE trees
+    SET sort_key = ranked.position * 1024
+    FROM (
+        SELECT
+            tree_id,
+            ROW_NUMBER() OVER (ORDER BY sort_key) AS position,
+            (
+                SELECT CASE
+                    WHEN NEW.position = 'left' THEN target.sort_key - IFNULL((
+                        SELECT MAX(sort_key) FROM trees
+                        WHERE owner_id IS target.owner_id AND sort_key < target.sort_key
+                          AND tree_id <> NEW.tree_id
+                    ), target.sort_key - 2048)
+                    ELSE IFNULL((
+                        SELECT MIN(sort_key) FROM trees
+                        WHERE owner_id IS target.owner_id AND sort_key > target.sort_key
+                          AND tree_id <> NEW.tree_id
+                    ), target.sort_key + 2048) - target.sort_key
+                END
+                FROM trees AS target
+                WHERE target.tree_id = NEW.target_tree_id
+            ) AS room
+        FROM trees
+        WHERE owner_id IS (SELECT owner_id FROM trees WHERE tree_id = NEW.target_tree_id)
+    ) AS ranked
+    WHERE trees.tree_id = ranked.tree_id AND ranked.room < 2;
+
+    UPDATE trees
+    SET sort_key = (
+        SELECT CASE
+            WHEN NEW.position = 'left' THEN (target.sort_key + IFNULL((
+                SELECT MAX(sort_key) FROM trees
+                WHERE owner_id IS target.owner_id AND sort_key < target.sort_key
+                  AND tree_id <> NEW.tree_id
+            ), target.sort_key - 2048)) / 2
+            ELSE (target.sort_key + IFNULL((
+                SELECT MIN(sort_key) FROM trees
+                WHERE owner_id IS target.owner_id AND sort_key > target.sort_key
+                  AND tree_id <> NEW.tree_id
+            ), target.sort_key + 2048)) / 2
+        END
+        FROM trees AS target
+        WHERE target.tree_id = NEW.target_tree_id
+    )
+    WHERE tree_id = NEW.tree_id;
+END;
+
+-- Create an empty tree of the same owner next to NEW.target_tree_id
 DROP VIEW IF EXISTS create_tree_space_operation;
-CREATE VIEW create_tree_space_operation (target_tree_id, num_trees) AS    
+CREATE VIEW create_tree_space_operation (target_tree_id, position, gap) AS
     SELECT NULL WHERE 0;
 
 DROP TRIGGER IF EXISTS create_tree_space_operation_insert;
 CREATE TRIGGER create_tree_space_operation_insert 
 INSTEAD OF INSERT ON create_tree_space_operation
 BEGIN
-    
-    -- Increment all tree_ids greater than target_tree_id
-    UPDATE tree
-    SET tree_id = tree_id + NEW.num_trees
-    WHERE tree_id > NEW.target_tree_id;
-    
+    INSERT INTO trees (sort_key, gap, owner_id)
+    SELECT
+        (SELECT IFNULL(MAX(sort_key), 0) + 1024 FROM trees AS other WHERE other.owner_id IS target.owner_id),
+        IFNULL(NEW.gap, 0),
+        target.owner_id
+    FROM trees AS target
+    WHERE target.tree_id = NEW.target_tree_id;
+
+    INSERT INTO place_tree_operation (tree_id, target_tree_id, position)
+    VALUES (last_insert_rowid(), NEW.target_tree_id, NEW.position);
 END;
 
 DROP VIEW IF EXISTS make_sibling_of_root_node_operation;
@@ -521,33 +913,15 @@ BEGIN
     SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
     
     -- Create tree space
-    INSERT INTO create_tree_space_operation (target_tree_id, num_trees)
-    SELECT 
-        CASE 
-            WHEN position = 'left' THEN target_tree_id - 1
-            ELSE target_tree_id
-        END,
-        1
+    INSERT INTO create_tree_space_operation (target_tree_id, position, gap)
+    SELECT target_tree_id, position, (SELECT gap FROM trees WHERE trees.tree_id = node_tree_id)
     FROM move_operation_params;
         
     -- Make child node a root
     INSERT INTO make_child_root_node_operation (should_run, new_tree_id)
-    SELECT 
-        1,
-        CASE 
-            WHEN position = 'left' THEN target_tree_id
-            ELSE target_tree_id + 1
-        END
-    FROM move_operation_params;
+    SELECT 1, MAX(tree_id) FROM trees;
 END;
 
-DROP TABLE IF EXISTS logs;
-
-CREATE TABLE logs (
-    id INTEGER PRIMARY KEY,
-    logtext TEXT NOT NULL
-);
-
 -- Root node case  
 DROP VIEW IF EXISTS make_sibling_of_root_node_root_operation;
 CREATE VIEW make_sibling_of_root_node_root_operation (should_run) AS    
@@ -558,63 +932,10 @@ INSTEAD OF INSERT ON make_sibling_of_root_node_root_operation
 BEGIN
     SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
 
-    UPDATE tree
-    SET tree_id = CASE 
-        WHEN tree.tree_id = mp.node_tree_id THEN parameters.new_tree_id
-        ELSE tree.tree_id + parameters.shift
-    END
-    FROM move_operation_params AS mp, (
-        WITH previous_sibling_info AS (
-        SELECT COALESCE(sib.id, 0) AS id, COALESCE(sib.tree_id, 0) AS tree_id
-
-        FROM (SELECT 1) AS dummy
-        LEFT JOIN (
-            SELECT id, tree_id FROM tree, move_operation_params AS mp WHERE tree_id < mp.target_tree_id AND level = 0 ORDER BY tree_id DESC
-            LIMIT 1
-        ) AS sib
-    ),
-    next_sibling_info AS (
-        SELECT COALESCE(sib.id, 0) AS id, COALESCE(sib.tree_id, 0) AS tree_id
-        FROM (SELECT 1) AS dummy
-        LEFT JOIN (
-        SELECT id, tree_id FROM tree, move_operation_params AS mp WHERE tree_id > mp.target_tree_id AND level = 0 ORDER BY tree_id ASC
-        LIMIT 1
-        ) AS sib
-    ), params AS (
-    SELECT 
-        CASE 
-        WHEN mp.position = 'left' AND mp.target_tree_id > mp.node_tree_id THEN previous_sibling_info.tree_id
-        WHEN mp.position = 'left' AND mp.target_tree_id < mp.node_tree_id THEN mp.target_tree_id
-        WHEN mp.position = 'right' AND mp.target_tree_id > mp.node_tree_id THEN mp.target_tree_id
-        WHEN mp.position = 'right' AND mp.target_tree_id < mp.node_tree_id THEN next_sibling_info.tree_id
-        END AS new_tree_id,
-        CASE 
-        WHEN mp.position = 'left' AND mp.target_tree_id > mp.node_tree_id THEN -1
-        WHEN mp.position = 'left' AND mp.target_tree_id < mp.node_tree_id THEN 1
-        WHEN mp.position = 'right' AND mp.target_tree_id > mp.node_tree_id THEN -1
-        WHEN mp.position = 'right' AND mp.target_tree_id < mp.node_tree_id THEN 1
-        END AS shift
-    FROM move_operation_params AS mp, previous_sibling_info, next_sibling_info
-    ),
-    bounds AS (
-    SELECT 
-        CASE 
-            WHEN mp.position = 'left' AND mp.target_tree_id > mp.node_tree_id THEN mp.node_tree_id
-            WHEN mp.position = 'left' AND mp.target_tree_id < mp.node_tree_id THEN params.new_tree_id
-            WHEN mp.position = 'right' AND mp.target_tree_id > mp.node_tree_id THEN mp.node_tree_id
-            WHEN mp.position = 'right' AND mp.target_tree_id < mp.node_tree_id THEN params.new_tree_id
-        END AS lower_bound,
-        CASE 
-            WHEN mp.position = 'left' AND mp.target_tree_id > mp.node_tree_id THEN params.new_tree_id
-            WHEN mp.position = 'left' AND mp.target_tree_id < mp.node_tree_id THEN mp.node_tree_id
-            WHEN mp.position = 'right' AND mp.target_tree_id > mp.node_tree_id THEN mp.target_tree_id
-            WHEN mp.position = 'right' AND mp.target_tree_id < mp.node_tree_id THEN mp.node_tree_id
-        END AS upper_bound
-        FROM move_operation_params AS mp, params
-    )
-    SELECT * FROM bounds, params
-    ) AS parameters
-    WHERE tree.tree_id BETWEEN parameters.lower_bound AND parameters.upper_bound;
+    -- Only the display order changes: the tree keeps its id and numbering
+    INSERT INTO place_tree_operation (tree_id, target_tree_id, position)
+    SELECT node_tree_id, target_tree_id, position
+    FROM move_operation_params;
 END;
 
 DROP VIEW IF EXISTS move_child_node_operation;
@@ -628,7 +949,11 @@ BEGIN
     SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
 
     INSERT INTO move_child_within_tree_operation (should_run)
-    SELECT node_tree_id = target_tree_id
+    SELECT node_tree_id = target_tree_id AND gap = 0
+    FROM move_operation_params;
+
+    INSERT INTO move_child_within_gapped_tree_operation (should_run)
+    SELECT node_tree_id = target_tree_id AND gap > 0
     FROM move_operation_params;
 
     INSERT INTO move_child_to_new_tree_operation (should_run)
@@ -705,6 +1030,59 @@ BEGIN
     
 END;
 
+-- Gapped trees: place the subtree's values in the free interval at the
+-- target position, writing only the moved rows
+DROP VIEW IF EXISTS move_child_within_gapped_tree_operation;
+CREATE VIEW move_child_within_gapped_tree_operation (should_run) AS
+    SELECT NULL WHERE 0;
+
+DROP TRIGGER IF EXISTS move_child_within_gapped_tree_operation_insert;
+CREATE TRIGGER move_child_within_gapped_tree_operation_insert
+INSTEAD OF INSERT ON move_child_within_gapped_tree_operation
+BEGIN
+    SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
+
+    INSERT INTO gap_operation_params (tree_id, target_node_id, position, need, gap)
+    SELECT target_tree_id, target_node_id, position, 2 * (
+            SELECT COUNT(*) FROM tree
+            WHERE tree.tree_id = node_tree_id AND tree.lft BETWEEN node_lft AND node_rgt
+        ), gap
+    FROM move_operation_params;
+
+    INSERT INTO make_gap_room_operation (should_run) VALUES (1);
+
+    -- Making room may have renumbered the moved subtree
+    UPDATE move_operation_params
+    SET node_lft = node.lft, node_rgt = node.rgt
+    FROM tree AS node
+    WHERE node.id = move_operation_params.node_id;
+
+    INSERT INTO renumber_points (v, r)
+    SELECT v, ROW_NUMBER() OVER (ORDER BY v)
+    FROM (
+        SELECT lft AS v FROM tree, move_operation_params AS mop
+        WHERE tree.tree_id = mop.node_tree_id AND tree.lft BETWEEN mop.node_lft AND mop.node_rgt
+        UNION ALL
+        SELECT rgt FROM tree, move_operation_params AS mop
+        WHERE tree.tree_id = mop.node_tree_id AND tree.lft BETWEEN mop.node_lft AND mop.node_rgt
+    );
+
+    UPDATE tree
+    SET
+        level = level - CASE
+            WHEN mop.position IN ('last-child', 'first-child') THEN mop.node_level - mop.target_level - 1
+            ELSE mop.node_level - mop.target_level
+        END,
+        lft = gop.lo + (SELECT r FROM renumber_points WHERE v = tree.lft) * gop.step,
+        rgt = gop.lo + (SELECT r FROM renumber_points WHERE v = tree.rgt) * gop.step
+    FROM move_operation_params AS mop, gap_operation_params AS gop
+    WHERE tree.tree_id = mop.node_tree_id
+        AND tree.lft BETWEEN mop.node_lft AND mop.node_rgt;
+
+    DELETE FROM renumber_points;
+    DELETE FROM gap_operation_params;
+END;
+
 DROP VIEW IF EXISTS move_child_to_new_tree_operation;
 CREATE VIEW move_child_to_new_tree_operation (should_run) AS    
     SELECT NULL WHERE 0;
@@ -714,6 +1092,17 @@ CREATE TRIGGER move_child_to_new_tree_operation_insert
 INSTEAD OF INSERT ON move_child_to_new_tree_operation
 BEGIN
     SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
+    -- A subtree leaving a gapped tree for a contiguous one is packed first
+    INSERT INTO renumber_subtree_operation (tree_id, lft, rgt, step, tail)
+    SELECT node_tree_id, node_lft, node_rgt, 1, 0
+    FROM move_operation_params
+    WHERE gap = 0 AND (SELECT gap FROM trees WHERE trees.tree_id = node_tree_id) > 0;
+
+    UPDATE move_operation_params
+    SET node_rgt = node.rgt, node_width = node.rgt - node.lft + 1
+    FROM tree AS node
+    WHERE node.id = move_operation_params.node_id;
+
     -- First calculate the inter-tree move values
     INSERT INTO calculate_inter_tree_move_values_operation (should_run) VALUES (1);
     -- Create space for the node in the target tree
@@ -738,7 +1127,18 @@ CREATE TRIGGER move_root_node_operation_insert
 INSTEAD OF INSERT ON move_root_node_operation
 BEGIN
     SELECT CASE WHEN NEW.should_run = 0 THEN RAISE(IGNORE) END;
-    
+
+    -- A subtree leaving a gapped tree for a contiguous one is packed first
+    INSERT INTO renumber_subtree_operation (tree_id, lft, rgt, step, tail)
+    SELECT node_tree_id, node_lft, node_rgt, 1, 0
+    FROM move_operation_params
+    WHERE gap = 0 AND (SELECT gap FROM trees WHERE trees.tree_id = node_tree_id) > 0;
+
+    UPDATE move_operation_params
+    SET node_rgt = node.rgt, node_width = node.rgt - node.lft + 1
+    FROM tree AS node
+    WHERE node.id = move_operation_params.node_id;
+
     -- First calculate the inter-tree move values
     INSERT INTO calculate_inter_tree_move_values_operation (should_run) VALUES (1);
     
@@ -758,11 +1158,10 @@ BEGIN
     WHERE tree.lft >= mop.node_lft 
       AND tree.lft <= mop.node_rgt
       AND tree.tree_id = mop.node_tree_id;
-    -- Close the gap in the original tree by decreasing tree_ids
-    UPDATE tree
-    SET tree_id = tree_id - 1
-    FROM move_operation_params AS mop
-    WHERE tree.tree_id > mop.node_tree_id;
+    -- The original tree is now empty
+    DELETE FROM trees
+    WHERE tree_id = (SELECT node_tree_id FROM move_operation_params)
+      AND NOT EXISTS (SELECT 1 FROM tree, move_operation_params AS mop WHERE tree.tree_id = mop.node_tree_id);
 END;
 
 
@@ -774,7 +1173,7 @@ DROP TRIGGER IF EXISTS delete_node_operation_insert;
 CREATE TRIGGER delete_node_operation_insert INSTEAD OF INSERT ON delete_node_operation
 BEGIN
     -- Step 1: Compute delete parameters
-    INSERT INTO delete_operation_params (node_size, node_lft, node_rgt, node_tree_id, node_is_root)
+    INSERT INTO delete_operation_params (node_size, node_lft, node_rgt, node_tree_id, node_is_root, gap, owner_id)
     WITH 
     node AS (SELECT * FROM tree WHERE id = NEW.node_id)
     SELECT
@@ -782,7 +1181,9 @@ BEGIN
         node.lft AS node_lft,
         node.rgt AS node_rgt,
         node.tree_id AS node_tree_id,
-        node.level = 0 AS node_is_root
+        node.level = 0 AS node_is_root,
+        COALESCE((SELECT gap FROM trees WHERE trees.tree_id = node.tree_id), 0) AS gap,
+        (SELECT owner_id FROM trees WHERE trees.tree_id = node.tree_id) AS owner_id
     FROM node;  
     -- Step 2: Delete the node and its subtree
     DELETE FROM tree
@@ -791,77 +1192,79 @@ BEGIN
                       AND (SELECT node_rgt FROM delete_operation_params);
 
 
-    -- Step 3: Close the gap in the tree
+    -- Step 3: Close the gap in the tree (gapped trees just keep it)
     INSERT INTO close_gap_operation (size, target_point, tree_id)
     SELECT node_size, node_lft, node_tree_id
+    FROM delete_operation_params
+    WHERE gap = 0;
+
+    DELETE FROM trees
+    WHERE tree_id = (SELECT node_tree_id FROM delete_operation_params WHERE node_is_root)
+      AND NOT EXISTS (SELECT 1 FROM tree, delete_operation_params AS op WHERE tree.tree_id = op.node_tree_id);
+
+    INSERT INTO bump_tree_version_operation (tree_id)
+    SELECT node_tree_id FROM delete_operation_params;
+    -- The node is gone, so the entry only says which points were removed
+    INSERT INTO tree_journal (tree_id, owner_id, version, kind, node_id, data)
+    SELECT node_tree_id, owner_id, (SELECT version FROM tree_version), 'delete', NEW.node_id,
+        json_object('lft', node_lft, 'rgt', node_rgt,
+                    'shift', json_object('from', node_rgt + 1, 'by', CASE WHEN gap = 0 THEN -node_size ELSE 0 END))
     FROM delete_operation_params;
-
-    UPDATE tree
-    SET tree_id = tree_id - 1
-    FROM delete_operation_params AS op
-    WHERE op.node_is_root
-      AND tree.tree_id > op.node_tree_id;
-
     DELETE FROM delete_operation_params;
 END;
 
 -- Add this view to show indented tree
+-- Walks down from the roots one level at a time. Each step is a
+-- (tree_id, level, lft) index range, so the view is O(n log n) instead of
+-- running correlated ancestor subqueries for every row. The app serves
+-- /api/tree/indented from tree_indent.py, which produces the same columns.
 DROP VIEW IF EXISTS tree_indented;
 CREATE VIEW tree_indented AS
-WITH tree_with_ancestors AS (
-    SELECT 
-        t.*,
-        (
-            SELECT GROUP_CONCAT(a.name, ' > ') 
-            FROM tree a 
-            WHERE a.tree_id = t.tree_id 
-                AND a.lft < t.lft 
-                AND a.rgt > t.rgt
-            ORDER BY a.tree_id, a.lft
-        ) AS ancestor_path,
-        (
-            SELECT GROUP_CONCAT(a.id, '.') 
-            FROM tree a 
-            WHERE a.tree_id = t.tree_id 
-                AND a.lft < t.lft 
-                AND a.rgt > t.rgt
-            ORDER BY a.tree_id, a.lft
-        ) AS ancestor_id_path,
-        (
-            SELECT COUNT(*) 
-            FROM tree a 
-            WHERE a.tree_id = t.tree_id 
-                AND a.lft < t.lft 
-                AND a.rgt > t.rgt
-        ) AS depth
-    FROM tree t
+WITH RECURSIVE walk (
+    id, tree_id, name, lft, rgt, level, depth, full_path, id_path, has_next, prefix
+) AS (
+    SELECT id, tree_id, name, lft, rgt, level, 0, name, CAST(id AS TEXT), 0, ''
+    FROM tree
+    WHERE level = 0
+    UNION ALL
+    SELECT
+        child.id,
+        child.tree_id,
+        child.name,
+        child.lft,
+        child.rgt,
+        child.level,
+        walk.depth + 1,
+        walk.full_path || ' > ' || child.name,
+        walk.id_path || '.' || child.id,
+        EXISTS (
+            SELECT 1 FROM tree sibling
+            WHERE sibling.tree_id = child.tree_id
+                AND sibling.level = child.level
+                AND sibling.lft > child.rgt
+                AND sibling.lft < walk.rgt
+        ),
+        -- Continuation lines drawn for the ancestors below the root
+        CASE
+            WHEN walk.depth = 0 THEN ''
+            WHEN walk.has_next THEN walk.prefix || '│   '
+            ELSE walk.prefix || '    '
+        END
+    FROM walk
+    JOIN tree child
+        ON child.tree_id = walk.tree_id
+        AND child.level = walk.level + 1
+        AND child.lft > walk.lft
+        AND child.lft < walk.rgt
 )
-SELECT 
+SELECT
     id,
     tree_id,
     -- Visual indentation with proper hierarchy markers
-    CASE 
+    CASE
         WHEN depth = 0 THEN name
-        ELSE 
-            SUBSTR('│   │   │   │   │   │   │   │   │   │   ', 1, (depth - 1) * 4) ||
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM tree s 
-                    WHERE s.tree_id = tree_id 
-                        AND s.lft > lft 
-                        AND s.rgt < (
-                            SELECT MIN(parent.rgt) 
-                            FROM tree parent 
-                            WHERE parent.tree_id = tree_id 
-                                AND parent.lft < lft 
-                                AND parent.rgt > rgt
-                            UNION SELECT rgt FROM tree WHERE id = tree_with_ancestors.id
-                            LIMIT 1
-                        )
-                        AND s.level = level + 1
-                ) THEN '├── '
-                ELSE '└── '
-            END || name
+        WHEN has_next THEN prefix || '├── ' || name
+        ELSE prefix || '└── ' || name
     END AS indented_name,
     -- Simple indentation (more reliable)
     SUBSTR('    ', 1, level * 3) || name AS simple_indented_name,
@@ -869,158 +1272,9 @@ SELECT
     lft,
     rgt,
     level,
-    COALESCE(ancestor_path || ' > ' || name, name) AS full_path,
-    COALESCE(ancestor_id_path || '.' || id, CAST(id AS TEXT)) AS id_path,
+    full_path,
+    id_path,
     depth
-FROM tree_with_ancestors
-ORDER BY tree_id, lft;
-
-DROP TABLE IF EXISTS users;
-CREATE TABLE users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    email TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL,
-    is_active BOOLEAN DEFAULT 0,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-);
-
-DROP TABLE IF EXISTS registration_tokens;
-CREATE TABLE registration_tokens (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    token TEXT UNIQUE NOT NULL,
-    user_id INTEGER,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
-);
-
-DROP TABLE IF EXISTS password_reset_tokens;
-CREATE TABLE password_reset_tokens (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    token TEXT UNIQUE NOT NULL,
-    user_id INTEGER,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
-);
-
-DELETE FROM tree;
-DELETE FROM last_operation_id;
-DELETE FROM add_operation_params;
-DELETE FROM move_operation_params;
-DELETE FROM delete_operation_params;
--- Create initial tree
-insert into add_root_operation (name) values ('Root');
-
--- Add children
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root'), 'Child 1.1', 'first-child');
-
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root'), 'Child 1.2', 'last-child');
-
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Child 1.1'), 'Child 1.1.1', 'first-child');
-
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Child 1.1'), 'Child 1.1.2', 'last-child');
-
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Child 1.2'), 'Child 1.2.1', 'first-child');
-
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Child 1.2'), 'Child 1.2.2', 'last-child');
-
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root'), 'Child 1.2.3', 'last-child');
-
--- add 3 more roots
-insert into add_root_operation (name) values ('Root 1');    
-insert into add_root_operation (name) values ('Root 2');
-insert into add_root_operation (name) values ('Root 3');
-
--- Add subtrees to new roots
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root 1'), 'Child 2.1', 'first-child');
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root 1'), 'Child 2.2', 'last-child');
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root 2'), 'Child 3.1', 'first-child');
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root 2'), 'Child 3.2', 'last-child');
-insert into add_node_operation (target_node_id, name, position) values 
-((select id from tree where name = 'Root 3'), 'Child 4.1', 'first-child');
-
--- Show initial tree structure
-SELECT 'Initial tree structure:' as comment;
-SELECT name, lft, rgt, level FROM tree ORDER BY tree_id, lft;
-insert into delete_node_operation (node_id) values 
-((select id from tree where name = 'Root 2'));
-
--- Show initial tree structure
-SELECT 'Post-deletion tree structure:' as comment;
-SELECT tree_id, name, lft, rgt, level FROM tree ORDER BY tree_id, lft;
--- Move Child 1.2 to the right of Child 1.1.1
-insert into move_node_operation (node_id, target_node_id, position) values 
-(
- (select id from tree where name = 'Child 1.2'), 
- (select id from tree where name = 'Child 1.1.1'), 'first-child');
-
--- Move Root 3 to be the left sibling of Root 1
-select id from tree where name = 'Root 1';
-select id from tree where name = 'Root 3';
-insert into move_node_operation (node_id, target_node_id, position) values 
-(
- (select id from tree where name = 'Root 3'), 
- (select id from tree where name = 'Root 1'), 'left');
-
--- -- Move Child 1.1.1 to be a root node
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Child 1.1.1'), 
- NULL, 'last-child');
-
----- Move Root 1 to be the right sibling of Child 1.1.2
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Root 1'), 
- (select id from tree where name = 'Child 1.1.2'), 'right');
-
--- ---- Move Root to be the left sibling of Child 4.1
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Root'), 
- (select id from tree where name = 'Child 4.1'), 'left');
-
--- ---- Move Root 1 to be the frst child of Child 1.1
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Root 1'), 
- (select id from tree where name = 'Child 1.1'), 'first-child');
-
--- ---- Move Child 4.1 to be the last child of Root
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Child 4.1'), 
- (select id from tree where name = 'Root'), 'last-child');
-
--- ---- Move Root to root position
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Root'), 
- NULL, 'last-child');
--- ---- Move Child 1.1 to be the right sibling of Root
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Child 1.1'), 
- (select id from tree where name = 'Root'), 'right');
-
--- ---- Root 1 to be the right sibling of Child 1.2
-insert into move_node_operation (node_id, target_node_id, position) values
-(
- (select id from tree where name = 'Root 1'), 
- (select id from tree where name = 'Child 1.2'), 'left');
-
-SELECT 'Indented tree view:' as comment;
-SELECT id, tree_id, lft, rgt, level, indented_name FROM tree_indented ORDER BY tree_id, lft;
-SELECT * FROM move_operation_params_log;
-DELETE FROM move_operation_params_log;
\ No newline at end of file
+FROM walk
+JOIN trees USING (tree_id)
+ORDER BY trees.sort_key, lft;
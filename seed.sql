@@ -0,0 +1,126 @@
+-- Demo trees for development; `flask db seed` replaces all trees with these.
+-- Runs the operations through the *_operation triggers, so it also serves
+-- as a smoke test of schema.sql.
+
+DELETE FROM tree;
+DELETE FROM last_operation_id;
+DELETE FROM add_operation_params;
+DELETE FROM move_operation_params;
+DELETE FROM trees;
+DELETE FROM delete_operation_params;
+-- Create initial tree
+insert into add_root_operation (name) values ('Root');
+
+-- Add children
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root'), 'Child 1.1', 'first-child');
+
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root'), 'Child 1.2', 'last-child');
+
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Child 1.1'), 'Child 1.1.1', 'first-child');
+
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Child 1.1'), 'Child 1.1.2', 'last-child');
+
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Child 1.2'), 'Child 1.2.1', 'first-child');
+
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Child 1.2'), 'Child 1.2.2', 'last-child');
+
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root'), 'Child 1.2.3', 'last-child');
+
+-- add 3 more roots
+insert into add_root_operation (name) values ('Root 1');    
+insert into add_root_operation (name) values ('Root 2');
+insert into add_root_operation (name) values ('Root 3');
+
+-- Add subtrees to new roots
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root 1'), 'Child 2.1', 'first-child');
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root 1'), 'Child 2.2', 'last-child');
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root 2'), 'Child 3.1', 'first-child');
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root 2'), 'Child 3.2', 'last-child');
+insert into add_node_operation (target_node_id, name, position) values 
+((select id from tree where name = 'Root 3'), 'Child 4.1', 'first-child');
+
+-- Show initial tree structure
+SELECT 'Initial tree structure:' as comment;
+SELECT name, lft, rgt, level FROM tree ORDER BY tree_id, lft;
+insert into delete_node_operation (node_id) values 
+((select id from tree where name = 'Root 2'));
+
+-- Show initial tree structure
+SELECT 'Post-deletion tree structure:' as comment;
+SELECT tree_id, name, lft, rgt, level FROM tree ORDER BY tree_id, lft;
+-- Move Child 1.2 to the right of Child 1.1.1
+insert into move_node_operation (node_id, target_node_id, position) values 
+(
+ (select id from tree where name = 'Child 1.2'), 
+ (select id from tree where name = 'Child 1.1.1'), 'first-child');
+
+-- Move Root 3 to be the left sibling of Root 1
+select id from tree where name = 'Root 1';
+select id from tree where name = 'Root 3';
+insert into move_node_operation (node_id, target_node_id, position) values 
+(
+ (select id from tree where name = 'Root 3'), 
+ (select id from tree where name = 'Root 1'), 'left');
+
+-- -- Move Child 1.1.1 to be a root node
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Child 1.1.1'), 
+ NULL, 'last-child');
+
+---- Move Root 1 to be the right sibling of Child 1.1.2
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Root 1'), 
+ (select id from tree where name = 'Child 1.1.2'), 'right');
+
+-- ---- Move Root to be the left sibling of Child 4.1
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Root'), 
+ (select id from tree where name = 'Child 4.1'), 'left');
+
+-- ---- Move Root 1 to be the frst child of Child 1.1
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Root 1'), 
+ (select id from tree where name = 'Child 1.1'), 'first-child');
+
+-- ---- Move Child 4.1 to be the last child of Root
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Child 4.1'), 
+ (select id from tree where name = 'Root'), 'last-child');
+
+-- ---- Move Root to root position
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Root'), 
+ NULL, 'last-child');
+-- ---- Move Child 1.1 to be the right sibling of Root
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Child 1.1'), 
+ (select id from tree where name = 'Root'), 'right');
+
+-- ---- Root 1 to be the right sibling of Child 1.2
+insert into move_node_operation (node_id, target_node_id, position) values
+(
+ (select id from tree where name = 'Root 1'), 
+ (select id from tree where name = 'Child 1.2'), 'left');
+
+SELECT 'Indented tree view:' as comment;
+SELECT id, tree_id, lft, rgt, level, indented_name FROM tree_indented ORDER BY tree_id, lft;
+SELECT * FROM move_operation_params_log;
+DELETE FROM move_operation_params_log;
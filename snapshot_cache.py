@@ -0,0 +1,74 @@
+"""Bounded in-process LRU cache of encoded JSON responses.
+
+Keys include the change version the body was built from (see
+bump_tree_version_operation), so an entry can never be served after its
+tree changes, even when another process made the change. Invalidating on
+writes only frees memory early.
+
+Keys are tuples whose first items say what the body depends on:
+('tree', tree_id, ...) for one tree and ('forest', ...) for all trees.
+"""
+import threading
+from collections import OrderedDict
+
+
+class SnapshotCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> bytes, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        """Return the cached bytes for key, calling build() to make them on a miss"""
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+        body = build()
+        self.put(key, body)
+        return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, tree_ids):
+        """Drop entries for the given trees and every forest-wide entry"""
+        tree_ids = set(tree_ids)
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key[0] == 'forest' or (key[0] == 'tree' and key[1] in tree_ids)]:
+                self.size -= len(self.entries.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
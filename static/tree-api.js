@@ -1,5 +1,9 @@
 // Pure API functions - no UI logic
+import { COLUMNS_MIMETYPE, columnsToObjects, decodeColumns } from '/static/tree-columns.js';
+
 class TreeAPI {
+    static PAGE_SIZE = 500;
+
     static async request(url, options = {}) {
         const response = await fetch(url, {
             headers: { 
@@ -14,11 +18,23 @@ class TreeAPI {
             throw new Error(`HTTP ${response.status}: ${error}`);
         }
         
+        if (response.headers.get('Content-Type')?.startsWith(COLUMNS_MIMETYPE)) {
+            return columnsToObjects(decodeColumns(await response.arrayBuffer()));
+        }
         return response.json();
     }
 
+    // GET an endpoint that returns a list of nodes, asking for the columnar
+    // encoding (about half the bytes and faster to parse); resolves to the
+    // same node objects as the JSON
+    static async requestNodes(url) {
+        return this.request(url, {
+            headers: { 'Accept': `${COLUMNS_MIMETYPE}, application/json;q=0.9` }
+        });
+    }
+
     static async getTree() {
-        return this.request('/api/tree');
+        return this.requestNodes('/api/tree');
     }
 
     static async getIndentedTree() {
@@ -26,13 +42,70 @@ class TreeAPI {
     }
 
     static async getTrees() {
-        return this.request('/api/trees');
+        return this.requestNodes('/api/trees');
+    }
+
+    static query(params) {
+        const search = new URLSearchParams();
+        Object.entries(params).forEach(([key, value]) => {
+            if (value !== null && value !== undefined) {
+                search.set(key, value);
+            }
+        });
+        const queryString = search.toString();
+        return queryString ? `?${queryString}` : '';
+    }
+
+    // One keyset page of a tree, in lft order
+    static async getTreeNodes(treeId, { afterLft = null, limit = this.PAGE_SIZE } = {}) {
+        return this.requestNodes(`/api/trees/${treeId}${this.query({ after_lft: afterLft, limit })}`);
+    }
+
+    // One keyset page of the subtree rooted at nodeId (the node itself comes first)
+    static async getSubtree(nodeId, { depth = null, afterLft = null, limit = this.PAGE_SIZE } = {}) {
+        return this.requestNodes(`/api/nodes/${nodeId}/subtree${this.query({ depth, after_lft: afterLft, limit })}`);
+    }
+
+    // One keyset page of the node's subtree without the node itself
+    static async getDescendants(nodeId, { depth = null, afterLft = null, limit = this.PAGE_SIZE } = {}) {
+        return this.requestNodes(`/api/nodes/${nodeId}/descendants${this.query({ depth, after_lft: afterLft, limit })}`);
     }
 
-    static async createTree(name = 'New Tree') {
+    // The node's ancestors from its root down to its parent
+    static async getAncestors(nodeId) {
+        return this.requestNodes(`/api/nodes/${nodeId}/ancestors`);
+    }
+
+    // Nodes whose name matches text, best first, each with its ancestor path
+    static async search(text, { offset = 0, limit = 50 } = {}) {
+        return this.request(`/api/search${this.query({ q: text, offset, limit })}`);
+    }
+
+    // Follow the after_lft cursor until a short page is returned
+    static async fetchAllPages(fetchPage, limit = this.PAGE_SIZE) {
+        const nodes = [];
+        let afterLft = null;
+        for (;;) {
+            const page = await fetchPage({ afterLft, limit });
+            nodes.push(...page);
+            if (page.length < limit) {
+                return nodes;
+            }
+            afterLft = page[page.length - 1].lft;
+        }
+    }
+
+    static async getChildren(nodeId) {
+        return this.fetchAllPages(
+            options => this.getDescendants(nodeId, { depth: 1, ...options })
+        );
+    }
+
+    // gap > 0 numbers the tree with spaced lft/rgt values; omit it for the server default
+    static async createTree(name = 'New Tree', gap = undefined) {
         return this.request('/api/trees', {
             method: 'POST',
-            body: JSON.stringify({ name })
+            body: JSON.stringify({ name, gap })
         });
     }
 
@@ -56,6 +129,27 @@ class TreeAPI {
         });
     }
 
+    // Apply add/move/rename/delete operations in one transaction, e.g.
+    // [{ op: 'add', target_node_id: 1, name: 'A' }, { op: 'add', target_node_id: '$0', name: 'B' }]
+    // where '$0' is the node added by the first operation. Resolves to
+    // { ids, changes }; nothing is applied if any operation fails.
+    static async batch(operations) {
+        return this.request('/api/operations/batch', {
+            method: 'POST',
+            body: JSON.stringify({ operations })
+        });
+    }
+
+    // Open the change stream of all trees, or of one tree, and call
+    // onChange with each parsed journal entry ({ kind, node_id, node,
+    // parent_id, position, ... }). EventSource reconnects by itself and
+    // resumes after the last entry it received. Returns the EventSource.
+    static subscribe(onChange, treeId = null) {
+        const source = new EventSource(treeId === null ? '/api/events' : `/api/trees/${treeId}/events`);
+        source.onmessage = event => onChange(JSON.parse(event.data));
+        return source;
+    }
+
     static async renameNode(nodeId, newName) {
         return this.request(`/api/nodes/${nodeId}`, {
             method: 'PUT',
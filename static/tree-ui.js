@@ -7,12 +7,16 @@ class TreeUI {
         this.treeContainer = $('#tree-container');
         this.treeForm = $('#tree_form').get(0);
         this.apiOutput = $('#api-output');
+        // Set while changes from other clients are applied, so that the
+        // move_node.jstree they trigger is not sent back to the server
+        this.applyingRemote = false;
         this.init();
     }
 
     init() {
         this.setupEventListeners();
         this.loadTree();
+        this.events = TreeAPI.subscribe(change => this.applyChange(change));
     }
 
     setupEventListeners() {
@@ -23,33 +27,22 @@ class TreeUI {
     }
 
     async loadTree() {
-        try {
-            this.apiOutput.text('Loading tree data...');
-            
-            const treeData = await TreeAPI.getTree();
-            this.apiOutput.text(JSON.stringify(treeData, null, 2));
-            
-            this.renderTree(treeData);
-            
-        } catch (error) {
-            this.apiOutput.text('Error: ' + error.message);
-            console.error('Error loading tree:', error);
+        // Reload the roots and whichever nodes are currently open; closed
+        // subtrees stay unloaded until they are expanded again
+        const tree = this.treeContainer.jstree(true);
+        if (tree) {
+            tree.refresh();
+        } else {
+            this.renderTree();
         }
     }
 
-    renderTree(treeData) {
-        // Convert flat data to nested structure for jsTree
-        const jsTreeData = this.convertToJsTreeFormat(treeData);
-        
-        // Destroy existing tree if it exists
-        if (this.treeContainer.jstree(true)) {
-            this.treeContainer.jstree('destroy');
-        }
-
-        // Initialize jsTree
+    renderTree() {
+        // Initialize jsTree with lazy loading: each node's children are
+        // fetched the first time it is opened
         this.treeContainer.jstree({
             'core': {
-                'data': jsTreeData,
+                'data': (node, callback) => this.loadNodes(node, callback),
                 'check_callback': true,
                 'themes': {
                     'responsive': false
@@ -67,70 +60,93 @@ class TreeUI {
         });
 
         this.treeContainer.on('move_node.jstree', (e, data) => {
-            this.handleNodeMove(data);
+            if (!this.applyingRemote) {
+                this.handleNodeMove(data);
+            }
         });
     }
 
-    convertToJsTreeFormat(treeData) {
-        // Group nodes by tree_id
+    async loadNodes(node, callback) {
+        const tree = this.treeContainer.jstree(true);
+        try {
+            this.apiOutput.text('Loading tree data...');
 
-        const trees = {};
-        treeData.forEach(node => {
-            if (!trees[node.tree_id-1]) {
-                trees[node.tree_id-1] = [];
-            }
-            trees[node.tree_id-1].push(node);
-        });
+            const nodes = node.id === '#'
+                ? await TreeAPI.getTrees()
+                : await TreeAPI.getChildren(node.id);
+            this.apiOutput.text(JSON.stringify(nodes, null, 2));
 
-        // Convert each tree to hierarchical format
-        const result = [];
-        
-        Object.values(trees).forEach(treeNodes => {
-            // Sort by lft for proper hierarchy
-            treeNodes.sort((a, b) => a.lft - b.lft);
-            
-            const nodeMap = {};
-            const rootNodes = [];
-            
-            // Create node map
-            treeNodes.forEach(node => {
-                nodeMap[node.id] = {
-                    id: node.id.toString(),
-                    text: `${node.name} (ID: ${node.id}, Tree: ${node.tree_id})`,
-                    data: node,
-                    children: []
-                };
-            });
-            
-            // Build hierarchy
-            treeNodes.forEach(node => {
-                const currentNode = nodeMap[node.id];
-                
-                // Find parent (node that contains this node) by level and lft/rgt and smallest rgt-lft difference
-                let parent = null;
-                for (const potentialParent of treeNodes) {
-                    if (potentialParent.level === node.level - 1 &&
-                        potentialParent.lft < node.lft &&
-                        potentialParent.rgt > node.rgt && potentialParent.tree_id === node.tree_id) {
-                        if (!parent || (potentialParent.rgt - potentialParent.lft < parent.rgt - parent.lft)) {
-                            parent = potentialParent;
-                        }
+            callback.call(tree, nodes.map(child => this.toJsTreeNode(child)));
+        } catch (error) {
+            this.apiOutput.text('Error: ' + error.message);
+            console.error('Error loading tree:', error);
+            callback.call(tree, []);
+        }
+    }
+
+    toJsTreeNode(node) {
+        return {
+            id: node.id.toString(),
+            text: `${node.name} (ID: ${node.id}, Tree: ${node.tree_id})`,
+            data: node,
+            // Nodes with children get them loaded when they are expanded
+            children: Boolean(node.has_children)
+        };
+    }
+
+    // Apply one entry of the server's change stream. Entries for our own
+    // changes arrive too, so each case checks whether it is already shown.
+    applyChange(change) {
+        const tree = this.treeContainer.jstree(true);
+        if (!tree) {
+            return;
+        }
+        this.applyingRemote = true;
+        try {
+            switch (change.kind) {
+                case 'insert':
+                case 'move':
+                    this.placeNode(tree, change);
+                    break;
+                case 'rename': {
+                    const node = tree.get_node(String(change.node_id));
+                    if (node) {
+                        node.data = change.node;
+                        tree.rename_node(node, this.toJsTreeNode(change.node).text);
                     }
+                    break;
                 }
+                case 'delete':
+                    if (tree.get_node(String(change.node_id))) {
+                        tree.delete_node(String(change.node_id));
+                    }
+                    break;
+                default:
+                    // 'reload': we missed entries; 'repair': the tree was renumbered
+                    this.loadTree();
+            }
+        } finally {
+            this.applyingRemote = false;
+        }
+    }
 
-                if (parent) {
-                    nodeMap[parent.id].children.push(currentNode);
-                } else {
-                    rootNodes.push(currentNode);
-                }
-            });
-            
-            // Add root nodes to result
-            result.push(...rootNodes);
-        });
-        // order by tree_id to keep consistent order
-        result.sort((a, b) => a.data.tree_id - b.data.tree_id);
-        return result;
+    placeNode(tree, change) {
+        const id = String(change.node.id);
+        const parentId = change.parent_id === null ? '#' : String(change.parent_id);
+        const parent = tree.get_node(parentId);
+        const existing = tree.get_node(id);
+        if (existing && tree.get_parent(existing) === parentId
+            && parent.children.indexOf(id) === change.position) {
+            return;
+        }
+        if (existing) {
+            tree.delete_node(existing);
+        }
+        // Under a parent whose children are not loaded yet the node shows up
+        // when the parent is opened
+        if (parent && tree.is_loaded(parent)) {
+            tree.create_node(parent, this.toJsTreeNode(change.node), change.position);
+        }
     }
 
     getContextMenuItems(node) {
@@ -175,7 +191,9 @@ class TreeUI {
             if (name) {
                 try {
                     await TreeAPI.addNode(node.data.id, name, 'last-child');
-                    await this.loadTree();
+                    const tree = this.treeContainer.jstree(true);
+                    tree.refresh_node(node);
+                    tree.open_node(node);
                     this.treeForm.innerHTML = '';
                     this.treeForm.classList.add('hidden');
 
@@ -195,7 +213,8 @@ class TreeUI {
         if (newName && newName !== node.data.name) {
             try {
                 await TreeAPI.renameNode(node.data.id, newName);
-                await this.loadTree();
+                node.data.name = newName;
+                this.treeContainer.jstree(true).rename_node(node, this.toJsTreeNode(node.data).text);
             } catch (error) {
                 alert('Error renaming node: ' + error.message);
             }
@@ -206,7 +225,7 @@ class TreeUI {
         if (confirm(`Delete "${node.data.name}" and all its children?`)) {
             try {
                 await TreeAPI.deleteNode(node.data.id);
-                await this.loadTree();
+                this.treeContainer.jstree(true).delete_node(node);
             } catch (error) {
                 alert('Error deleting node: ' + error.message);
             }
@@ -239,7 +258,10 @@ class TreeUI {
             console.log(`Converted position:`, apiTargetPosition);
 
             await TreeAPI.moveNode(nodeId, apiTargetPosition.id, apiTargetPosition.position);
-            await this.loadTree(); // Reload to ensure consistency
+            // jsTree has already placed the node; only its new parent needs fresh data
+            if (targetNodeId !== '#') {
+                this.treeContainer.jstree(true).refresh_node(targetNodeId);
+            }
             
         } catch (error) {
             alert('Error moving node: ' + error.message);
@@ -251,13 +273,14 @@ class TreeUI {
         const tree = this.treeContainer.jstree(true);
         
         if (targetNodeId === '#') {
-            // Get nodes in tree_id order
-            const rootNodes = tree.get_json('#').sort((a, b) => a.data.tree_id - b.data.tree_id);
+            // Roots are listed in display (sort_key) order and jsTree has
+            // already placed the moved node at jsTreePosition
+            const rootNodes = tree.get_json('#');
             console.log('Root nodes:', rootNodes);
             if (jsTreePosition === 0) {
-                return { id: rootNodes[0]?.id || null, position: 'left' };
+                return { id: rootNodes[1]?.id || null, position: 'left' };
             } else {
-                const siblingId = rootNodes[jsTreePosition]?.id || null;
+                const siblingId = rootNodes[jsTreePosition - 1]?.id || null;
                 return { id: siblingId, position: 'right' };
             }
         } else {
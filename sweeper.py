@@ -0,0 +1,64 @@
+"""Periodic deletion of expired tokens.
+
+Rows are deleted in batches of SWEEP_BATCH_SIZE, each in its own short
+BEGIN IMMEDIATE transaction, so a large backlog never holds the write lock
+for long. Each app process runs a Sweeper thread every TOKEN_SWEEP_INTERVAL
+seconds; `flask db sweep` runs one pass by hand. Concurrent sweeps from
+several processes are harmless.
+"""
+import threading
+import time
+
+import db
+
+# Tables with an indexed expires_at column (Unix time)
+EXPIRING_TABLES = ('registration_tokens', 'password_reset_tokens')
+
+
+def sweep(conn, batch_size=1000, now=None):
+    """Delete expired rows from every expiring table; returns the count per table"""
+    now = int(time.time()) if now is None else now
+    deleted = {}
+    for table in EXPIRING_TABLES:
+        deleted[table] = 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                count = conn.execute(f'''
+                    DELETE FROM {table}
+                    WHERE rowid IN (SELECT rowid FROM {table} WHERE expires_at <= ? LIMIT ?)
+                ''', (now, batch_size)).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            deleted[table] += count
+            if count < batch_size:
+                break
+    return deleted
+
+
+class Sweeper:
+    def __init__(self, config):
+        self.config = config
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def run(self):
+        conn = db.get_connection(self.config)
+        while True:
+            time.sleep(self.config['TOKEN_SWEEP_INTERVAL'])
+            try:
+                sweep(conn, self.config['SWEEP_BATCH_SIZE'])
+            except Exception as e:
+                print(f"Error sweeping expired tokens: {e}")
+
+    def start(self):
+        """Start this process's sweeper thread unless it is running or disabled"""
+        if self.config['TOKEN_SWEEP_INTERVAL'] <= 0 or (self.thread and self.thread.is_alive()):
+            return
+        with self.lock:
+            # Threads do not survive a fork, so each worker process starts its own
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='token-sweeper', daemon=True)
+                self.thread.start()
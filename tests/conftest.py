@@ -0,0 +1,24 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def create_database():
+    """An in-memory database with the app schema and no tree rows"""
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    db.upgrade(conn)
+    return conn
+
+
+@pytest.fixture
+def conn():
+    conn = create_database()
+    yield conn
+    conn.close()
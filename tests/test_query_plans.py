@@ -0,0 +1,66 @@
+"""No node query of the API or of tree_engine may scan the tree table."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from query_plans import api_requests, sample_nodes, statement_plans  # noqa: E402
+from synthetic import OWNER_ID, create_database, load_tree  # noqa: E402
+
+SIZE = 2000
+
+READS = [request for request in api_requests(SIZE, 0, 0) if request[0] == 'GET']
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    """(client, traced statements, writer connection) for two SIZE node trees"""
+    path = str(tmp_path_factory.mktemp('plans') / 'plans.db')
+    conn = create_database(path)
+    load_tree(conn, SIZE, tree_id=1, seed=1)
+    load_tree(conn, SIZE, tree_id=2, seed=2)
+    conn.close()
+
+    os.environ['DATABASE'] = path
+    import app as tree_app
+    import db
+    tree_app.app.config.update(DATABASE=path, TREE_ENGINE='python')
+
+    statements = []
+    for readonly in (False, True):
+        db.get_connection(tree_app.app.config, readonly).set_trace_callback(statements.append)
+    client = tree_app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = OWNER_ID
+    conn = db.get_connection(tree_app.app.config)
+    yield client, statements, conn
+    for readonly in (False, True):
+        db.get_connection(tree_app.app.config, readonly).set_trace_callback(None)
+
+
+def scans_of(api, method, url, body):
+    client, statements, conn = api
+    statements.clear()
+    response = client.open(url, method=method, json=body)
+    assert response.status_code < 400, response.get_data(as_text=True)
+    conn.set_trace_callback(None)
+    try:
+        return [(' '.join(sql.split()), scans) for sql, plan, scans in statement_plans(conn, statements) if scans]
+    finally:
+        conn.set_trace_callback(statements.append)
+
+
+@pytest.mark.parametrize('index', range(len(READS)), ids=[url for _, url, _ in READS])
+def test_reads_use_index_ranges(api, index):
+    node, deep = sample_nodes(api[2], SIZE)
+    method, url, body = [r for r in api_requests(SIZE, node, deep) if r[0] == 'GET'][index]
+    assert scans_of(api, method, url, body) == []
+
+
+def test_writes_use_index_ranges(api):
+    node, deep = sample_nodes(api[2], SIZE)
+    for method, url, body in api_requests(SIZE, node, deep):
+        if method != 'GET':
+            assert scans_of(api, method, url, body) == [], f'{method} {url}'
@@ -0,0 +1,62 @@
+"""check_changed must see every row an add, move or delete can have changed."""
+import pytest
+
+import tree_check
+
+TREE_SIZE = 200
+
+
+@pytest.fixture
+def tree(conn):
+    """A tree without gaps of TREE_SIZE nodes, each added as the last child of a random earlier one"""
+    conn.execute("INSERT INTO add_root_operation (name, gap, owner_id) VALUES ('Root', 0, 1)")
+    for i in range(2, TREE_SIZE + 1):
+        conn.execute("INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, 'Node', 'last-child')",
+                     ((i * 7919) % (i - 1) + 1,))
+    conn.commit()
+    return conn
+
+
+def leaves(conn):
+    return conn.execute('SELECT id, lft FROM tree WHERE rgt = lft + 1 ORDER BY lft').fetchall()
+
+
+def test_consistent_tree_has_no_problems(tree):
+    assert tree_check.check_tree(tree, 1) == []
+    for _, lft in leaves(tree):
+        assert tree_check.check_changed(tree, 1, lft) == []
+
+
+@pytest.mark.parametrize('broken', ['root rgt', 'parent rgt', 'last row'])
+def test_shifted_rows_outside_the_parent_are_checked(tree, broken):
+    node_id, lft = leaves(tree)[len(leaves(tree)) // 2]
+    if broken == 'root rgt':
+        tree.execute('UPDATE tree SET rgt = rgt + 1 WHERE level = 0')
+    elif broken == 'parent rgt':
+        tree.execute('UPDATE tree SET rgt = rgt + 1 WHERE id = ?', (tree_check.parent_id(tree, node_id),))
+    else:
+        tree.execute('UPDATE tree SET lft = lft + 1 WHERE lft = (SELECT MAX(lft) FROM tree)')
+    assert tree_check.check_changed(tree, 1, lft)
+
+
+def test_rows_before_the_change_are_not_read(tree):
+    node_id, lft = leaves(tree)[-1]
+    first_id, _ = leaves(tree)[0]
+    tree.execute('UPDATE tree SET level = level + 1 WHERE id = ?', (first_id,))
+    assert tree_check.check_changed(tree, 1, lft) == []
+    assert tree_check.check_tree(tree, 1)
+
+
+def test_gapped_tree_is_checked_whole(conn):
+    conn.execute("INSERT INTO add_root_operation (name, gap, owner_id) VALUES ('Root', 10, 1)")
+    for _ in range(5):
+        conn.execute("INSERT INTO add_node_operation (target_node_id, name, position) VALUES (1, 'Node', 'last-child')")
+    first_id, _ = leaves(conn)[0]
+    _, last_lft = leaves(conn)[-1]
+    conn.execute('UPDATE tree SET level = level + 1 WHERE id = ?', (first_id,))
+    assert tree_check.check_changed(conn, 1, last_lft)
+
+
+def test_removed_tree_has_no_problems(tree):
+    tree.execute('INSERT INTO delete_node_operation (node_id) VALUES (1)')
+    assert tree_check.check_changed(tree, 1, 1) == []
@@ -0,0 +1,111 @@
+"""tree_engine must leave the database exactly as the move/delete triggers do."""
+import random
+import sqlite3
+
+import pytest
+
+import tree_engine
+from conftest import create_database
+
+OWNER_ID = 1
+
+STATE_QUERIES = (
+    'SELECT id, tree_id, lft, rgt, level, name, id_path FROM tree ORDER BY id',
+    'SELECT tree_id, sort_key, gap, version, owner_id FROM trees ORDER BY tree_id',
+    'SELECT version FROM tree_version',
+    'SELECT owner_id, version FROM workspace_version ORDER BY owner_id',
+    'SELECT id, tree_id, old_tree_id, owner_id, version, kind, node_id, data FROM tree_journal ORDER BY id',
+)
+
+# Nodes whose materialized path differs from the one tree_indented derives from lft/rgt
+STALE_PATHS = 'SELECT COUNT(*) FROM tree JOIN tree_indented USING (id) WHERE tree.id_path <> tree_indented.id_path'
+
+
+def state(conn):
+    return [[tuple(row) for row in conn.execute(query)] for query in STATE_QUERIES]
+
+
+def trigger_move(conn, node_id, target_id, position):
+    conn.execute('INSERT INTO move_node_operation (node_id, target_node_id, position) VALUES (?, ?, ?)',
+                 (node_id, target_id, position))
+
+
+def trigger_delete(conn, node_id):
+    conn.execute('INSERT INTO delete_node_operation (node_id) VALUES (?)', (node_id,))
+
+
+ENGINES = {
+    'triggers': (trigger_move, trigger_delete),
+    'python': (tree_engine.move_node, tree_engine.delete_node),
+}
+
+
+def random_operation(conn, rng):
+    """A random add, new tree (gapped or not), move or delete; some moves target the node's own subtree"""
+    nodes = conn.execute('SELECT id, tree_id, lft, rgt FROM tree').fetchall()
+    if len(nodes) < 3 or rng.random() < 0.4:
+        if not nodes or rng.random() < 0.15:
+            return ('root', rng.choice((0, 0, 10)))
+        return ('add', rng.choice(nodes)['id'], rng.choice(('first-child', 'last-child')))
+    if rng.random() < 0.05:
+        return ('delete', rng.choice(nodes)['id'])
+    node = rng.choice(nodes)
+    position = rng.choice(tree_engine.POSITIONS)
+    if rng.random() < 0.1:
+        return ('move', node['id'], None, position)
+    inside = [t for t in nodes if t['tree_id'] == node['tree_id'] and node['lft'] <= t['lft'] <= node['rgt']]
+    if rng.random() < 0.05:
+        return ('move', node['id'], rng.choice(inside)['id'], position)
+    targets = [t for t in nodes if t not in inside]
+    return ('move', node['id'], rng.choice(targets)['id'] if targets else None, position)
+
+
+def apply(conn, op, engine):
+    """Apply op in its own transaction; the error message if it was refused, else None"""
+    move, delete = ENGINES[engine]
+    try:
+        if op[0] == 'root':
+            conn.execute("INSERT INTO add_root_operation (name, gap, owner_id) VALUES ('Root', ?, ?)",
+                         (op[1], OWNER_ID))
+        elif op[0] == 'add':
+            conn.execute("INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, 'Node', ?)",
+                         (op[1], op[2]))
+        elif op[0] == 'move':
+            move(conn, *op[1:])
+        else:
+            delete(conn, op[1])
+    except (ValueError, sqlite3.IntegrityError) as e:
+        conn.rollback()
+        return str(e)
+    conn.commit()
+    return None
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_random_operations_match_triggers(seed):
+    rng = random.Random(seed)
+    databases = {engine: create_database() for engine in ENGINES}
+    for step in range(300):
+        op = random_operation(databases['triggers'], rng)
+        errors = {engine: apply(conn, op, engine) for engine, conn in databases.items()}
+        assert errors['triggers'] == errors['python'], f'step {step}: {op}'
+        assert state(databases['triggers']) == state(databases['python']), f'step {step}: {op}'
+        assert databases['python'].execute(STALE_PATHS).fetchone()[0] == 0, f'step {step}: {op}'
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('target', ['node', 'child', 'grandchild'])
+def test_move_into_own_subtree_is_refused(conn, engine, target):
+    conn.execute("INSERT INTO add_root_operation (name, gap, owner_id) VALUES ('Root', 0, ?)", (OWNER_ID,))
+    ids = [1]
+    for _ in range(3):
+        conn.execute("INSERT INTO add_node_operation (target_node_id, name, position) VALUES (?, 'Node', 'last-child')",
+                     (ids[-1],))
+        ids.append(conn.execute('SELECT MAX(id) FROM tree').fetchone()[0])
+    conn.commit()
+    before = state(conn)
+    node = ids[1]
+    target_id = {'node': node, 'child': ids[2], 'grandchild': ids[3]}[target]
+    error = apply(conn, ('move', node, target_id, 'last-child'), engine)
+    assert error == 'Cannot move a node into its own subtree'
+    assert state(conn) == before
@@ -0,0 +1,321 @@
+"""Verify and repair the nested-set numbering of trees.
+
+check_tree reads one tree's rows in lft order (one range of the
+(tree_id, lft) index) and replays them against a stack of open ancestors,
+so a tree of n rows costs one index range scan and O(n) work, with memory
+for one root-to-leaf path. It reports:
+
+    numbering   lft/rgt values not strictly increasing in visiting order
+                (duplicates, overlaps), or, with gap = 0, not exactly 1..2n
+    nesting     lft >= rgt, or a node that ends after its parent
+    level       level other than parent level + 1 (0 for the root)
+    root        more than one root in a tree
+    tree        nodes whose tree_id has no trees row, or a tree without nodes
+    id_path     id_path other than the parent's id_path plus the id
+
+Given lo and hi it checks only the rows with lft in [lo, hi], starting from
+the nodes that enclose lo (one (tree_id, level, lft) lookup per level) and
+the last value before lo. check_changed uses that after each write when
+TREE_CHECK_WRITES is on: an add, move or delete in a tree without gaps
+shifts every value after its position, and the rgt of every node around it,
+so it checks from that position to the end of the tree.
+
+repair_tree derives every node's parent, either from id_path (kept by the
+add and move operations independently of lft/rgt) or from the lft order and
+levels, renumbers the tree from that in preorder and writes every changed
+row with one UPDATE. check_fts and rebuild_fts do the same for the tree_fts
+full-text index.
+"""
+import sqlite3
+from collections import namedtuple
+
+# Problems reported per check before giving up on the rest
+MAX_PROBLEMS = 100
+
+PARENT_SOURCES = ('id_path', 'levels')
+
+Row = namedtuple('Row', 'id lft rgt level id_path')
+
+
+class TreeCheck:
+    """State of one pass over a tree's rows in lft order"""
+
+    def __init__(self, tree_id, gap, limit, last=None):
+        self.tree_id = tree_id
+        self.gap = gap
+        self.limit = limit
+        self.last = last  # previous lft/rgt value visited, None if unknown
+        self.stack = []
+        self.roots = 0
+        self.problems = []
+
+    def problem(self, node_id, kind, message):
+        if len(self.problems) < self.limit:
+            self.problems.append({'tree_id': self.tree_id, 'node_id': node_id, 'kind': kind, 'message': message})
+
+    def visit(self, node_id, value):
+        if self.last is not None:
+            if self.gap == 0 and value != self.last + 1:
+                self.problem(node_id, 'numbering', f'value {value} follows {self.last}; expected {self.last + 1}')
+            elif value <= self.last:
+                self.problem(node_id, 'numbering', f'value {value} follows {self.last}')
+        self.last = value
+
+    def close(self, until=None):
+        """Visit the rgt of open nodes that end before until (all if None)"""
+        while self.stack and (until is None or self.stack[-1].rgt < until):
+            node = self.stack.pop()
+            self.visit(node.id, node.rgt)
+
+    def node(self, row):
+        self.close(row.lft)
+        self.visit(row.id, row.lft)
+        if row.lft >= row.rgt:
+            self.problem(row.id, 'nesting', f'lft {row.lft} is not less than rgt {row.rgt}')
+        parent = self.stack[-1] if self.stack else None
+        if parent is None:
+            self.roots += 1
+            if self.roots == 2:
+                self.problem(row.id, 'root', 'second root in the tree')
+            if row.level != 0:
+                self.problem(row.id, 'level', f'level {row.level} at the top of the tree; expected 0')
+            expected_path = str(row.id)
+        else:
+            if row.rgt > parent.rgt:
+                self.problem(row.id, 'nesting', f'ends at {row.rgt}, after its parent {parent.id} ({parent.rgt})')
+            if row.level != parent.level + 1:
+                self.problem(row.id, 'level', f'level {row.level} under parent {parent.id} of level {parent.level}')
+            expected_path = f'{parent.id_path}.{row.id}'
+        if row.id_path != expected_path:
+            self.problem(row.id, 'id_path', f'id_path {row.id_path!r}; expected {expected_path!r}')
+        self.stack.append(row)
+
+
+def tree_gap(conn, tree_id):
+    row = conn.execute('SELECT gap FROM trees WHERE tree_id = ?', (tree_id,)).fetchone()
+    return None if row is None else row[0]
+
+
+def enclosing(conn, tree_id, point):
+    """The nodes with lft < point <= rgt, root first, found by level from the (tree_id, level, lft) index.
+
+    Nodes of one level do not overlap, so only the last one starting before
+    point can enclose it, and none of a deeper level can if none of this one does.
+    """
+    found = []
+    while True:
+        row = conn.execute('''
+            SELECT id, lft, rgt, level, id_path FROM tree
+            WHERE tree_id = ? AND level = ? AND lft < ?
+            ORDER BY lft DESC
+            LIMIT 1
+        ''', (tree_id, len(found), point)).fetchone()
+        if row is None or row[2] < point:
+            return found
+        found.append(Row(*row))
+
+
+def previous_value(conn, tree_id, point):
+    """The largest lft or rgt in tree_id below point, 0 if there is none"""
+    return conn.execute('''
+        SELECT MAX(
+            IFNULL((SELECT MAX(lft) FROM tree WHERE tree_id = ?1 AND lft < ?2), 0),
+            IFNULL((SELECT MAX(rgt) FROM tree WHERE tree_id = ?1 AND rgt < ?2), 0)
+        )
+    ''', (tree_id, point)).fetchone()[0]
+
+
+def check_tree(conn, tree_id, lo=None, hi=None, limit=MAX_PROBLEMS):
+    """Problems in tree_id, or in the rows with lft in [lo, hi]; [] if it is consistent"""
+    gap = tree_gap(conn, tree_id)
+    ranged = lo is not None or hi is not None
+    lo = 0 if lo is None else lo
+    hi = (1 << 62) if hi is None else hi
+    rows = conn.execute('''
+        SELECT id, lft, rgt, level, id_path FROM tree
+        WHERE tree_id = ? AND lft BETWEEN ? AND ?
+        ORDER BY lft
+    ''', (tree_id, lo, hi))
+    check = TreeCheck(tree_id, gap or 0, limit, last=previous_value(conn, tree_id, lo) if ranged else 0)
+    if gap is None:
+        check.problem(None, 'tree', 'nodes without a trees row')
+    if ranged:
+        check.stack = enclosing(conn, tree_id, lo)
+        check.roots = 1 if check.stack else 0
+    first = True
+    for row in map(Row._make, rows):
+        first = False
+        check.node(row)
+        if len(check.problems) >= limit:
+            return check.problems
+    if ranged:
+        # Ancestors that end past hi are closed outside the checked range
+        check.close(hi + 1)
+    else:
+        check.close()
+        if first and gap is not None:
+            check.problem(None, 'tree', 'tree has no nodes')
+    return check.problems
+
+
+def check_subtree(conn, node_id, limit=MAX_PROBLEMS):
+    """Problems in the subtree of node_id, or in its whole tree if it is a root"""
+    row = conn.execute('SELECT tree_id, lft, rgt, level FROM tree WHERE id = ?', (node_id,)).fetchone()
+    if row is None:
+        return []
+    tree_id, lft, rgt, level = row
+    if level == 0:
+        return check_tree(conn, tree_id, limit=limit)
+    return check_tree(conn, tree_id, lft, rgt, limit)
+
+
+def check_changed(conn, tree_id, lft, limit=MAX_PROBLEMS):
+    """Problems in the rows of tree_id that an add, move or delete at lft can have changed.
+
+    That is every row from lft on, plus the rgt of the nodes around lft, in a
+    tree without gaps, and the whole of a gapped tree, where making room may
+    renumber any subtree around lft. [] if the tree has no rows left.
+    """
+    gap = tree_gap(conn, tree_id)
+    if gap is None and conn.execute('SELECT 1 FROM tree WHERE tree_id = ?', (tree_id,)).fetchone() is None:
+        return []
+    if gap:
+        return check_tree(conn, tree_id, limit=limit)
+    return check_tree(conn, tree_id, lft, limit=limit)
+
+
+def parent_id(conn, node_id):
+    """The parent of node_id according to its id_path, or None for a root or a missing node"""
+    row = conn.execute('SELECT id_path FROM tree WHERE id = ?', (node_id,)).fetchone()
+    if row is None:
+        return None
+    head, _, _ = row[0].rpartition('.')
+    return int(head.rpartition('.')[2]) if head else None
+
+
+def check_all(conn, tree_ids=None, limit=MAX_PROBLEMS):
+    """Problems in the given trees, or in every tree plus nodes whose tree is missing"""
+    problems = []
+    if tree_ids is None:
+        tree_ids = [row[0] for row in conn.execute('SELECT tree_id FROM trees ORDER BY tree_id')]
+        orphans = conn.execute('''
+            SELECT DISTINCT tree_id FROM tree
+            WHERE NOT EXISTS (SELECT 1 FROM trees WHERE trees.tree_id = tree.tree_id)
+        ''').fetchall()
+        tree_ids += [row[0] for row in orphans]
+    for tree_id in tree_ids:
+        problems += check_tree(conn, tree_id, limit=limit - len(problems))
+        if len(problems) >= limit:
+            break
+    return problems
+
+
+def derive_parents(conn, tree_id, source):
+    """[(id, parent id or None)] in lft order, from id_path or from the lft order and levels"""
+    rows = conn.execute(
+        'SELECT id, level, id_path FROM tree WHERE tree_id = ? ORDER BY lft, id', (tree_id,)
+    ).fetchall()
+    parents = []
+    if source == 'id_path':
+        ids = {row[0] for row in rows}
+        for node_id, level, id_path in rows:
+            head, _, _ = id_path.rpartition('.')
+            parent = int(head.rpartition('.')[2]) if head else None
+            if parent is not None and parent not in ids:
+                raise ValueError(f'Node {node_id}: parent {parent} from id_path is not in tree {tree_id}')
+            parents.append((node_id, parent))
+    elif source == 'levels':
+        stack = []  # (level, id) of the path to the previous node
+        for node_id, level, id_path in rows:
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            if (stack[-1][0] if stack else -1) != level - 1:
+                raise ValueError(f'Node {node_id}: no node of level {level - 1} before it in lft order')
+            parents.append((node_id, stack[-1][1] if stack else None))
+            stack.append((level, node_id))
+    else:
+        raise ValueError('source must be one of: ' + ', '.join(PARENT_SOURCES))
+    return parents
+
+
+def renumber(tree_id, parents, gap):
+    """(lft, rgt, level, id_path, id) for every node, numbered in preorder from parents.
+
+    Siblings keep the order in which parents lists them.
+    """
+    children = {}
+    roots = []
+    for node_id, parent in parents:
+        (roots if parent is None else children.setdefault(parent, [])).append(node_id)
+    if len(roots) != 1:
+        raise ValueError(f'Tree {tree_id} would have {len(roots)} roots')
+    step = gap if gap > 0 else 1
+    rows = []
+    point = 0
+    # (id, level, id_path) to visit a node; a node's index in rows, pushed
+    # under its children, to give it its rgt once they are done
+    stack = [(roots[0], 0, str(roots[0]))]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, int):
+            rows[entry][1] = 1 + point * step
+            point += 1
+            continue
+        node_id, level, id_path = entry
+        rows.append([1 + point * step, None, level, id_path, node_id])
+        point += 1
+        stack.append(len(rows) - 1)
+        for child in reversed(children.get(node_id, ())):
+            stack.append((child, level + 1, f'{id_path}.{child}'))
+    if len(rows) != len(parents):
+        raise ValueError(f'Tree {tree_id}: {len(parents) - len(rows)} nodes are not reachable from the root')
+    return rows
+
+
+def repair_tree(conn, tree_id, source='id_path'):
+    """Renumber tree_id from the parent structure in source; returns the number of rows rewritten.
+
+    Must be called inside a transaction. Records a 'repair' journal entry
+    (clients reload the tree) and bumps the tree's version if anything changed.
+    """
+    gap = tree_gap(conn, tree_id)
+    if gap is None:
+        raise ValueError(f'Tree {tree_id} not found')
+    rows = renumber(tree_id, derive_parents(conn, tree_id, source), gap)
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS tree_repair (
+            id INTEGER PRIMARY KEY, lft INTEGER, rgt INTEGER, level INTEGER, id_path TEXT
+        )
+    ''')
+    conn.execute('DELETE FROM temp.tree_repair')
+    conn.executemany(
+        'INSERT INTO temp.tree_repair (lft, rgt, level, id_path, id) VALUES (?, ?, ?, ?, ?)', rows
+    )
+    changed = conn.execute('''
+        UPDATE tree
+        SET lft = fix.lft, rgt = fix.rgt, level = fix.level, id_path = fix.id_path
+        FROM temp.tree_repair AS fix
+        WHERE tree.tree_id = ? AND tree.id = fix.id
+          AND (tree.lft, tree.rgt, tree.level, tree.id_path) IS NOT (fix.lft, fix.rgt, fix.level, fix.id_path)
+    ''', (tree_id,)).rowcount
+    conn.execute('DELETE FROM temp.tree_repair')
+    if changed:
+        conn.execute('INSERT INTO bump_tree_version_operation (tree_id) VALUES (?)', (tree_id,))
+        conn.execute(
+            "INSERT INTO journal_node_operation (kind, node_id) VALUES ('repair', ?)", (rows[0][4],)
+        )
+    return changed
+
+
+def check_fts(conn):
+    """Problems between tree_fts and the names in tree; [] if the index matches"""
+    try:
+        conn.execute("INSERT INTO tree_fts (tree_fts, rank) VALUES ('integrity-check', 1)")
+    except sqlite3.DatabaseError as e:
+        return [{'tree_id': None, 'node_id': None, 'kind': 'fts', 'message': str(e)}]
+    return []
+
+
+def rebuild_fts(conn):
+    """Rebuild tree_fts from the names in tree"""
+    conn.execute("INSERT INTO tree_fts (tree_fts) VALUES ('rebuild')")
@@ -0,0 +1,224 @@
+"""Columnar binary encoding of node lists, the alternative to JSON arrays of objects.
+
+The JSON endpoints repeat every key for every node. This encoding sends
+each column once: integer columns as little-endian typed arrays the
+browser can view without parsing, and text columns as a dictionary of
+distinct values plus one index per row. static/tree-columns.js decodes it.
+
+Layout (all integers little-endian):
+
+    b'TCOL'                 magic
+    uint32                  length of the header
+    header                  UTF-8 JSON: {"rows": n, "columns": [...]}
+    column data             for each column that has data, n values,
+                            starting at a multiple of 8 bytes
+
+Each header column is {"name": ..., "type": ...} plus, by type:
+
+    int32, float64          n values in the column data
+    string                  "dictionary": distinct values (null included),
+                            "index": "uint16" or "uint32"; n indexes into the
+                            dictionary in the column data
+    json                    "values": the n values themselves; used for text
+                            columns without repeated values (id_path) and
+                            anything that is not an integer or text
+
+float64 holds integers outside the int32 range exactly up to 2**53.
+"""
+import json
+import sys
+from array import array
+from itertools import islice
+
+MIMETYPE = 'application/vnd.sqlitetree.columns'
+
+MAGIC = b'TCOL'
+
+# Typed array views need offsets aligned to their item size
+ALIGNMENT = 8
+
+# Largest integer a float64 (a JavaScript number) holds exactly
+MAX_EXACT_FLOAT = 2 ** 53
+
+# Rows read from the cursor per step of encode_columns
+CHUNK_ROWS = 1000
+
+_STRING_TYPES = {str, type(None)}
+
+
+class _Column:
+    """One column's values, appended chunk by chunk into the array of the
+    narrowest type that holds them all so far"""
+
+    def __init__(self, name):
+        self.name = name
+        self.kind = None  # until a value other than None: leading_nulls counts them
+        self.leading_nulls = 0
+        self.data = None
+        self.positions = None  # string: value -> dictionary index
+
+    def extend(self, values):
+        """Append a chunk of values, in one array operation where the types allow"""
+        kind = self.kind
+        if kind == 'int32' or kind == 'float64':
+            if all(type(v) is int for v in values) and (
+                kind == 'int32' or all(-MAX_EXACT_FLOAT <= v <= MAX_EXACT_FLOAT for v in values)
+            ):
+                try:
+                    self.data += array(self.data.typecode, values)
+                    return
+                except OverflowError:
+                    pass
+        elif kind == 'string':
+            if set(map(type, values)) <= _STRING_TYPES:
+                positions = self.positions
+                indexes = [positions.setdefault(v, len(positions)) for v in values]
+                try:
+                    self.data += array(self.data.typecode, indexes)
+                except OverflowError:
+                    self.data = array('I', self.data) + array('I', indexes)
+                return
+        elif kind == 'json':
+            self.data += values
+            return
+        for value in values:
+            self.append(value)
+
+    def append(self, value):
+        kind = self.kind
+        if kind == 'int32' or kind == 'float64':
+            if type(value) is int and -MAX_EXACT_FLOAT <= value <= MAX_EXACT_FLOAT:
+                try:
+                    self.data.append(value)
+                    return
+                except OverflowError:
+                    if kind == 'int32':
+                        self.kind, self.data = 'float64', array('d', self.data)
+                        self.data.append(value)
+                        return
+        elif kind == 'string':
+            if value is None or type(value) is str:
+                position = self.positions.setdefault(value, len(self.positions))
+                try:
+                    self.data.append(position)
+                except OverflowError:
+                    self.data = array('I', self.data)
+                    self.data.append(position)
+                return
+        elif kind == 'json':
+            self.data.append(value)
+            return
+        elif value is None:
+            self.leading_nulls += 1
+            return
+        elif type(value) is int and not self.leading_nulls:
+            self.kind, self.data = 'int32', array('i')
+            self.append(value)
+            return
+        elif type(value) is str:
+            self.kind, self.data, self.positions = 'string', array('H'), {}
+            for _ in range(self.leading_nulls):
+                self.append(None)
+            self.append(value)
+            return
+        self.kind, self.data = 'json', self.values() + [value]
+
+    def values(self):
+        """The values appended so far, as a list"""
+        if self.kind is None:
+            return [None] * self.leading_nulls
+        if self.kind == 'string':
+            dictionary = list(self.positions)
+            return [dictionary[i] for i in self.data]
+        if self.kind == 'float64':
+            return [int(v) for v in self.data]
+        return list(self.data)
+
+    def finish(self, rows):
+        """(header spec, bytes or None) once all rows are appended"""
+        spec = {'name': self.name}
+        if self.kind is None:
+            # Only nulls: one dictionary entry
+            self.kind, self.data = 'string', array('H', [0] * rows)
+            self.positions = {None: 0} if rows else {}
+        if self.kind == 'string' and len(self.positions) == rows:
+            # No value repeats, so the indexes would only add to the size
+            self.kind, self.data = 'json', self.values()
+        if self.kind == 'json':
+            spec['type'] = 'json'
+            spec['values'] = self.data
+            return spec, None
+        spec['type'] = self.kind
+        if self.kind == 'string':
+            spec['dictionary'] = list(self.positions)
+            spec['index'] = 'uint16' if self.data.typecode == 'H' else 'uint32'
+        if sys.byteorder == 'big':
+            self.data.byteswap()
+        return spec, self.data.tobytes()
+
+
+def encode_columns(names, rows):
+    """Encode rows (sequences in the order of names, e.g. sqlite3.Row) as bytes.
+
+    rows may be any iterable, a cursor included: it is read CHUNK_ROWS rows
+    at a time into per-column arrays, so the rows are never held as a list.
+    """
+    columns = [_Column(name) for name in names]
+    count = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        for column, values in zip(columns, zip(*chunk)):
+            column.extend(values)
+        count += len(chunk)
+    header = {'rows': count, 'columns': []}
+    buffers = []
+    for column in columns:
+        spec, data = column.finish(count)
+        header['columns'].append(spec)
+        if data is not None:
+            buffers.append(data)
+
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+    parts = [MAGIC, len(header_bytes).to_bytes(4, 'little'), header_bytes]
+    size = len(MAGIC) + 4 + len(header_bytes)
+    for data in buffers:
+        padding = -size % ALIGNMENT
+        parts += [b'\0' * padding, data]
+        size += padding + len(data)
+    return b''.join(parts)
+
+
+def decode_columns(body):
+    """The rows of an encoded body as dicts; the inverse of encode_columns"""
+    if body[:4] != MAGIC:
+        raise ValueError('Not a columns body')
+    header_length = int.from_bytes(body[4:8], 'little')
+    offset = 8 + header_length
+    header = json.loads(body[8:offset])
+    n = header['rows']
+    columns = []
+    for spec in header['columns']:
+        kind = spec['type']
+        if kind == 'json':
+            columns.append(spec['values'])
+            continue
+        typecode = {'int32': 'i', 'float64': 'd'}.get(kind) or {'uint16': 'H', 'uint32': 'I'}[spec['index']]
+        data = array(typecode)
+        offset += -offset % ALIGNMENT
+        end = offset + n * data.itemsize
+        data.frombytes(body[offset:end])
+        offset = end
+        if sys.byteorder == 'big':
+            data.byteswap()
+        if kind == 'string':
+            dictionary = spec['dictionary']
+            columns.append([dictionary[i] for i in data])
+        elif kind == 'float64':
+            columns.append([int(v) for v in data])
+        else:
+            columns.append(data.tolist())
+    names = [spec['name'] for spec in header['columns']]
+    return [dict(zip(names, values)) for values in zip(*columns)] if names else []
@@ -0,0 +1,226 @@
+"""Nested-set moves and deletes computed in Python (TREE_ENGINE=python).
+
+move_node_operation runs its arithmetic through a dozen trigger views that
+write and re-read move_operation_params and issue one UPDATE per step.
+Here the same arithmetic is done in Python from the node and target rows,
+and the tree rows are rewritten by a single UPDATE ... SET lft = CASE ...
+limited to the affected range. The results, including tree ids, sort keys,
+versions and journal entries, are the same as the triggers';
+tests/test_tree_engine.py replays random operations through both.
+
+Trees numbered with gaps (trees.gap > 0) allocate free values through
+gap_bounds and make_gap_room_operation, so moves that touch one still go
+through move_node_operation. Operations on whole trees (new trees, display
+order) reuse the same views as the triggers.
+
+Both refuse to move a node into its own subtree. Every UPDATE is limited
+to index ranges of the affected values: since lft < rgt, "lft > x OR
+rgt > x" is written as "rgt > x", and rows with either end in an interval
+are collected from both the (tree_id, lft, rgt) and the (tree_id, rgt, lft)
+index.
+"""
+from collections import namedtuple
+
+POSITIONS = ('first-child', 'last-child', 'left', 'right')
+
+Node = namedtuple('Node', 'id lft rgt level tree_id gap owner_id')
+
+
+def get_node(conn, node_id):
+    row = conn.execute('''
+        SELECT tree.id, lft, rgt, level, tree.tree_id, IFNULL(trees.gap, 0), trees.owner_id
+        FROM tree LEFT JOIN trees ON trees.tree_id = tree.tree_id
+        WHERE tree.id = ?
+    ''', (node_id,)).fetchone()
+    return Node(*row) if row else None
+
+
+def move_node(conn, node_id, target_node_id, position):
+    """Move node_id relative to target_node_id, or make it a new tree if the target is None"""
+    if position not in POSITIONS:
+        raise ValueError('Position must be one of: ' + ', '.join(POSITIONS))
+    node = get_node(conn, node_id)
+    if node is None:
+        return
+    target = get_node(conn, target_node_id) if target_node_id is not None else None
+    if target and target.tree_id == node.tree_id and node.lft <= target.lft <= node.rgt:
+        raise ValueError('Cannot move a node into its own subtree')
+    if node.gap > 0 or (target and target.gap > 0):
+        conn.execute(
+            'INSERT INTO move_node_operation (node_id, target_node_id, position) VALUES (?, ?, ?)',
+            (node_id, target_node_id, position)
+        )
+        return
+
+    # The same cases, in the same order, as move_node_operation_insert
+    if target is None:
+        if node.level > 0:
+            conn.execute(
+                'INSERT INTO trees (sort_key, gap, owner_id) '
+                'SELECT IFNULL(MAX(sort_key), 0) + 1024, ?1, ?2 FROM trees WHERE owner_id IS ?2',
+                (node.gap, node.owner_id)
+            )
+            detach_subtree(conn, node, conn.execute('SELECT MAX(tree_id) FROM trees').fetchone()[0])
+    elif target.level == 0 and position in ('left', 'right'):
+        if node.level == 0:
+            conn.execute(
+                'INSERT INTO place_tree_operation (tree_id, target_tree_id, position) VALUES (?, ?, ?)',
+                (node.tree_id, target.tree_id, position)
+            )
+        else:
+            conn.execute(
+                'INSERT INTO create_tree_space_operation (target_tree_id, position, gap) VALUES (?, ?, ?)',
+                (target.tree_id, position, node.gap)
+            )
+            detach_subtree(conn, node, conn.execute('SELECT MAX(tree_id) FROM trees').fetchone()[0])
+    elif node.tree_id == target.tree_id:
+        move_within_tree(conn, node, target, position)
+    else:
+        move_to_tree(conn, node, target, position)
+
+    conn.execute('INSERT INTO refresh_id_path_operation (node_id) VALUES (?)', (node.id,))
+    conn.execute('''
+        INSERT INTO bump_tree_version_operation (tree_id)
+        SELECT ?1
+        UNION
+        SELECT ?2 WHERE ?2 IS NOT NULL
+        UNION
+        SELECT tree_id FROM tree WHERE id = ?3
+    ''', (node.tree_id, target.tree_id if target else None, node.id))
+    conn.execute(
+        "INSERT INTO journal_node_operation (kind, node_id, old_tree_id) VALUES ('move', ?, ?)",
+        (node.id, node.tree_id)
+    )
+
+
+def level_change(node, target, position):
+    if position in ('first-child', 'last-child'):
+        return node.level - target.level - 1
+    return node.level - target.level
+
+
+def detach_subtree(conn, node, new_tree_id):
+    """Make node the root of new_tree_id and close the hole it leaves"""
+    width = node.rgt - node.lft + 1
+    conn.execute('''
+        UPDATE tree
+        SET
+            level = CASE WHEN lft BETWEEN :lft AND :rgt THEN level - :level ELSE level END,
+            tree_id = CASE WHEN lft BETWEEN :lft AND :rgt THEN :new_tree_id ELSE tree_id END,
+            lft = CASE
+                WHEN lft BETWEEN :lft AND :rgt THEN lft - :lft + 1
+                WHEN lft >= :lft THEN lft - :width
+                ELSE lft
+            END,
+            rgt = CASE
+                WHEN rgt BETWEEN :lft AND :rgt THEN rgt - :lft + 1
+                WHEN rgt >= :lft THEN rgt - :width
+                ELSE rgt
+            END
+        WHERE tree_id = :tree_id AND rgt >= :lft
+    ''', {'lft': node.lft, 'rgt': node.rgt, 'level': node.level, 'width': width,
+          'tree_id': node.tree_id, 'new_tree_id': new_tree_id})
+
+
+def move_within_tree(conn, node, target, position):
+    """Move the subtree to its new place and shift the values in between the other way"""
+    width = node.rgt - node.lft + 1
+    if position == 'last-child':
+        new_lft = target.rgt - width if target.rgt > node.rgt else target.rgt
+    elif position == 'first-child':
+        new_lft = target.lft - width + 1 if target.lft > node.lft else target.lft + 1
+    elif position == 'left':
+        new_lft = target.lft - width if target.lft > node.lft else target.lft
+    else:
+        new_lft = target.rgt - width + 1 if target.rgt > node.rgt else target.rgt + 1
+    offset = new_lft - node.lft
+    conn.execute('''
+        UPDATE tree
+        SET
+            level = CASE WHEN lft BETWEEN :lft AND :rgt THEN level - :level_change ELSE level END,
+            lft = CASE
+                WHEN lft BETWEEN :lft AND :rgt THEN lft + :offset
+                WHEN lft BETWEEN :low AND :high THEN lft + :shift
+                ELSE lft
+            END,
+            rgt = CASE
+                WHEN rgt BETWEEN :lft AND :rgt THEN rgt + :offset
+                WHEN rgt BETWEEN :low AND :high THEN rgt + :shift
+                ELSE rgt
+            END
+        WHERE id IN (
+            SELECT id FROM tree WHERE tree_id = :tree_id AND lft BETWEEN :low AND :high
+            UNION ALL
+            SELECT id FROM tree WHERE tree_id = :tree_id AND rgt BETWEEN :low AND :high AND lft < :low
+        )
+    ''', {'lft': node.lft, 'rgt': node.rgt, 'tree_id': node.tree_id,
+          'level_change': level_change(node, target, position), 'offset': offset,
+          'low': min(node.lft, new_lft), 'high': max(node.rgt, new_lft + width - 1),
+          'shift': -width if offset > 0 else width})
+
+
+def move_to_tree(conn, node, target, position):
+    """Open a hole in the target's tree, move the subtree into it and close the one it leaves"""
+    width = node.rgt - node.lft + 1
+    space_target = {
+        'last-child': target.rgt - 1,
+        'first-child': target.lft,
+        'left': target.lft - 1,
+        'right': target.rgt,
+    }[position]
+    conn.execute('''
+        UPDATE tree
+        SET
+            level = CASE
+                WHEN tree_id = :tree_id AND lft BETWEEN :lft AND :rgt THEN level - :level_change
+                ELSE level
+            END,
+            tree_id = CASE WHEN tree_id = :tree_id AND lft BETWEEN :lft AND :rgt THEN :target_tree_id ELSE tree_id END,
+            lft = CASE
+                WHEN tree_id = :target_tree_id THEN CASE WHEN lft > :space_target THEN lft + :width ELSE lft END
+                WHEN lft BETWEEN :lft AND :rgt THEN lft - :offset
+                WHEN lft >= :lft THEN lft - :width
+                ELSE lft
+            END,
+            rgt = CASE
+                WHEN tree_id = :target_tree_id THEN CASE WHEN rgt > :space_target THEN rgt + :width ELSE rgt END
+                WHEN rgt BETWEEN :lft AND :rgt THEN rgt - :offset
+                WHEN rgt >= :lft THEN rgt - :width
+                ELSE rgt
+            END
+        WHERE (tree_id = :target_tree_id AND rgt > :space_target)
+           OR (tree_id = :tree_id AND rgt >= :lft)
+    ''', {'lft': node.lft, 'rgt': node.rgt, 'tree_id': node.tree_id, 'width': width,
+          'target_tree_id': target.tree_id, 'space_target': space_target,
+          'level_change': level_change(node, target, position),
+          'offset': node.lft - space_target - 1})
+    if node.level == 0:
+        # The node's old tree is now empty
+        conn.execute('DELETE FROM trees WHERE tree_id = ?', (node.tree_id,))
+
+
+def delete_node(conn, node_id):
+    """Delete node_id and its subtree and close the hole (contiguous trees only)"""
+    node = get_node(conn, node_id)
+    if node is None:
+        return
+    width = node.rgt - node.lft + 1
+    conn.execute('DELETE FROM tree WHERE tree_id = ? AND lft BETWEEN ? AND ?',
+                 (node.tree_id, node.lft, node.rgt))
+    if node.gap == 0:
+        conn.execute('''
+            UPDATE tree
+            SET lft = CASE WHEN lft > :lft THEN lft - :width ELSE lft END,
+                rgt = CASE WHEN rgt > :lft THEN rgt - :width ELSE rgt END
+            WHERE tree_id = :tree_id AND rgt > :lft
+        ''', {'lft': node.lft, 'width': width, 'tree_id': node.tree_id})
+    if node.level == 0:
+        conn.execute('DELETE FROM trees WHERE tree_id = ?', (node.tree_id,))
+    conn.execute('INSERT INTO bump_tree_version_operation (tree_id) VALUES (?)', (node.tree_id,))
+    conn.execute('''
+        INSERT INTO tree_journal (tree_id, owner_id, version, kind, node_id, data)
+        SELECT ?1, ?6, version, 'delete', ?2,
+            json_object('lft', ?3, 'rgt', ?4,
+                        'shift', json_object('from', ?4 + 1, 'by', ?5))
+        FROM tree_version
+    ''', (node.tree_id, node.id, node.lft, node.rgt, 0 if node.gap else -width, node.owner_id))
@@ -0,0 +1,84 @@
+"""Linear-time indentation of nested-set rows.
+
+Produces the same columns as the tree_indented view (indented_name,
+simple_indented_name, full_path, id_path, depth) from rows read in
+(tree_id, lft) order, using an ancestor stack instead of correlated
+subqueries per row.
+"""
+
+BRANCH = '├── '
+LAST_BRANCH = '└── '
+PIPE = '│   '
+SPACE = '    '
+
+
+def mark_last_children(rows):
+    """Return a list of flags telling whether each row has a following sibling.
+
+    Rows must be grouped by tree_id and ordered by lft within a tree. Only
+    containment (lft/rgt) is used, so gapped numbering works as well.
+    """
+    has_next = [False] * len(rows)
+    stack = []  # [rgt, index of last child seen] for each open ancestor
+    top_level = [None]  # last root seen in the current tree
+    tree_id = None
+    for i, row in enumerate(rows):
+        if row['tree_id'] != tree_id:
+            tree_id = row['tree_id']
+            stack = []
+            top_level = [None]
+        while stack and stack[-1][0] < row['lft']:
+            stack.pop()
+        siblings = stack[-1] if stack else top_level
+        previous = siblings[-1]
+        if previous is not None:
+            has_next[previous] = True
+        siblings[-1] = i
+        stack.append([row['rgt'], None])
+    return has_next
+
+
+def indent_rows(rows):
+    """Yield tree_indented dicts for rows ordered by tree_id, lft."""
+    rows = rows if isinstance(rows, list) else list(rows)
+    has_next = mark_last_children(rows)
+
+    stack = []  # (rgt, full_path, id_path, continuation prefix for children)
+    tree_id = None
+    for row, next_sibling in zip(rows, has_next):
+        if row['tree_id'] != tree_id:
+            tree_id = row['tree_id']
+            stack = []
+        while stack and stack[-1][0] < row['lft']:
+            stack.pop()
+
+        name = row['name']
+        node_id = row['id']
+        depth = len(stack)
+        if depth == 0:
+            full_path = name
+            id_path = str(node_id)
+            indented_name = name
+            child_prefix = ''
+        else:
+            parent_rgt, parent_path, parent_id_path, prefix = stack[-1]
+            full_path = f'{parent_path} > {name}'
+            id_path = f'{parent_id_path}.{node_id}'
+            indented_name = prefix + (BRANCH if next_sibling else LAST_BRANCH) + name
+            child_prefix = prefix + (PIPE if next_sibling else SPACE)
+        stack.append((row['rgt'], full_path, id_path, child_prefix))
+
+        yield {
+            'id': node_id,
+            'tree_id': row['tree_id'],
+            'indented_name': indented_name,
+            # Mirrors SUBSTR('    ', 1, level * 3) in the view
+            'simple_indented_name': SPACE[:row['level'] * 3] + name,
+            'name': name,
+            'lft': row['lft'],
+            'rgt': row['rgt'],
+            'level': row['level'],
+            'full_path': full_path,
+            'id_path': id_path,
+            'depth': depth,
+        }
@@ -0,0 +1,392 @@
+"""Streaming import and export of whole trees.
+
+Import reads nested JSON, adjacency-list CSV or indented text as a stream
+of enter/name/exit events and numbers the nodes in one depth-first pass.
+Rows go into the tree table in chunks, so loading n nodes is O(n) instead
+of the O(n^2) of calling add_node_operation per node.
+Only the path from the root to the current node is kept in memory.
+
+Export reads the tree table in lft order through a cursor and yields text
+chunks, so neither direction holds a whole tree in memory.
+"""
+import csv
+import io
+import json
+import re
+
+FORMATS = ('json', 'csv', 'text')
+EXTENSIONS = {'.json': 'json', '.csv': 'csv', '.txt': 'text'}
+
+CHUNK_ROWS = 10000
+CHUNK_CHARS = 64 * 1024
+READ_CHARS = 64 * 1024
+INDENT = '  '
+
+ENTER, NAME, EXIT = 'enter', 'name', 'exit'
+
+
+def guess_format(filename, default='json'):
+    """Pick the import/export format from a file extension"""
+    for extension, fmt in EXTENSIONS.items():
+        if filename and filename.lower().endswith(extension):
+            return fmt
+    return default
+
+
+# Import
+
+_TOKEN = re.compile(r'\s*(?:([{}\[\],:])|("(?:[^"\\]|\\.)*")|([^\s{}\[\],:"]+))')
+
+
+def _json_tokens(fp):
+    """Yield (kind, value) JSON tokens read from fp in chunks.
+
+    kind is one of the structural characters, 'value' for strings and
+    scalars (decoded with json.loads) or None at end of input.
+    """
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        match = _TOKEN.match(buf, pos)
+        # A token that touches the end of the buffer may continue in the next chunk
+        if (match is None or match.end() == len(buf)) and not eof:
+            chunk = fp.read(READ_CHARS)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        if match is None:
+            if buf[pos:].strip():
+                raise ValueError(f'Invalid JSON near {buf[pos:pos + 20]!r}')
+            yield None, None
+            return
+        pos = match.end()
+        structural, string, scalar = match.groups()
+        if structural:
+            yield structural, None
+        else:
+            try:
+                yield 'value', json.loads(string or scalar)
+            except ValueError:
+                raise ValueError(f'Invalid JSON value {(string or scalar)[:20]!r}') from None
+
+
+def _expect(tokens, kind):
+    token, value = next(tokens)
+    if token != kind:
+        raise ValueError(f'Expected {kind!r} in JSON, got {token or "end of input"!r}')
+    return value
+
+
+def _skip_json_value(tokens):
+    token, _ = next(tokens)
+    depth = 1 if token in ('{', '[') else 0
+    while depth:
+        token, _ = next(tokens)
+        if token in ('{', '['):
+            depth += 1
+        elif token in ('}', ']'):
+            depth -= 1
+        elif token is None:
+            raise ValueError('Unexpected end of JSON')
+
+
+def parse_nested_json(fp):
+    """Yield tree events from {"name": ..., "children": [...]} objects.
+
+    The document is one such object or a list of them (one per tree).
+    Other keys are ignored.
+    """
+    tokens = _json_tokens(fp)
+    stack = []  # 'node' or 'list' for each open container
+    token, value = next(tokens)
+    state = 'node'
+    if token == '[':
+        stack.append('list')
+        token, value = next(tokens)
+        state = 'end_list' if token == ']' else 'node'
+    while True:
+        if state == 'node':  # token should open a node
+            if token != '{':
+                raise ValueError(f'Expected a node object in JSON, got {token or "end of input"!r}')
+            yield ENTER, None
+            stack.append('node')
+            token, value = next(tokens)
+            state = 'end_node' if token == '}' else 'member'
+        elif state == 'member':  # token should be a key
+            if token != 'value' or not isinstance(value, str):
+                raise ValueError('Expected a key in JSON node object')
+            _expect(tokens, ':')
+            state = 'after_member'
+            if value == 'name':
+                yield NAME, str(_expect(tokens, 'value'))
+            elif value == 'children':
+                _expect(tokens, '[')
+                token, value = next(tokens)
+                if token != ']':
+                    stack.append('list')
+                    state = 'node'
+            else:
+                _skip_json_value(tokens)
+        elif state == 'after_member':
+            token, value = next(tokens)
+            if token == ',':
+                token, value = next(tokens)
+                state = 'member'
+            elif token == '}':
+                state = 'end_node'
+            else:
+                raise ValueError("Expected ',' or '}' in JSON node object")
+        elif state == 'end_node':
+            yield EXIT, None
+            stack.pop()
+            if not stack:
+                break
+            token, value = next(tokens)
+            if token == ',':
+                token, value = next(tokens)
+                state = 'node'
+            elif token == ']':
+                state = 'end_list'
+            else:
+                raise ValueError("Expected ',' or ']' in JSON children list")
+        else:  # end_list
+            stack.pop()
+            if not stack:
+                break
+            state = 'after_member'
+    if next(tokens)[0] is not None:
+        raise ValueError('Unexpected data after the JSON document')
+
+
+def parse_indented_text(lines):
+    """Yield tree events from lines indented with spaces or tabs.
+
+    A line is a child of the nearest line above it with less indentation.
+    Blank lines are skipped.
+    """
+    indents = []
+    for line in lines:
+        name = line.rstrip('\r\n')
+        stripped = name.lstrip(' \t')
+        if not stripped.strip():
+            continue
+        indent = len(name) - len(stripped)
+        while indents and indents[-1] >= indent:
+            indents.pop()
+            yield EXIT, None
+        indents.append(indent)
+        yield ENTER, stripped.rstrip()
+    for _ in indents:
+        yield EXIT, None
+
+
+def parse_adjacency_csv(lines):
+    """Yield tree events from CSV rows with id, parent_id and name columns.
+
+    Rows must be in depth-first order, as export_trees writes them: every row
+    comes after its parent and after the parent's earlier descendants. An
+    empty parent_id starts a new tree.
+    """
+    reader = csv.DictReader(lines)
+    missing = {'id', 'parent_id', 'name'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError('CSV is missing columns: ' + ', '.join(sorted(missing)))
+    path = []
+    for row in reader:
+        parent_id = row['parent_id'] or None
+        if parent_id is None:
+            for _ in path:
+                yield EXIT, None
+            path = []
+        else:
+            while path and path[-1] != parent_id:
+                path.pop()
+                yield EXIT, None
+            if not path:
+                raise ValueError(
+                    f'CSV line {reader.line_num}: parent {parent_id} is not an ancestor of the '
+                    'previous row; rows must be in depth-first order'
+                )
+        path.append(row['id'])
+        yield ENTER, row['name']
+    for _ in path:
+        yield EXIT, None
+
+
+PARSERS = {
+    'json': parse_nested_json,
+    'csv': parse_adjacency_csv,
+    'text': parse_indented_text,
+}
+
+
+def import_trees(conn, fp, fmt='json', gap=0, chunk_rows=CHUNK_ROWS, owner_id=None):
+    """Load every tree in the text stream fp as trees of owner_id and return their tree ids.
+
+    Each tree is appended after the owner's existing ones. Node ids are assigned in
+    preorder. With gap > 0 the lft/rgt values are gap apart. The caller owns
+    the transaction.
+    """
+    step = gap if gap > 0 else 1
+    next_id = conn.execute('SELECT IFNULL(MAX(id), 0) + 1 FROM tree').fetchone()[0]
+    tree_ids = []
+    rows = []
+    stack = []  # [id, name, lft, level, id_path] for the path to the current node
+    point = 0
+    for event, value in PARSERS[fmt](fp):
+        if event == ENTER:
+            if not stack:
+                cursor = conn.execute(
+                    'INSERT INTO trees (sort_key, gap, owner_id) '
+                    'SELECT IFNULL(MAX(sort_key), 0) + 1024, ?1, ?2 FROM trees WHERE owner_id IS ?2',
+                    (gap, owner_id)
+                )
+                tree_ids.append(cursor.lastrowid)
+                point = 0
+            id_path = f'{stack[-1][4]}.{next_id}' if stack else str(next_id)
+            stack.append([next_id, value, 1 + point * step, len(stack), id_path])
+            next_id += 1
+            point += 1
+        elif event == NAME:
+            stack[-1][1] = value
+        else:
+            node_id, name, lft, level, id_path = stack.pop()
+            if name is None:
+                raise ValueError(f'Node {node_id} has no name')
+            rows.append((node_id, tree_ids[-1], name, lft, 1 + point * step, level, id_path))
+            point += 1
+            if len(rows) >= chunk_rows:
+                insert_rows(conn, rows)
+                rows = []
+    insert_rows(conn, rows)
+    # One journal entry per tree so that open clients show the new roots
+    conn.executemany(
+        "INSERT INTO journal_node_operation (kind, node_id) "
+        "SELECT 'insert', id FROM tree WHERE tree_id = ? AND level = 0",
+        [(tree_id,) for tree_id in tree_ids]
+    )
+    return tree_ids
+
+
+def insert_rows(conn, rows):
+    # The tree_fts triggers flush the full-text index at the end of every
+    # statement, so a chunk is staged in a temp table and copied by one
+    # INSERT instead of one INSERT per row
+    conn.execute(
+        'CREATE TEMP TABLE IF NOT EXISTS tree_import '
+        '(id INTEGER PRIMARY KEY, tree_id, name, lft, rgt, level, id_path)'
+    )
+    conn.executemany('INSERT INTO temp.tree_import VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.execute(
+        'INSERT INTO tree (id, tree_id, name, lft, rgt, level, id_path) '
+        'SELECT id, tree_id, name, lft, rgt, level, id_path FROM temp.tree_import ORDER BY id'
+    )
+    conn.execute('DELETE FROM temp.tree_import')
+
+
+# Export
+
+def export_rows(conn, tree_id=None, owner_id=None):
+    """Cursor over (id, tree_id, name, lft, rgt, level) in display order.
+
+    With an owner_id only that owner's trees are read; a tree_id of another
+    owner yields no rows.
+    """
+    where = []
+    params = []
+    if tree_id is not None:
+        where.append('tree.tree_id = ?')
+        params.append(tree_id)
+    if owner_id is not None:
+        where.append('trees.owner_id = ?')
+        params.append(owner_id)
+    return conn.execute(f'''
+        SELECT tree.id, tree.tree_id, name, lft, rgt, level
+        FROM trees JOIN tree ON tree.tree_id = trees.tree_id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY trees.sort_key, tree.lft
+    ''', params)
+
+
+def _chunked(parts):
+    """Join small strings into chunks of about CHUNK_CHARS characters"""
+    buf = []
+    size = 0
+    for part in parts:
+        buf.append(part)
+        size += len(part)
+        if size >= CHUNK_CHARS:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def _nested_json_parts(rows):
+    yield '['
+    stack = []  # [rgt, whether the children list has been opened]
+    tree_id = None
+    first = True
+    for node_id, row_tree_id, name, lft, rgt, level in rows:
+        if row_tree_id != tree_id:
+            tree_id = row_tree_id
+            boundary = None
+        else:
+            boundary = lft
+        while stack and (boundary is None or stack[-1][0] < boundary):
+            yield ']}' if stack.pop()[1] else '}'
+            first = False
+        if stack and not stack[-1][1]:
+            yield ', "children": ['
+            stack[-1][1] = True
+            first = True
+        if not first:
+            yield ', '
+        yield '{"name": ' + json.dumps(name, ensure_ascii=False)
+        stack.append([rgt, False])
+        first = True
+    while stack:
+        yield ']}' if stack.pop()[1] else '}'
+    yield ']\n'
+
+
+def _csv_parts(rows):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(('id', 'parent_id', 'name'))
+    yield out.getvalue()
+    out.seek(0)
+    out.truncate()
+    stack = []  # (rgt, id) for the path to the current node
+    tree_id = None
+    for node_id, row_tree_id, name, lft, rgt, level in rows:
+        if row_tree_id != tree_id:
+            tree_id = row_tree_id
+            stack = []
+        while stack and stack[-1][0] < lft:
+            stack.pop()
+        writer.writerow((node_id, stack[-1][1] if stack else '', name))
+        stack.append((rgt, node_id))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+def _indented_text_parts(rows):
+    for node_id, tree_id, name, lft, rgt, level in rows:
+        yield INDENT * level + name + '\n'
+
+
+WRITERS = {
+    'json': _nested_json_parts,
+    'csv': _csv_parts,
+    'text': _indented_text_parts,
+}
+
+
+def export_trees(conn, fmt='json', tree_id=None, owner_id=None):
+    """Yield one tree (or all trees, of one owner or of everyone) as text chunks in the given format"""
+    return _chunked(WRITERS[fmt](export_rows(conn, tree_id, owner_id)))
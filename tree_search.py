@@ -0,0 +1,68 @@
+"""Ranked full-text search of node names through the tree_fts index.
+
+The query text is split into words; every word must occur in the name, and
+the last one may be a prefix (the user is still typing it). Words are
+quoted, so FTS5 operators in the text match literally instead of raising
+syntax errors. Results are ordered by bm25 rank, then id, and carry the
+names and ids of their ancestors, read from tree.id_path.
+"""
+import re
+
+# Words shorter than this are only matched as whole words: a one-letter
+# prefix would match a large part of any big tree
+MIN_PREFIX_LENGTH = 2
+
+
+def fts_query(text):
+    """FTS5 MATCH expression for text, or None if it has no words"""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ['"' + word + '"' for word in words]
+    if len(words[-1]) >= MIN_PREFIX_LENGTH and not text[-1:].isspace():
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_nodes(conn, text, owner_id, offset=0, limit=50, rank_limit=10000):
+    """One page of the owner's nodes matching text, best first, each with its ancestor path.
+
+    Ranking costs time for every match, so only the first rank_limit
+    matches (by id) of the owner's are ranked; a query that matches more
+    than that is too broad for its order to matter much, and the page still
+    comes back fast. The index holds every owner's names, so matches in
+    other owners' trees still cost one tree and one trees lookup each.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+    nodes = [dict(row) for row in conn.execute('''
+        SELECT tree.id, tree.tree_id, tree.name, tree.lft, tree.rgt, tree.level, tree.id_path
+        FROM (
+            -- Rank and cut the page inside FTS5 before reading any tree rows
+            SELECT rowid, rank FROM (
+                SELECT tree_fts.rowid, tree_fts.rank
+                FROM tree_fts
+                CROSS JOIN tree ON tree.id = tree_fts.rowid
+                CROSS JOIN trees ON trees.tree_id = tree.tree_id
+                WHERE tree_fts MATCH ? AND trees.owner_id = ?
+                LIMIT ?
+            )
+            ORDER BY rank, rowid
+            LIMIT ? OFFSET ?
+        ) AS hit
+        JOIN tree ON tree.id = hit.rowid
+        ORDER BY hit.rank, hit.rowid
+    ''', (query, owner_id, rank_limit, limit, offset))]
+
+    # One lookup for the ancestors of the whole page
+    ancestor_ids = {int(i) for node in nodes for i in node['id_path'].split('.')[:-1]}
+    names = dict(conn.execute(
+        'SELECT id, name FROM tree WHERE id IN (SELECT value FROM json_each(?))',
+        ('[' + ','.join(map(str, ancestor_ids)) + ']',)
+    ).fetchall()) if ancestor_ids else {}
+    for node in nodes:
+        node['path'] = [
+            {'id': int(i), 'name': names.get(int(i))} for i in node.pop('id_path').split('.')[:-1]
+        ]
+    return nodes
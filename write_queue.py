@@ -0,0 +1,112 @@
+"""One writer thread per process that applies queued writes in groups.
+
+With WRITE_QUEUE on, request threads do not open write transactions
+themselves: submit() queues a function and waits. The writer takes
+everything queued so far (up to WRITE_QUEUE_BATCH), runs each function in
+arrival order inside its own SAVEPOINT of one BEGIN IMMEDIATE transaction,
+commits once and then hands every caller its own result or exception. A
+function that raises has only its own changes rolled back. Writes that
+arrive while a group commits form the next group, so the busier the app,
+the more writes share a transaction, and threads of one process never
+wait on each other's busy timeout.
+
+Several app processes still take turns at the write lock, one group at a
+time. Results are only returned after the commit, so a caller can read its
+own write on any connection.
+"""
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+
+import db
+
+
+class WriteQueue:
+    def __init__(self, config):
+        self.config = config
+        self.pending = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.groups = 0
+        self.writes = 0
+
+    def submit(self, work):
+        """Run work(conn) in the writer's transaction and return what it returns.
+
+        Raises what work raised, or what BEGIN or COMMIT raised for the whole
+        group. After WRITE_QUEUE_TIMEOUT seconds a write that has not started
+        is dropped and TimeoutError is raised.
+        """
+        self.start()
+        future = Future()
+        self.pending.put((work, future))
+        try:
+            return future.result(self.config['WRITE_QUEUE_TIMEOUT'])
+        except TimeoutError:
+            if future.cancel():
+                raise TimeoutError('The write queue is too busy; the operation was not applied')
+            # Already running: wait for its outcome rather than report a write as lost
+            return future.result()
+
+    def take_group(self):
+        """Block for the first queued write, then take what else is already queued"""
+        group = [self.pending.get()]
+        while len(group) < self.config['WRITE_QUEUE_BATCH']:
+            try:
+                group.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        # Timed-out callers have cancelled theirs
+        return [(work, future) for work, future in group if future.set_running_or_notify_cancel()]
+
+    def apply_group(self, conn, group):
+        outcomes = []  # (result, exception) per write
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for work, future in group:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    outcomes.append((work(conn), None))
+                    conn.execute('RELEASE queued_write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    conn.execute('RELEASE queued_write')
+                    outcomes.append((None, e))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future in group:
+                future.set_exception(e)
+            return
+        self.groups += 1
+        self.writes += len(group)
+        for (_, future), (result, exception) in zip(group, outcomes):
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
+
+    def run(self):
+        conn = db.get_connection(self.config)
+        while True:
+            group = self.take_group()
+            if group:
+                self.apply_group(conn, group)
+
+    def start(self):
+        """Start this process's writer thread unless it is running"""
+        if self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            # Threads do not survive a fork, so each worker process starts its own
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='write-queue', daemon=True)
+                self.thread.start()
+
+    def stats(self):
+        return {
+            'groups': self.groups,
+            'writes': self.writes,
+            'queued': self.pending.qsize(),
+        }